@@ -0,0 +1,76 @@
+"""
+Times calendar_reader's sync against a multi-year calendar: the first import, an unchanged rerun, a forced rerun and a rerun with a few changed days.
+The first import is compared with the previous approach of one execute() per task.
+Usage: python Benchmarks/calendar_sync.py [--years N]
+"""
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import argparse
+import asyncio
+import datetime
+import shutil
+import sqlite3
+import tempfile
+import time
+from calendar_reader import build_tasks, sync_calendar, migrate_calendar
+
+parser = argparse.ArgumentParser(description="Benchmarks the incremental calendar sync.")
+parser.add_argument("--years", type=int, default=5, help="Number of school years in the synthetic calendar.")
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "Static", "calendar.template_db")
+
+def synthetic_dates(years: int) -> dict:
+    dates = {'regular': [], 'delayed': [], 'early_dismissal': [], 'student_early_dismissal': []}
+    day = datetime.date(2026, 9, 1)
+    while day < datetime.date(2026 + years, 9, 1):
+        if day.weekday() < 5 and day.month not in (7, 8):
+            kind = 'delayed' if day.day == 15 else 'early_dismissal' if day.day == 28 else 'regular'
+            dates[kind].append(day.isoformat())
+        day += datetime.timedelta(days=1)
+    return dates
+
+def new_database(directory: str, name: str) -> str:
+    path = os.path.join(directory, name)
+    shutil.copy(TEMPLATE_PATH, path)
+    asyncio.run(migrate_calendar(path))
+    return path
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1000
+
+def main(args: dict):
+    dates = synthetic_dates(args['years'])
+    tasks = build_tasks(dates)
+    with tempfile.TemporaryDirectory() as directory:
+        # Previous approach: one execute() per task, into an empty database
+        db = sqlite3.connect(new_database(directory, "per_row.db"))
+        now = datetime.datetime.now().timestamp()
+        def per_row():
+            for ts, action in tasks.items():
+                db.execute("INSERT INTO CALENDAR (ACTION, COMPLETED, CREATION_TIMESTAMP, SCHEDULED_TIMESTAMP) VALUES (?,?,?,?)", (action, 0, now, ts))
+            db.commit()
+        print(f"{len(tasks)} tasks over {args['years']} years")
+        print(f"  per-row inserts:     {timed(per_row):8.2f} ms")
+        db.close()
+
+        db = sqlite3.connect(new_database(directory, "sync.db"))
+        print(f"  first sync:          {timed(lambda: sync_calendar(db, 'default', tasks)):8.2f} ms")
+        print(f"  unchanged rerun:     {timed(lambda: sync_calendar(db, 'default', tasks)):8.2f} ms (skipped by content hash)")
+        print(f"  forced rerun:        {timed(lambda: sync_calendar(db, 'default', tasks, force=True)):8.2f} ms (full diff, nothing to write)")
+
+        # Ten regular days become delayed openings, and the last week is dropped
+        changed = {k: list(v) for k, v in dates.items()}
+        changed['delayed'] += changed['regular'][100:110]
+        del changed['regular'][100:110]
+        changed['regular'] = changed['regular'][:-5]
+        changed_tasks = build_tasks(changed)
+        result = []
+        elapsed = timed(lambda: result.append(sync_calendar(db, 'default', changed_tasks)))
+        print(f"  rerun with changes:  {elapsed:8.2f} ms ({result[0][0]} added, {result[0][1]} changed, {result[0][2]} removed)")
+        db.close()
+
+if __name__ == "__main__":
+    main(vars(parser.parse_args()))
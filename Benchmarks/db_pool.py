@@ -0,0 +1,73 @@
+"""
+Compares per-query latency of opening a new aiosqlite connection for every query (the old connect_db() behaviour) against the shared connection pool.
+Usage: python Benchmarks/db_pool.py [--guilds N] [--queries N]
+"""
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import argparse
+import asyncio
+import shutil
+import tempfile
+import time
+import random
+import aiosqlite
+from database import DatabasePool
+
+parser = argparse.ArgumentParser(description="Benchmarks the main.db connection pool against connect-per-query.")
+parser.add_argument("--guilds", type=int, default=500, help="Number of guild rows to seed.")
+parser.add_argument("--queries", type=int, default=2000, help="Number of settings lookups to time.")
+
+QUERY = "SELECT TARGET_ROLES FROM GUILD_SETTINGS WHERE GUILD_ID=?"
+
+def seed(path: str, guilds: int) -> list:
+    import sqlite3
+    ids = [10 ** 17 + i for i in range(guilds)]
+    with sqlite3.connect(path) as db:
+        db.executemany("INSERT INTO GUILD_SETTINGS (GUILD_ID, TARGET_ROLES) VALUES (?, ?)", [(i, f"{i},{i + 1}") for i in ids])
+        db.executemany("INSERT INTO STATE_INFO (GUILD_ID) VALUES (?)", [(i,) for i in ids])
+    return ids
+
+async def connect_per_query(path: str, ids: list, queries: int) -> float:
+    start = time.perf_counter()
+    for _ in range(queries):
+        db = await aiosqlite.connect(path)
+        try:
+            await (await db.execute(QUERY, (random.choice(ids),))).fetchone()
+        finally:
+            await db.close()
+    return time.perf_counter() - start
+
+async def pooled(path: str, ids: list, queries: int) -> float:
+    pool = DatabasePool(path)
+    await pool.open()
+    try:
+        start = time.perf_counter()
+        for _ in range(queries):
+            db = await pool.acquire()
+            try:
+                await (await db.execute(QUERY, (random.choice(ids),))).fetchone()
+            finally:
+                await db.close()
+        return time.perf_counter() - start
+    finally:
+        await pool.close()
+
+async def main(args: dict):
+    root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "main.db")
+        shutil.copy(os.path.join(root, "Static", "main.template_db"), path)
+        ids = seed(path, args['guilds'])
+
+        results = {
+            "connect-per-query": await connect_per_query(path, ids, args['queries']),
+            "pooled": await pooled(path, ids, args['queries'])
+        }
+
+    for name, total in results.items():
+        print(f"{name:>18}: {total * 1000 / args['queries']:.3f} ms/query ({total:.2f}s total)")
+    print(f"{'speedup':>18}: {results['connect-per-query'] / results['pooled']:.1f}x")
+
+if __name__ == "__main__":
+    asyncio.run(main(vars(parser.parse_args())))
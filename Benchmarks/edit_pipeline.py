@@ -0,0 +1,90 @@
+"""
+Compares locking down a synthetic guild with different numbers of edits in flight (Lockdown.edit_concurrency), 1 being the old one-edit-at-a-time behaviour.
+Requests go through the request scheduler to a local stand-in for the API that answers after a fixed latency and reports per-route bucket headers,
+so the wall time can be set against the least time the global limit allows for the same calls. Also checks that every concurrency gives the same report.
+Usage: python Benchmarks/edit_pipeline.py [--channels 300] [--latency 0.1] [--concurrency 1,2,4,8,16] [--global-limit 50]
+"""
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+import argparse
+import asyncio
+import json
+import time
+import discord
+from lockdown import plan_lockdown, execute_lockdown_plan
+from ratelimit import RequestScheduler, route_key
+from synthetic import build_guild, install_recorder
+
+parser = argparse.ArgumentParser(description="Benchmarks pipelined channel and role edits on a synthetic guild.")
+parser.add_argument("--channels", type=int, default=300, help="Channels in the guild.")
+parser.add_argument("--roles", type=int, default=20, help="Roles in the guild.")
+parser.add_argument("--targets", type=int, default=3, help="Roles locked down; role edits share one bucket, so many of them take at least a bucket window each per --bucket-limit.")
+parser.add_argument("--overwrites", type=int, default=4, help="Role overwrites per channel.")
+parser.add_argument("--latency", type=float, default=0.1, help="Round trip time of a request in seconds.")
+parser.add_argument("--concurrency", type=str, default="1,2,4,8,16", help="Comma-separated numbers of edits in flight.")
+parser.add_argument("--global-limit", type=int, default=50, help="Requests allowed per second across all routes.")
+parser.add_argument("--bucket-limit", type=int, default=5, help="Requests allowed per route per bucket window.")
+parser.add_argument("--bucket-window", type=float, default=5.0, help="Length of a bucket window in seconds.")
+
+class FakeBuckets:
+    """
+    Hands the scheduler the rate limit headers Discord would send with each response, from fixed windows per route.
+    """
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self.windows = {}
+
+    def headers(self, key: str) -> dict:
+        now = time.monotonic()
+        start, used = self.windows.get(key, (now, 0))
+        if now - start >= self.window:
+            start, used = now, 0
+        self.windows[key] = (start, used + 1)
+        return {'X-RateLimit-Limit': str(self.limit), 'X-RateLimit-Remaining': str(max(0, self.limit - used - 1)), 'X-RateLimit-Reset-After': str(start + self.window - now)}
+
+def empty_report() -> dict:
+    return {'affected_channels': {}, 'affected_roles': [], 'no_perms_channels': [], 'no_perms_roles': [], 'meta': {}}
+
+async def run(concurrency: int, args: dict) -> tuple:
+    client = discord.Client(intents=discord.Intents.none())
+    guild = build_guild(client._connection, 10 ** 17, channels=args['channels'], categories=max(1, args['channels'] // 20), roles=args['roles'], overwrites=args['overwrites'], seed=0)
+    recorder = install_recorder(client, latency=args['latency'])
+    buckets = FakeBuckets(args['bucket_limit'], args['bucket_window'])
+    scheduler = RequestScheduler(global_limit=args['global_limit'])
+    send = client.http.request
+
+    async def respond(route, **kwargs):
+        result = await send(route, **kwargs)
+        key = route_key(route.method, route.url)
+        scheduler.observe(key, 200, buckets.headers(key))
+        return result
+
+    client.http.request = respond
+    scheduler.install(client.http)
+
+    report = empty_report()
+    plan = plan_lockdown(guild, guild.roles[1:1 + args['targets']], [], [], False)
+    start = time.perf_counter()
+    await execute_lockdown_plan(plan, report, concurrency=concurrency)
+    elapsed = time.perf_counter() - start
+    await client.close()
+    return elapsed, len(recorder.calls), report
+
+async def main(args: dict):
+    reference = None
+    for concurrency in (int(x) for x in args['concurrency'].split(",")):
+        elapsed, calls, report = await run(concurrency, args)
+        # The global limit's window is a second long, and the first window is free
+        budget = max(0, calls - args['global_limit']) / args['global_limit']
+        print(f"{args['channels']:>5} channels, {concurrency:>3} in flight: {elapsed:7.2f}s for {calls} calls ({calls / elapsed:6.1f}/s; the global limit allows it in {budget:.2f}s)")
+        if reference == None:
+            reference = json.dumps(report)
+        elif json.dumps(report) != reference:
+            print("    the report differs from the first run's")
+
+if __name__ == "__main__":
+    asyncio.run(main(vars(parser.parse_args())))
@@ -0,0 +1,131 @@
+"""
+Compares the memory and startup cost of the 'full' and 'lean' gateway modes (Bot.gateway_mode), per 1,000 guilds.
+Each mode runs in a fresh process, which builds the bot with utils.getGatewayOptions() and feeds it synthetic GUILD_CREATE payloads as the gateway would.
+In 'full' mode the payloads carry every member and their presences (what chunking would deliver afterwards) and message events fill the message cache;
+'lean' mode receives neither. Startup time is the time spent processing the payloads, and memory is the growth in resident set size (the peak outside Linux; not available on Windows).
+Usage: python Benchmarks/gateway_memory.py [--guilds 1000] [--members 200] [--channels 50] [--messages 1000]
+"""
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+import argparse
+import asyncio
+import gc
+import json
+import shutil
+import subprocess
+import tempfile
+import time
+import discord
+import utils
+from synthetic import guild_payload
+
+# The first member of every guild is the bot itself
+BOT_USER_ID = 10 ** 17 - 1
+
+parser = argparse.ArgumentParser(description="Benchmarks the memory and startup time of the gateway modes.")
+parser.add_argument("--guilds", type=int, default=1000, help="Number of guilds.")
+parser.add_argument("--members", type=int, default=200, help="Members per guild.")
+parser.add_argument("--channels", type=int, default=50, help="Channels per guild.")
+parser.add_argument("--messages", type=int, default=1000, help="Message events received in 'full' mode.")
+parser.add_argument("--mode", type=str, default=None, choices=("full", "lean"), help=argparse.SUPPRESS)
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except FileNotFoundError:
+        # Peak rather than current, but never lower
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def member_payloads(guild_id: int, count: int) -> tuple:
+    members = []
+    presences = []
+    for i in range(count):
+        user = {'id': str(BOT_USER_ID if i == 0 else guild_id + 10 ** 6 + i), 'username': f"user-{i}", 'discriminator': "0", 'avatar': None, 'global_name': None}
+        members.append({'user': user, 'roles': [str(guild_id + 1 + i % 5)], 'joined_at': "2022-01-01T00:00:00+00:00", 'deaf': False, 'mute': False})
+        if i % 3 == 0:
+            presences.append({'user': {'id': user['id']}, 'status': "online", 'activities': [], 'client_status': {'desktop': "online"}})
+    return members, presences
+
+def message_payload(guild_id: int, channel_id: int, message_id: int) -> dict:
+    return {
+        'id': str(message_id), 'channel_id': str(channel_id), 'guild_id': str(guild_id), 'content': "x" * 80, 'type': 0, 'tts': False,
+        'author': {'id': str(guild_id + 10 ** 6), 'username': "user-0", 'discriminator': "0", 'avatar': None},
+        'timestamp': "2022-01-01T00:00:00+00:00", 'edited_timestamp': None, 'mention_everyone': False, 'mentions': [],
+        'mention_roles': [], 'attachments': [], 'embeds': [], 'pinned': False
+    }
+
+async def run_mode(args: dict) -> dict:
+    config = utils.getConfig('Static/config.template_yaml', 'Config/config.yaml')
+    config['Bot']['gateway_mode'] = args['mode']
+    options = utils.getGatewayOptions(config)
+    full = args['mode'] == "full"
+    # Payloads are made up front, so only what the bot keeps of them is measured
+    guild_ids = [10 ** 17 + i * 10 ** 7 for i in range(args['guilds'])]
+    payloads = []
+    for guild_id in guild_ids:
+        data = guild_payload(guild_id, channels=args['channels'], categories=max(1, args['channels'] // 10), roles=10)
+        data['member_count'] = args['members']
+        # The bot's own member is always sent
+        data['members'], data['presences'] = member_payloads(guild_id, args['members'] if full else 1)
+        if not full:
+            data['presences'] = []
+        payloads.append(data)
+    messages = [message_payload(guild_ids[i % len(guild_ids)], guild_ids[i % len(guild_ids)] + 100000 + max(1, args['channels'] // 10), 10 ** 18 + i) for i in range(args['messages'])] if full else []
+
+    bot = utils.CurfewBot(config, **options)
+    state = bot._connection
+    state.user = discord.ClientUser(state=state, data={'id': str(BOT_USER_ID), 'username': "CurfewBot", 'discriminator': "0", 'avatar': None})
+    # Chunking would request the members over the gateway; they are in the payloads instead
+    state._chunk_guilds = False
+    gc.collect()
+    before = rss_bytes()
+    start = time.perf_counter()
+    for data in payloads:
+        state.parse_guild_create(data)
+    for data in messages:
+        state.parse_message_create(data)
+    # Let the dispatched events run
+    await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    payloads.clear()
+    messages.clear()
+    gc.collect()
+    result = {
+        'mode': args['mode'], 'guilds': len(bot.guilds), 'members_cached': sum(len(g._members) for g in bot.guilds), 'messages_cached': len(bot.cached_messages),
+        'rss_bytes': rss_bytes() - before, 'startup_seconds': elapsed
+    }
+    await bot.http.close()
+    return result
+
+def main(args: dict):
+    if args['mode'] != None:
+        # Run in an empty directory, so the bot's databases are made there
+        root = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            shutil.copytree(os.path.join(root, "Static"), "Static")
+            os.makedirs("Config")
+            try:
+                print(json.dumps(asyncio.run(run_mode(args))))
+            finally:
+                os.chdir(root)
+        return
+
+    results = []
+    for mode in ("full", "lean"):
+        command = [sys.executable, os.path.realpath(__file__), "--mode", mode] + [x for k in ('guilds', 'members', 'channels', 'messages') for x in (f"--{k}", str(args[k]))]
+        results.append(json.loads(subprocess.run(command, check=True, capture_output=True, text=True).stdout.strip().splitlines()[-1]))
+
+    per = 1000 / max(1, args['guilds'])
+    for x in results:
+        print(f"{x['mode']:>4}: {x['rss_bytes'] * per / 2 ** 20:8.1f} MiB RSS and {x['startup_seconds'] * per:6.2f}s startup per 1,000 guilds ({x['members_cached']} members and {x['messages_cached']} messages cached in {x['guilds']} guilds)")
+    full, lean = results
+    if lean['rss_bytes'] > 0 and lean['startup_seconds'] > 0:
+        print(f"lean uses {full['rss_bytes'] / lean['rss_bytes']:.1f}x less memory and starts {full['startup_seconds'] / lean['startup_seconds']:.1f}x faster")
+
+if __name__ == "__main__":
+    main(vars(parser.parse_args()))
@@ -0,0 +1,74 @@
+"""
+Times the side-effect-free lockdown planner on synthetic guilds of increasing size, and keeping a staged plan up to date as channels change
+(LockdownPlan.update_channels(), which the scheduler calls on channel events) against planning the whole guild again. Staged plans are checked against new ones.
+Usage: python Benchmarks/lockdown_planner.py [--sizes 100,1000,5000] [--repeat N] [--events N]
+"""
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+import argparse
+import asyncio
+import random
+import time
+import discord
+from lockdown import plan_lockdown
+from synthetic import build_guild
+
+parser = argparse.ArgumentParser(description="Benchmarks lockdown planning on synthetic guilds.")
+parser.add_argument("--sizes", type=str, default="100,1000,5000", help="Comma-separated channel counts.")
+parser.add_argument("--repeat", type=int, default=5, help="Number of plans timed per size.")
+parser.add_argument("--events", type=int, default=200, help="Channel changes applied to each staged plan.")
+
+def change_channel(guild: discord.Guild, rng: random.Random) -> int:
+    """
+    Makes a random change to a channel, as a channel event would: new overwrites (sometimes copied from its category), moved to another category, or deleted.
+    Returns the ID of the changed channel.
+    """
+    channel = rng.choice(guild.channels)
+    kind = rng.random()
+    if kind < 0.1 and channel.type != discord.ChannelType.category:
+        guild._remove_channel(channel)
+    elif kind < 0.3 and channel.type != discord.ChannelType.category:
+        channel.category_id = rng.choice(guild.categories).id
+    elif kind < 0.6 and channel.category != None:
+        channel._overwrites = list(channel.category._overwrites)
+    else:
+        role = rng.choice(guild.roles)
+        overwrites = [x for x in channel._overwrites if x.id != role.id]
+        state = rng.choice((None, True, False))
+        if state != None:
+            value = discord.Permissions(view_channel=True).value
+            overwrites.append(discord.abc._Overwrites({'id': role.id, 'type': 0, 'allow': value if state else 0, 'deny': 0 if state else value}))
+        channel._overwrites = overwrites
+    return channel.id
+
+def normalized(plan) -> tuple:
+    plan = plan.to_dict()
+    return plan['channel_edits'], plan['role_edits']
+
+async def main(args: dict):
+    client = discord.Client(intents=discord.Intents.none())
+    for i, size in enumerate(int(x) for x in args['sizes'].split(",")):
+        guild = build_guild(client._connection, 10 ** 17 * (i + 1), channels=size, categories=max(1, size // 20), roles=50, overwrites=4)
+        target_roles = guild.roles[1:6]
+        timings = []
+        for _ in range(args['repeat']):
+            start = time.perf_counter()
+            plan = plan_lockdown(guild, target_roles, [], [], False)
+            timings.append(time.perf_counter() - start)
+        print(f"{size:>6} channels: {min(timings) * 1000:8.2f} ms/plan, {plan.estimated_calls} calls")
+
+        rng = random.Random(size)
+        update_seconds = 0.0
+        for _ in range(args['events']):
+            channel_id = change_channel(guild, rng)
+            start = time.perf_counter()
+            plan.update_channels([channel_id])
+            update_seconds += time.perf_counter() - start
+        assert normalized(plan) == normalized(plan_lockdown(guild, target_roles, [], [], False)), "the staged plan differs from a new one"
+        print(f"{size:>6} channels: {update_seconds / max(1, args['events']) * 1000:8.3f} ms/channel event to keep a staged plan current, {args['events']} events")
+    await client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main(vars(parser.parse_args())))
@@ -0,0 +1,205 @@
+"""
+Runs CurfewBot.server_lockdown() and server_reopen() against synthetic guilds of increasing size, and the calendar scheduler's batch (what calendar_poll runs when a task is due) against increasing numbers of guilds.
+API requests are recorded locally instead of being sent, and applied to the cached guild. Each run reports wall time, API calls, request payload bytes, peak memory and time spent in SQLite.
+SQLite time is summed over every connection, so it can exceed the wall time when guilds are processed concurrently.
+Results can be saved as JSON and compared with a previous run, exiting with status 1 if anything regressed.
+Usage: python Benchmarks/lockdown_suite.py [--channels 10,100,1000,5000] [--guilds 1,10,100,1000] [--output results.json] [--baseline old.json]
+"""
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+import discord
+import utils
+from synthetic import build_guild, install_recorder, install_db_timer
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+parser = argparse.ArgumentParser(description="Benchmarks lockdowns and reopens on synthetic guilds.")
+parser.add_argument("--channels", type=str, default="10,100,1000,5000", help="Comma-separated channel counts of the single-guild runs.")
+parser.add_argument("--guilds", type=str, default="1,10,100,1000", help="Comma-separated guild counts of the calendar batch runs.")
+parser.add_argument("--guild-channels", type=int, default=50, help="Channels per guild in the calendar batch runs.")
+parser.add_argument("--roles", type=int, default=50, help="Roles per guild.")
+parser.add_argument("--overwrites", type=int, default=4, help="Role overwrites per channel.")
+parser.add_argument("--repeat", type=int, default=3, help="Number of timed lockdown and reopen cycles; the fastest of each is kept.")
+parser.add_argument("--no-memory", action="store_true", help="Skip the second, traced run of each benchmark that measures peak memory.")
+parser.add_argument("--output", type=str, default=None, help="Path to save the results to as JSON.")
+parser.add_argument("--baseline", type=str, default=None, help="Path of earlier JSON results to compare with.")
+parser.add_argument("--tolerance", type=float, default=0.5, help="Relative increase over the baseline's times and memory that counts as a regression. API calls and payload bytes are deterministic and must not increase at all.")
+
+# Metrics compared with the baseline, and whether they are deterministic
+METRICS = {'wall_ms': False, 'db_ms': False, 'peak_memory_bytes': False, 'api_calls': True, 'payload_bytes': True}
+
+def build_guilds(bot: utils.CurfewBot, count: int, channels: int, args: dict) -> list:
+    return [build_guild(bot._connection, 10 ** 17 + i * 10 ** 7, channels=channels, categories=max(1, channels // 20), roles=args['roles'], overwrites=args['overwrites'], seed=i) for i in range(count)]
+
+async def new_bot() -> utils.CurfewBot:
+    # Run in an empty directory, so the databases start out empty and the real ones are never touched
+    config = utils.getConfig('Static/config.template_yaml', 'Config/config.yaml')
+    bot = utils.CurfewBot(config, command_prefix='!', intents=discord.Intents.none())
+    await bot.db_pool.open()
+    await bot.calendar_pool.open()
+    await bot.load_guild_settings()
+    return bot
+
+async def close_bot(bot: utils.CurfewBot):
+    await bot.db_pool.close()
+    await bot.calendar_pool.close()
+    await bot.http.close()
+
+async def measure(func, recorder, timer, traced: bool) -> dict:
+    recorder.reset()
+    timer.reset()
+    if traced:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        await func()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if traced else None
+    finally:
+        if traced:
+            tracemalloc.stop()
+    # The recorder's cache updates stand in for gateway events, which are not part of the operation
+    return {'wall_ms': (elapsed - recorder.apply_seconds) * 1000, 'db_ms': timer.seconds * 1000, 'db_calls': timer.calls, 'api_calls': len(recorder.calls), 'payload_bytes': recorder.payload_bytes, 'peak_memory_bytes': peak}
+
+async def run_cycle(parameters: dict, steps: list, recorder, timer, args: dict) -> list:
+    """
+    Runs a lockdown and reopen cycle of (benchmark name, coroutine function) steps, keeping the fastest times of each step.
+    Reopening does not always restore a guild exactly, so the API calls and payload bytes are those of the first cycle, which are deterministic.
+    Then runs it again under tracemalloc for the peak memory of each step, which slows it down too much to time it then.
+    """
+    results = [None] * len(steps)
+    for _ in range(max(1, args['repeat'])):
+        for i, (name, func) in enumerate(steps):
+            result = {'benchmark': name, **parameters, **(await measure(func, recorder, timer, False))}
+            if results[i] == None:
+                results[i] = result
+            for metric in ('wall_ms', 'db_ms'):
+                results[i][metric] = min(results[i][metric], result[metric])
+    if not args['no_memory']:
+        for result, (name, func) in zip(results, steps):
+            result['peak_memory_bytes'] = (await measure(func, recorder, timer, True))['peak_memory_bytes']
+    for result in results:
+        memory = f", {result['peak_memory_bytes'] / 2 ** 20:7.1f} MiB peak" if result['peak_memory_bytes'] != None else ""
+        print(f"{result['benchmark']:>17} {result['channels']:>5} channels {result['guilds']:>5} guilds: {result['wall_ms']:9.1f} ms, {result['db_ms']:8.1f} ms in SQLite, {result['api_calls']:>7} calls, {result['payload_bytes'] / 1024:9.1f} KiB sent{memory}")
+    return results
+
+async def bench_channels(args: dict, timer) -> list:
+    results = []
+    for channels in (int(x) for x in args['channels'].split(",")):
+        bot = await new_bot()
+        try:
+            recorder = install_recorder(bot, apply=True)
+            guild = build_guilds(bot, 1, channels, args)[0]
+            await bot.update_guilds()
+            target_roles = guild.roles[:3]
+            reports = []
+
+            async def lockdown():
+                reports.append(await bot.server_lockdown(guild, target_roles, [], [], False))
+
+            async def reopen():
+                await bot.server_reopen(guild, reports[-1])
+
+            results.extend(await run_cycle({'channels': channels, 'guilds': 1}, [('server_lockdown', lockdown), ('server_reopen', reopen)], recorder, timer, args))
+        finally:
+            await close_bot(bot)
+    return results
+
+async def bench_guilds(args: dict, timer) -> list:
+    results = []
+    for count in (int(x) for x in args['guilds'].split(",")):
+        bot = await new_bot()
+        try:
+            recorder = install_recorder(bot, apply=True)
+            guilds = build_guilds(bot, count, args['guild_channels'], args)
+            await bot.update_guilds()
+            db = await bot.connect_db()
+            try:
+                await db.executemany("UPDATE GUILD_SETTINGS SET USE_CALENDAR=1, TARGET_ROLES=? WHERE GUILD_ID=?", [(",".join(str(r.id) for r in g.roles[:3]), g.id) for g in guilds])
+                await db.commit()
+            finally:
+                await db.close()
+            await bot.load_guild_settings()
+
+            bot.load_extension('Cogs.AutoLockdown.autolockdown')
+            cog = bot.get_cog('Automatic Lockdown System')
+            # Tasks are performed directly rather than waiting for the poll loop to find them due
+            cog.calendar_poll.cancel()
+
+            now = datetime.datetime.now().timestamp()
+            steps = [('calendar_lockdown', lambda: cog.perform_calendar_task('LOCKDOWN', now)), ('calendar_reopen', lambda: cog.perform_calendar_task('REOPEN', now))]
+            results.extend(await run_cycle({'channels': args['guild_channels'], 'guilds': count}, steps, recorder, timer, args))
+            bot.unload_extension('Cogs.AutoLockdown.autolockdown')
+        finally:
+            await close_bot(bot)
+    return results
+
+def compare(results: list, baseline: dict, tolerance: float) -> list:
+    """
+    Returns a description of every metric that regressed from the baseline's result of the same benchmark and size.
+    """
+    def key(x: dict) -> tuple:
+        return (x['benchmark'], x['channels'], x['guilds'])
+
+    previous = {key(x): x for x in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old == None:
+            continue
+        for metric, deterministic in METRICS.items():
+            if result.get(metric) == None or old.get(metric) == None:
+                continue
+            limit = old[metric] if deterministic else old[metric] * (1 + tolerance)
+            if result[metric] > limit:
+                regressions.append(f"{result['benchmark']} ({result['channels']} channels, {result['guilds']} guilds): {metric} {old[metric]:.1f} -> {result[metric]:.1f}")
+    return regressions
+
+async def main(args: dict) -> int:
+    # The benchmarked code logs every guild it touches
+    logging.disable(logging.WARNING)
+    timer = install_db_timer()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        shutil.copytree(os.path.join(ROOT_PATH, "Static"), "Static")
+        os.makedirs("Config")
+        os.makedirs("Database")
+        try:
+            results = await bench_channels(args, timer) + await bench_guilds(args, timer)
+        finally:
+            timer.uninstall()
+            os.chdir(ROOT_PATH)
+
+    output = {
+        'meta': {'timestamp': datetime.datetime.now().timestamp(), 'python': platform.python_version(), 'py-cord': discord.__version__, 'platform': platform.platform(), 'arguments': args},
+        'results': results
+    }
+    if args['output'] != None:
+        with open(args['output'], "w") as f:
+            json.dump(output, f, indent=2)
+        print(f"Saved results to {args['output']}.")
+
+    if args['baseline'] != None:
+        with open(args['baseline'], "r") as f:
+            regressions = compare(results, json.load(f), args['tolerance'])
+        for x in regressions:
+            print(f"Regression: {x}")
+        if len(regressions) > 0:
+            return 1
+        print("No regressions from the baseline.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(vars(parser.parse_args()))))
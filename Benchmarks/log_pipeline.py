@@ -0,0 +1,84 @@
+"""
+Compares how long logging calls hold up the event loop when the disk stalls, writing to the log file directly (the old logging.FileHandler)
+against the queue-backed pipeline of logpipeline.start_logging(). Every write to the file is slowed down by --stall seconds, every --stall-every records,
+while a task logs a lockdown's worth of records; the time the task spends inside the logging calls is what a lockdown would be delayed by.
+Usage: python Benchmarks/log_pipeline.py [--records 2000] [--stall 0.05] [--stall-every 100] [--format text]
+"""
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+import logpipeline
+
+parser = argparse.ArgumentParser(description="Benchmarks logging calls while the disk stalls.")
+parser.add_argument("--records", type=int, default=2000, help="Records logged.")
+parser.add_argument("--stall", type=float, default=0.05, help="Seconds a stalled write takes.")
+parser.add_argument("--stall-every", type=int, default=100, help="Every this many writes stall.")
+parser.add_argument("--format", type=str, default="text", choices=("text", "json"), help="Format of the log file.")
+
+def stall_writes(handler: logging.Handler, stall: float, every: int):
+    # Slows down the handler's file writes as a busy or failing disk would
+    emit = handler.emit
+    count = [0]
+
+    def stalled(record: logging.LogRecord):
+        count[0] += 1
+        if count[0] % every == 0:
+            time.sleep(stall)
+        emit(record)
+
+    handler.emit = stalled
+
+async def log_records(count: int) -> tuple:
+    logger = logging.getLogger('bot')
+    token = logpipeline.set_log_fields(guild_id=10 ** 17, action='lockdown', operation_id=1)
+    worst = 0.0
+    start = time.perf_counter()
+    for i in range(count):
+        before = time.perf_counter()
+        logger.info(f"Locked channel {10 ** 17 + i} of guild {10 ** 17} (3 overwrites).")
+        worst = max(worst, time.perf_counter() - before)
+        if i % 50 == 0:
+            # Lets other tasks run, as the edits between log records would
+            await asyncio.sleep(0)
+    logpipeline.LOG_FIELDS.reset(token)
+    return time.perf_counter() - start, worst
+
+def run(args: dict, queued: bool, directory: str) -> tuple:
+    path = os.path.join(directory, f"{'queued' if queued else 'direct'}.log")
+    root = logging.getLogger()
+    if queued:
+        listener = logpipeline.start_logging(logging.INFO, '%Y-%m-%d %H:%M:%S', stdout=False, file_path=path, file_format=args['format'])
+        stall_writes(listener.handlers[0], args['stall'], args['stall_every'])
+    else:
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        handler = logging.FileHandler(path)
+        handler.setFormatter(logpipeline.JsonLinesFormatter() if args['format'] == "json" else logging.Formatter(logpipeline.TEXT_FORMAT))
+        stall_writes(handler, args['stall'], args['stall_every'])
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+    elapsed, worst = asyncio.run(log_records(args['records']))
+    start = time.perf_counter()
+    if queued:
+        listener.stop()
+    drained = time.perf_counter() - start
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    with open(path, 'r') as f:
+        written = sum(1 for _ in f)
+    return elapsed, worst, drained, written
+
+def main(args: dict):
+    with tempfile.TemporaryDirectory() as directory:
+        for queued in (False, True):
+            elapsed, worst, drained, written = run(args, queued, directory)
+            print(f"{'queued' if queued else 'direct':>6}: {elapsed:7.3f}s in logging calls for {args['records']} records (slowest call {worst * 1000:7.2f} ms), {written} written; {drained:.3f}s left to write on exit")
+
+if __name__ == "__main__":
+    main(vars(parser.parse_args()))
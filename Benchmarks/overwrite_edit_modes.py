@@ -0,0 +1,36 @@
+"""
+Compares the API calls and request payload bytes of locking down synthetic guilds with each channel edit mode.
+Usage: python Benchmarks/overwrite_edit_modes.py [--sizes 100,1000,5000] [--overwrites N]
+"""
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+import argparse
+import asyncio
+import discord
+from lockdown import EDIT_MODES, plan_lockdown, execute_lockdown_plan
+from synthetic import build_guild, install_recorder
+
+parser = argparse.ArgumentParser(description="Benchmarks channel edit modes on synthetic guilds.")
+parser.add_argument("--sizes", type=str, default="100,1000,5000", help="Comma-separated channel counts.")
+parser.add_argument("--overwrites", type=int, default=8, help="Role overwrites per channel.")
+
+def empty_report() -> dict:
+    return {'affected_channels': {}, 'affected_roles': [], 'no_perms_channels': [], 'no_perms_roles': [], 'meta': {}}
+
+async def main(args: dict):
+    client = discord.Client(intents=discord.Intents.none())
+    recorder = install_recorder(client)
+    for i, size in enumerate(int(x) for x in args['sizes'].split(",")):
+        guild = build_guild(client._connection, 10 ** 17 * (i + 1), channels=size, categories=max(1, size // 20), roles=50, overwrites=args['overwrites'])
+        # Ignoring neutral overwrites and targeting few roles leaves many channels with a single change, where the modes differ the most
+        for mode in EDIT_MODES:
+            recorder.reset()
+            plan = plan_lockdown(guild, guild.roles[1:3], [], [], True)
+            await execute_lockdown_plan(plan, empty_report(), edit_mode=mode)
+            print(f"{size:>6} channels, {mode:>13}: {len(recorder.calls):>6} calls, {recorder.payload_bytes / 1024:9.1f} KiB sent")
+    await client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main(vars(parser.parse_args())))
@@ -0,0 +1,110 @@
+"""
+Runs the request scheduler against a local fake Discord API that enforces per-route buckets, emits rate limit headers and answers 429 when a bucket is overrun.
+Compares it with sending the same requests unpaced (retrying blindly after each 429).
+Usage: python Benchmarks/ratelimit_fake_api.py [--channels N] [--edits N] [--limit N] [--window SECONDS] [--global-limit N]
+"""
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import argparse
+import logging
+import asyncio
+import time
+import aiohttp
+from aiohttp import web
+from ratelimit import RequestScheduler, route_key
+
+parser = argparse.ArgumentParser(description="Benchmarks the rate-limit-aware request scheduler against a fake API.")
+parser.add_argument("--channels", type=int, default=20, help="Number of distinct channel routes.")
+parser.add_argument("--edits", type=int, default=10, help="Edits sent to each channel.")
+parser.add_argument("--limit", type=int, default=5, help="Requests allowed per bucket per window.")
+parser.add_argument("--window", type=float, default=0.5, help="Length of a bucket window in seconds.")
+parser.add_argument("--global-limit", type=int, default=50, help="Requests allowed per second across all routes.")
+
+class FakeAPI:
+    """
+    Fixed-window rate limiter keyed the same way Discord keys its buckets.
+    """
+
+    def __init__(self, limit: int, window: float, global_limit: int):
+        self.limit = limit
+        self.window = window
+        self.global_limit = global_limit
+        self.global_sends = []
+        self.buckets = {}
+        self.hits = 0
+        self.rejections = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        key = route_key(request.method, str(request.url))
+        now = time.monotonic()
+
+        self.global_sends = [t for t in self.global_sends if t > now - 1]
+        if len(self.global_sends) >= self.global_limit:
+            self.rejections += 1
+            retry_after = self.global_sends[0] + 1 - now
+            return web.json_response({'message': 'You are being rate limited.', 'retry_after': retry_after, 'global': True}, status=429, headers={'Retry-After': f"{retry_after:.3f}", 'X-RateLimit-Global': 'true', 'X-RateLimit-Scope': 'global'})
+        self.global_sends.append(now)
+
+        start, used = self.buckets.get(key, (now, 0))
+        if now - start >= self.window:
+            start, used = now, 0
+        reset_after = self.window - (now - start)
+        headers = {
+            'X-RateLimit-Limit': str(self.limit),
+            'X-RateLimit-Bucket': key,
+            'X-RateLimit-Reset-After': f"{reset_after:.3f}"
+        }
+        if used >= self.limit:
+            self.rejections += 1
+            headers.update({'X-RateLimit-Remaining': '0', 'Retry-After': f"{reset_after:.3f}", 'X-RateLimit-Scope': 'user'})
+            return web.json_response({'message': 'You are being rate limited.', 'retry_after': reset_after, 'global': False}, status=429, headers=headers)
+
+        self.buckets[key] = (start, used + 1)
+        self.hits += 1
+        headers['X-RateLimit-Remaining'] = str(self.limit - used - 1)
+        # Simulate a round trip
+        await asyncio.sleep(0.01)
+        return web.json_response({}, headers=headers)
+
+async def unpaced(session: aiohttp.ClientSession, url: str) -> None:
+    while True:
+        async with session.patch(url, json={}) as response:
+            if response.status != 429:
+                return
+            await asyncio.sleep(float(response.headers['Retry-After']))
+
+async def run(args: dict, use_scheduler: bool) -> dict:
+    api = FakeAPI(args['limit'], args['window'], args['global_limit'])
+    app = web.Application()
+    app.router.add_route('*', '/{tail:.*}', api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    urls = [f"http://127.0.0.1:{port}/api/v10/channels/{10 ** 17 + c}" for c in range(args['channels']) for _ in range(args['edits'])]
+    scheduler = RequestScheduler()
+    try:
+        async with aiohttp.ClientSession() as session:
+            start = time.perf_counter()
+            if use_scheduler:
+                await asyncio.gather(*[scheduler.request(session, 'PATCH', url, json={}) for url in urls])
+            else:
+                await asyncio.gather(*[unpaced(session, url) for url in urls])
+            elapsed = time.perf_counter() - start
+    finally:
+        await runner.cleanup()
+
+    ideal = max(((args['edits'] - 1) // args['limit']) * args['window'], float((len(urls) - 1) // args['global_limit']))
+    return {'elapsed': elapsed, 'requests': len(urls), 'accepted': api.hits, '429s': api.rejections, 'ideal': ideal}
+
+async def main(args: dict):
+    for name, use_scheduler in (("unpaced", False), ("scheduler", True)):
+        r = await run(args, use_scheduler)
+        print(f"{name:>10}: {r['requests']} edits in {r['elapsed']:.2f}s (bucket floor ~{r['ideal']:.2f}s), {r['429s']} 429 responses")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(main(vars(parser.parse_args())))
@@ -0,0 +1,76 @@
+"""
+Compares how long the event loop is blocked serializing a large lockdown report for its attachments: the old three json.dumps() calls on the loop against one cached encoding made in a worker thread.
+Also prints the attachment sizes, plain and gzip-compressed.
+Usage: python Benchmarks/report_serialization.py [--sizes 1000,5000,20000] [--roles N]
+"""
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import argparse
+import asyncio
+import json
+import random
+import time
+import reports
+from reports import Report
+
+parser = argparse.ArgumentParser(description="Benchmarks lockdown report serialization.")
+parser.add_argument("--sizes", type=str, default="1000,5000,20000", help="Comma-separated numbers of affected channels.")
+parser.add_argument("--roles", type=int, default=4, help="Affected roles per channel.")
+
+def synthetic_report(channels: int, roles: int) -> Report:
+    rng = random.Random(channels)
+    base = 10 ** 17
+    return Report({
+        'affected_channels': {str(base + i): [(base + rng.randrange(10 ** 6), rng.choice((-1, 0, 1))) for _ in range(roles)] for i in range(channels)},
+        'affected_roles': [base + i for i in range(roles)],
+        'no_perms_channels': [],
+        'no_perms_roles': [],
+        'meta': {'provided': {'auto': True}, 'timestamp': time.time(), 'guild_id': base}
+    })
+
+async def blocked(func) -> float:
+    """
+    The longest the event loop went without running a ticker task while `func` ran, in milliseconds.
+    """
+    longest = 0.0
+    running = True
+
+    async def ticker():
+        nonlocal longest
+        last = time.perf_counter()
+        while running:
+            await asyncio.sleep(0)
+            now = time.perf_counter()
+            longest = max(longest, now - last)
+            last = now
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    await func()
+    running = False
+    await task
+    return longest * 1000
+
+async def main(args: dict):
+    for size in (int(x) for x in args['sizes'].split(",")):
+        report = synthetic_report(size, args['roles'])
+
+        async def old():
+            # Admin reply, log message and the STATE_INFO blob each encoded the report again
+            for _ in range(3):
+                json.dumps(report).encode('utf8')
+
+        async def new():
+            for _ in range(3):
+                await reports.serialize(report)
+
+        old_ms = await blocked(old)
+        new_ms = await blocked(new)
+        plain = len(json.dumps(report).encode('utf8'))
+        compact = len(await reports.serialize(report))
+        compressed = len(await reports.serialize_compressed(report))
+        print(f"{size:>6} channels: loop blocked {old_ms:8.2f} ms before, {new_ms:6.2f} ms now; {plain / 1024:8.1f} KiB before, {compact / 1024:8.1f} KiB compact, {compressed / 1024:7.1f} KiB gzipped")
+
+if __name__ == "__main__":
+    asyncio.run(main(vars(parser.parse_args())))
@@ -0,0 +1,121 @@
+"""
+Compares validating an uploaded lockdown report with the old schema path (the `schema` library and per-field validators that required 18-digit IDs) against reports.validate_lockdown_report().
+Reports use 19-digit IDs, which the old path rejects, so it is timed on a copy with 18-digit ones; both are parsed from gzip-compressed uploads.
+Times are given for parsing and validating the upload, and for validating alone, since parsing the JSON is most of the work. Also prints the peak memory of parsing and validating, and where the new validator locates a few broken reports.
+Needs the `schema` library, which is only in requirements-dev.txt.
+Usage: python Benchmarks/report_validation.py [--sizes 1000,5000,20000] [--roles N] [--repeat N]
+"""
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import argparse
+import gzip
+import json
+import random
+import time
+import tracemalloc
+from schema import Schema, And
+import reports
+
+parser = argparse.ArgumentParser(description="Benchmarks lockdown report validation.")
+parser.add_argument("--sizes", type=str, default="1000,5000,20000", help="Comma-separated numbers of affected channels.")
+parser.add_argument("--roles", type=int, default=4, help="Affected roles per channel.")
+parser.add_argument("--repeat", type=int, default=5, help="Number of timed runs; the fastest is kept.")
+
+# The schema /reopen used before
+def affected_channels_validator(d: dict) -> bool:
+    return isinstance(d, dict) and all(isinstance(x, str) and x.isnumeric() and len(x) == 18 for x in d.keys()) and all(isinstance(x, list) and all(isinstance(y, list) and len(y) == 2 and isinstance(y[0], int) and isinstance(y[1], int) and len(str(y[0])) == 18 and y[1] in range(-1, 2) for y in x) for x in d.values())
+
+def id_list_validator(d: dict) -> bool:
+    return isinstance(d, list) and all(isinstance(x, int) and len(str(x)) == 18 for x in d)
+
+OLD_SCHEMA = Schema({
+    "affected_channels": And(affected_channels_validator, dict),
+    "affected_roles": And(id_list_validator, list),
+    "no_perms_channels": And(id_list_validator, list),
+    "no_perms_roles": And(id_list_validator, list),
+    "meta": dict
+})
+
+def synthetic_report(channels: int, roles: int, base: int) -> dict:
+    rng = random.Random(channels)
+    return {
+        'affected_channels': {str(base + i): [[base + rng.randrange(10 ** 6), rng.choice((-1, 0, 1))] for _ in range(roles)] for i in range(channels)},
+        'affected_roles': [base + i for i in range(roles)],
+        'no_perms_channels': [base + i for i in range(channels // 50)],
+        'no_perms_roles': [],
+        'meta': {'provided': {'auto': True}, 'timestamp': time.time(), 'guild_id': base}
+    }
+
+def old_path(data: bytes) -> bool:
+    return OLD_SCHEMA.is_valid(json.loads(gzip.decompress(data)))
+
+def new_path(data: bytes) -> bool:
+    reports.decode_lockdown_report(data, max_size=16384 * 1024)
+    return True
+
+def validate(report: dict) -> bool:
+    reports.validate_lockdown_report(report)
+    return True
+
+def fastest(func, data, repeat: int) -> float:
+    best = None
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        assert func(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+    return best * 1000
+
+def peak_memory(func, data: bytes) -> int:
+    tracemalloc.start()
+    try:
+        func(data)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def broken_reports(size: int) -> list:
+    report = synthetic_report(size, 4, 10 ** 18)
+    channel_id = str(10 ** 18 + size // 2)
+    cases = []
+    x = json.loads(json.dumps(report))
+    x['affected_channels'][channel_id][2][1] = 2
+    cases.append(("previous state out of range", x))
+    x = json.loads(json.dumps(report))
+    x['affected_channels'][channel_id][1][0] = True
+    cases.append(("boolean role ID", x))
+    x = json.loads(json.dumps(report))
+    x['no_perms_channels'][4] = 12345
+    cases.append(("short channel ID", x))
+    x = json.loads(json.dumps(report))
+    del x['meta']
+    cases.append(("missing meta", x))
+    return cases
+
+def main(args: dict):
+    for size in (int(x) for x in args['sizes'].split(",")):
+        # 18-digit IDs for the old schema, 19-digit IDs (guilds and channels made since 2022) for the new validator
+        old_data = gzip.compress(json.dumps(synthetic_report(size, args['roles'], 10 ** 17)).encode("utf8"))
+        new_data = gzip.compress(json.dumps(synthetic_report(size, args['roles'], 10 ** 18)).encode("utf8"))
+        assert not OLD_SCHEMA.is_valid(json.loads(gzip.decompress(new_data)))
+
+        old_ms = fastest(old_path, old_data, args['repeat'])
+        new_ms = fastest(new_path, new_data, args['repeat'])
+        old_validate_ms = fastest(OLD_SCHEMA.is_valid, json.loads(gzip.decompress(old_data)), args['repeat'])
+        new_validate_ms = fastest(validate, json.loads(gzip.decompress(new_data)), args['repeat'])
+        old_peak = peak_memory(old_path, old_data)
+        new_peak = peak_memory(new_path, new_data)
+        print(f"{size:>6} channels, {len(new_data) / 1024:8.1f} KiB upload:")
+        print(f"    schema:      {old_ms:8.1f} ms ({old_validate_ms:7.1f} ms validating), {old_peak / 2 ** 20:6.1f} MiB peak")
+        print(f"    single pass: {new_ms:8.1f} ms ({new_validate_ms:7.1f} ms validating), {new_peak / 2 ** 20:6.1f} MiB peak")
+
+    for name, report in broken_reports(1000):
+        try:
+            reports.validate_lockdown_report(report)
+            print(f"{name}: not detected")
+        except reports.ReportError as e:
+            print(f"{name}: {e}")
+
+if __name__ == "__main__":
+    main(vars(parser.parse_args()))
@@ -0,0 +1,163 @@
+"""
+Builds real discord.Guild objects from synthetic gateway payloads and measures the API requests and database time spent on them, for benchmarking without a connection to Discord.
+"""
+import asyncio
+import random
+import time
+import aiosqlite
+import discord
+from typing import Optional
+
+VIEW_CHANNEL = discord.Permissions(view_channel=True).value
+DEFAULT_PERMISSIONS = discord.Permissions.general().value | discord.Permissions.text().value
+
+def guild_payload(guild_id: int, channels: int = 100, categories: int = 10, roles: int = 20, overwrites: int = 3, synced_ratio: float = 0.5, seed: Optional[int] = None) -> dict:
+    """
+    Returns a GUILD_CREATE-style payload. `overwrites` role overwrites are put on each channel; roughly `synced_ratio` of the channels copy their category's overwrites exactly.
+    """
+    rng = random.Random(guild_id if seed == None else seed)
+    role_ids = [guild_id] + [guild_id + i for i in range(1, roles + 1)]
+    role_payloads = [{
+        'id': str(r), 'name': '@everyone' if r == guild_id else f"role-{r - guild_id}", 'permissions': str(DEFAULT_PERMISSIONS),
+        'position': r - guild_id, 'color': 0, 'hoist': False, 'managed': False, 'mentionable': False
+    } for r in role_ids]
+
+    def random_overwrites() -> list:
+        result = []
+        for r in rng.sample(role_ids, min(overwrites, len(role_ids))):
+            state = rng.choice((True, None, False))
+            result.append({'id': str(r), 'type': 0, 'allow': str(VIEW_CHANNEL if state == True else 0), 'deny': str(VIEW_CHANNEL if state == False else 0)})
+        return result
+
+    next_id = guild_id + 100000
+    channel_payloads = []
+    category_payloads = []
+    for i in range(categories):
+        category_payloads.append({'id': str(next_id), 'type': 4, 'name': f"category-{i}", 'position': i, 'permission_overwrites': random_overwrites()})
+        next_id += 1
+    channel_payloads.extend(category_payloads)
+
+    for i in range(max(0, channels - categories)):
+        category = rng.choice(category_payloads) if len(category_payloads) > 0 else None
+        synced = category != None and rng.random() < synced_ratio
+        channel_payloads.append({
+            'id': str(next_id), 'type': 0, 'name': f"channel-{i}", 'position': i,
+            'parent_id': category['id'] if category != None else None,
+            'permission_overwrites': [dict(x) for x in category['permission_overwrites']] if synced else random_overwrites()
+        })
+        next_id += 1
+
+    return {
+        'id': str(guild_id), 'name': f"guild-{guild_id}", 'roles': role_payloads, 'channels': channel_payloads,
+        'member_count': 1, 'owner_id': '1', 'emojis': [], 'stickers': [], 'features': []
+    }
+
+def build_guild(state, guild_id: int, **kwargs) -> discord.Guild:
+    """
+    Builds a guild from guild_payload() and registers it with the connection state, so it is reachable through bot.get_guild().
+    """
+    guild = discord.Guild(data=guild_payload(guild_id, **kwargs), state=state)
+    state._add_guild(guild)
+    return guild
+
+class RequestRecorder:
+    """
+    Stands in for HTTPClient.request: records each request's route and JSON payload size instead of sending it.
+    Given a client, overwrite and role edits are also applied to its cache, as the gateway events following them would, so that a reopen sees the guild as the lockdown left it.
+    """
+
+    def __init__(self, latency: float = 0.0, client: Optional[discord.Client] = None):
+        self.latency = latency
+        self.client = client
+        self.calls = []
+        # Time spent applying edits to the cache, which real requests would not cost
+        self.apply_seconds = 0.0
+
+    async def __call__(self, route, **kwargs):
+        payload = kwargs.get('json')
+        size = len(discord.utils._to_json(payload)) if payload != None else 0
+        self.calls.append((route.method, route.path, size))
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        if self.client != None:
+            start = time.perf_counter()
+            self.apply(route, payload)
+            self.apply_seconds += time.perf_counter() - start
+        if route.path == '/guilds/{guild_id}/roles/{role_id}':
+            # Role.edit() builds a new Role from the response
+            return {
+                'id': route.url.rsplit('/', 1)[1], 'name': 'role', 'permissions': (payload or {}).get('permissions', '0'),
+                'position': 1, 'color': 0, 'hoist': False, 'managed': False, 'mentionable': False
+            }
+        return None
+
+    def apply(self, route, payload: Optional[dict]):
+        parts = route.url.split('/')
+        if route.path == '/channels/{channel_id}' and payload != None and 'permission_overwrites' in payload:
+            # Discord does not pass a category's overwrites on to the channels synced to it, so neither does this
+            self.client.get_channel(int(parts[-1]))._fill_overwrites({'permission_overwrites': payload['permission_overwrites']})
+        elif route.path in ('/channels/{channel_id}/permissions/{overwrite_id}', '/channels/{channel_id}/permissions/{target}'):
+            # The second is what py-cord 2.x sends
+            channel = self.client.get_channel(int(parts[-3]))
+            overwrite_id = int(parts[-1])
+            overwrites = [{'id': str(x.id), 'type': x.type, 'allow': str(x.allow), 'deny': str(x.deny)} for x in channel._overwrites if x.id != overwrite_id]
+            if route.method == 'PUT':
+                overwrites.append({'id': str(overwrite_id), 'type': payload.get('type', 0), 'allow': payload['allow'], 'deny': payload['deny']})
+            channel._fill_overwrites({'permission_overwrites': overwrites})
+        elif route.path == '/guilds/{guild_id}/roles/{role_id}' and payload != None and 'permissions' in payload:
+            role = self.client.get_guild(int(parts[-3])).get_role(int(parts[-1]))
+            role._permissions = int(payload['permissions'])
+
+    @property
+    def payload_bytes(self) -> int:
+        return sum(x[2] for x in self.calls)
+
+    def reset(self):
+        self.calls = []
+        self.apply_seconds = 0.0
+
+def install_recorder(client: discord.Client, latency: float = 0.0, apply: bool = False) -> RequestRecorder:
+    recorder = RequestRecorder(latency, client=client if apply else None)
+    client.http.request = recorder
+    return recorder
+
+class DatabaseTimer:
+    """
+    Wraps aiosqlite's queueing of work to its connection threads, adding up the time spent running each call in SQLite.
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self._original = None
+
+    def install(self):
+        self._original = aiosqlite.Connection._execute
+        timer = self
+        original = self._original
+
+        async def _execute(conn, fn, *args, **kwargs):
+            def timed():
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    timer.seconds += time.perf_counter() - start
+                    timer.calls += 1
+            return await original(conn, timed)
+
+        aiosqlite.Connection._execute = _execute
+
+    def uninstall(self):
+        if self._original != None:
+            aiosqlite.Connection._execute = self._original
+            self._original = None
+
+    def reset(self):
+        self.seconds = 0.0
+        self.calls = 0
+
+def install_db_timer() -> DatabaseTimer:
+    timer = DatabaseTimer()
+    timer.install()
+    return timer
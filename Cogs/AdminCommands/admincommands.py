@@ -5,13 +5,13 @@ import discord
 from discord.ext import commands
 from discord.commands.context import ApplicationContext
 import utils
+import reports
 import logging
 import aiosqlite
 from typing import Coroutine, Any, Union, Callable
 from io import BytesIO
 import json
 import traceback
-from schema import SchemaError
 
 logger = logging.getLogger('cog-admincommands')
 
@@ -27,15 +27,23 @@ class AdminCommandsCog(commands.Cog, name=NAME, description=DESCRIPTION):
 
         @commands.has_guild_permissions(administrator=True)
         @self.bot.slash_command(name="lockdown", description="Locks down the server and returns the report file.")
-        async def lockdown_command(ctx: ApplicationContext):
+        async def lockdown_command(ctx: ApplicationContext, dry_run: discord.Option(bool, "Only show what a lockdown would change, without changing anything.", name="dry-run", default=False)):
             await ctx.defer()
+            if dry_run:
+                plan = await ctx.bot.plan_guild_lockdown(ctx.guild)
+                await ctx.respond(
+                    f"{ctx.bot.getPlaceholder('info')} A lockdown would edit **{len(plan.channel_edits)}** channels and **{len(plan.role_edits)}** roles, for an estimated **{plan.estimate_calls(ctx.bot.lockdown_config('edit_mode', 'auto'))}** API calls. Nothing has been changed.",
+                    file=discord.File(fp=BytesIO(json.dumps(plan.to_dict()).encode('utf8')), filename="plan.json")
+                )
+                return
+
             db = await ctx.bot.connect_db()
             try:
                 logger.info(f"User {ctx.author.id} is locking down guild {ctx.guild.id}.")
                 report = await ctx.bot.server_lockdown(ctx.guild, await ctx.bot.get_target_roles(ctx.guild, db=db), await ctx.bot.get_ignored_roles(ctx.guild, db=db), await ctx.bot.get_ignored_channel_ids(ctx.guild, db=db), await ctx.bot.get_ignore_overwrites_preference(ctx.guild, db=db), meta=get_meta(ctx), db=db)
             finally:
                 await db.close()
-            await ctx.respond("Successfully locked down the server.", file=discord.File(fp=BytesIO(json.dumps(report).encode('utf8')), filename="report.json"))
+            await ctx.respond("Successfully locked down the server.", file=await ctx.bot.report_file(report, "report.json"))
 
         @commands.has_guild_permissions(administrator=True)
         @self.bot.slash_command(name="reopen", description="Reopens the server and returns the report file.")
@@ -44,32 +52,33 @@ class AdminCommandsCog(commands.Cog, name=NAME, description=DESCRIPTION):
 
             if lockdown_report != None:
                 # Validate lockdown report
-                try:
-                    assert lockdown_report.filename.endswith(".json")
-                    assert lockdown_report.content_type == "application/json; charset=utf-8"
-                    try:
-                        input_json = json.loads(await lockdown_report.read())
-                    except ValueError:
-                        # JSON not readable
-                        assert False
-                    assert utils.LOCKDOWN_REPORT_SCHEMA.is_valid(input_json)
-                except (AssertionError, SchemaError):
+                # Large reports are attached gzip-compressed
+                if not (lockdown_report.filename.endswith(".json.gz") or (lockdown_report.filename.endswith(".json") and lockdown_report.content_type == "application/json; charset=utf-8")):
                     await ctx.respond(f"{ctx.bot.getPlaceholder('error')} Please make sure the file you uploaded is a valid lockdown report file. If this issue continues, contact the developer.")
                     return
+                max_size = int(ctx.bot.config.get('Reports', {}).get('max_upload_kib', 16384) * 1024)
+                try:
+                    if lockdown_report.size > max_size:
+                        # Not worth downloading
+                        raise reports.ReportError("$", f"the report is larger than {max_size // 1024} KiB")
+                    input_json = await reports.load_lockdown_report(await lockdown_report.read(), max_size=max_size)
+                except reports.ReportError as e:
+                    logger.info(f"User {ctx.author.id} uploaded an invalid lockdown report to guild {ctx.guild.id}: {e}")
+                    await ctx.respond(f"{ctx.bot.getPlaceholder('error')} Please make sure the file you uploaded is a valid lockdown report file (problem at `{e.path}`: {e.message}). If this issue continues, contact the developer.", allowed_mentions=discord.AllowedMentions.none())
+                    return
 
             logger.info(f"User {ctx.author.id} is reopening guild {ctx.guild.id}.")
             db = await ctx.bot.connect_db()
             try:
                 if lockdown_report == None:
-                    input_json = (await (await db.execute("SELECT LAST_LOCKDOWN_REPORT FROM STATE_INFO WHERE GUILD_ID=?", (ctx.guild.id,))).fetchone())[0]
+                    input_json = await ctx.bot.get_last_lockdown_report(ctx.guild, db=db)
                     if input_json == None:
                         await ctx.respond(f"{ctx.bot.getPlaceholder('error')} There doesn't seem to be an existing lockdown report in my records. Please upload one if you have one.")
                         return
-                    input_json = json.loads(input_json)
                 report = await ctx.bot.server_reopen(ctx.guild, input_json, db=db, meta=get_meta(ctx))
             finally:
                 await db.close()
-            await ctx.respond("Successfully reopened the server.", file=discord.File(fp=BytesIO(json.dumps(report).encode('utf8')), filename="report.json"))
+            await ctx.respond("Successfully reopened the server.", file=await ctx.bot.report_file(report, "report.json"))
 
 
 def setup(bot: utils.CurfewBot):
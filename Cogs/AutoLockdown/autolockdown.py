@@ -5,76 +5,354 @@ import discord
 from discord.ext import commands, tasks
 from discord.commands.context import ApplicationContext
 import utils
+import recurrence
+import metrics
 from utils import CALENDAR_PATH
+from lockdown import overwrite_signature
 import logging
 import aiosqlite
 import json
 import datetime
 import asyncio
+import heapq
+from typing import List, Optional, Set, Tuple
 
 logger = logging.getLogger('cog-autolockdown')
 
 NAME = "Automatic Lockdown System"
 DESCRIPTION = "Automatically locks down and reopens servers on a set schedule."
 
+# Seconds the scheduler waits before trying again after an iteration failed
+POLL_RETRY_DELAY = 10
+
+def guild_needs_action(action: str, guild_row: tuple) -> bool:
+    """
+    Whether a guild's STATE_INFO row (GUILD_ID, LAST_LOCKDOWN, LAST_REOPEN) calls for the given calendar action.
+    """
+    if action == 'LOCKDOWN':
+        # Check if server is already locked down
+        return guild_row[1] == None or (guild_row[2] != None and guild_row[1] <= guild_row[2])
+    elif action == 'REOPEN':
+        # Check if server is already opened (or was never locked down, so there is nothing to reopen)
+        return guild_row[1] != None and (guild_row[2] == None or guild_row[2] <= guild_row[1])
+    return False
+
 class AutoLockdownCog(commands.Cog, name=NAME, description=DESCRIPTION):
     def __init__(self, bot: utils.CurfewBot):
         self.bot = bot
+        self.last_batch_summary: Optional[dict] = None
+        # Min-heap of (SCHEDULED_TIMESTAMP, CALENDAR_GROUP, ACTION, TASK_ID) for the next uncompleted calendar tasks of all groups; None until first loaded
+        # Tasks from recurring schedules have no TASK_ID
+        self.due_tasks: Optional[List[Tuple[float, str, str, int]]] = None
+        # Shared by every calendar batch, so that groups due at the same time do not multiply the concurrency
+        self.guild_semaphore = asyncio.Semaphore(max(1, self.scheduler_config('guild_concurrency', 5)))
+        # Set to wake the scheduler early and reload the calendar
+        self.calendar_changed = asyncio.Event()
+        self.calendar_signature = None
+        # (CALENDAR_GROUP, SCHEDULED_TIMESTAMP) of the lockdown tasks whose guilds' plans have been staged
+        self.staged_tasks: Set[Tuple[str, float]] = set()
         self.calendar_poll.start()
 
-    @tasks.loop(seconds=600)
+    def scheduler_config(self, key: str, default):
+        return self.bot.config.get('Scheduler', {}).get(key, default)
+
+    def get_calendar_signature(self) -> tuple:
+        # Any write to calendar.db, including from calendar_reader.py in another process, changes the size or modification time of the database or its WAL file
+        signature = []
+        for path in (CALENDAR_PATH, CALENDAR_PATH + "-wal"):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    async def load_due_tasks(self):
+        now = datetime.datetime.now().timestamp()
+        cal = await self.bot.connect_calendar()
+        try:
+            # Tasks this cluster has performed stay pending until the other clusters have too
+            # Only the newest overdue task of each group is performed (e.g. after downtime), so the heap cannot fill up with stale ones
+            overdue = await cal.execute_fetchall(
+                "SELECT MAX(SCHEDULED_TIMESTAMP), CALENDAR_GROUP, ACTION, TASK_ID FROM CALENDAR WHERE COMPLETED=0 AND SCHEDULED_TIMESTAMP<=? AND TASK_ID NOT IN (SELECT TASK_ID FROM CLUSTER_TASKS WHERE CLUSTER_ID=?) GROUP BY CALENDAR_GROUP",
+                (now, self.bot.cluster_id)
+            )
+            for row in overdue:
+                await self.skip_calendar_tasks(cal, row[1], row[0])
+            rows = list(overdue) + list(await cal.execute_fetchall(
+                "SELECT SCHEDULED_TIMESTAMP, CALENDAR_GROUP, ACTION, TASK_ID FROM CALENDAR WHERE COMPLETED=0 AND SCHEDULED_TIMESTAMP>? AND TASK_ID NOT IN (SELECT TASK_ID FROM CLUSTER_TASKS WHERE CLUSTER_ID=?) ORDER BY SCHEDULED_TIMESTAMP LIMIT ?",
+                (now, self.bot.cluster_id, self.scheduler_config('heap_size', 64))
+            ))
+            schedules = await recurrence.load_schedules(cal, now, now + self.scheduler_config('schedule_lookahead_days', 120) * 86400, cluster_id=self.bot.cluster_id)
+        finally:
+            await cal.close()
+        due = {(r[1], r[0]): tuple(r) for r in rows}
+        for schedule in schedules.values():
+            # Only the next few tasks of each recurring schedule are worked out; the heap is reloaded after every performed task
+            for timestamp, action in schedule.next_tasks(now):
+                # A stored task at the same time takes precedence
+                due.setdefault((schedule.group, timestamp), (timestamp, schedule.group, action, None))
+        self.due_tasks = list(due.values())
+        heapq.heapify(self.due_tasks)
+        self.staged_tasks.intersection_update(due.keys())
+        self.calendar_signature = self.get_calendar_signature()
+        if len(self.due_tasks) > 0:
+            logger.debug(f"Next calendar task: {self.due_tasks[0][2]} for group '{self.due_tasks[0][1]}' at {datetime.datetime.fromtimestamp(self.due_tasks[0][0]).isoformat()}.")
+
+    @commands.Cog.listener()
+    async def on_calendar_update(self):
+        # Dispatched by the bot when a guild changes the calendar it follows; upcoming lockdowns are staged again for the guilds that are not yet
+        self.staged_tasks.clear()
+        self.calendar_changed.set()
+
+    @tasks.loop(seconds=0)
     async def calendar_poll(self):
-        # Get the oldest uncompleted scheduled task in the calendar whose SCHEDULED_TIMESTAMP is in the past
-        # Perform the task and update the calendar as needed
         await self.bot.wait_until_ready()
-        cal = await self.bot.connect_calendar()
-        db = await self.bot.connect_db()
         try:
-            action_info = await (await cal.execute("SELECT ACTION, SCHEDULED_TIMESTAMP FROM CALENDAR WHERE SCHEDULED_TIMESTAMP < ? AND COMPLETED=0 ORDER BY SCHEDULED_TIMESTAMP DESC LIMIT 1", (datetime.datetime.now().timestamp(),))).fetchone()
-            if action_info == None:
-                return
-            
-            report_meta = {'auto': True, 'scheduled_timestamp': action_info[1]}
-
-            # Perform actions on guilds with the least channels first, since they take the least time
-            guild_rows = sorted(await db.execute_fetchall("SELECT * FROM STATE_INFO WHERE GUILD_ID IN (SELECT GUILD_ID FROM GUILD_SETTINGS WHERE USE_CALENDAR=1)"), key=lambda r: len(self.bot.get_guild(r[0]).channels))
-            for guild_row in guild_rows:
-                guild = self.bot.get_guild(guild_row[0])
-                if guild == None:
+            await self.poll_calendar()
+        except Exception:
+            # This loop is the only scheduler, so an error must not stop it; the calendar is reloaded, so tasks that were not completed are tried again
+            logger.exception(f"Calendar scheduler iteration failed; retrying in {POLL_RETRY_DELAY}s.")
+            self.calendar_changed.set()
+            await asyncio.sleep(POLL_RETRY_DELAY)
+
+    async def poll_calendar(self):
+        # Each iteration sleeps until the next scheduled task is due, or until the calendar changes
+        if self.due_tasks == None or self.calendar_changed.is_set():
+            self.calendar_changed.clear()
+            await self.load_due_tasks()
+
+        now = datetime.datetime.now().timestamp()
+        if len(self.due_tasks) > 0 and self.due_tasks[0][0] <= now:
+            # Only the most recent overdue task of each group is performed; older ones are marked as completed
+            due = {}
+            while len(self.due_tasks) > 0 and self.due_tasks[0][0] <= now:
+                task = heapq.heappop(self.due_tasks)
+                due[task[1]] = task
+            results = await asyncio.gather(*[self.perform_calendar_task(x[2], x[0], group=x[1], task_id=x[3]) for x in due.values()], return_exceptions=True)
+            failed = 0
+            for task, result in zip(due.values(), results):
+                if isinstance(result, Exception):
+                    logger.error(f"{task[2]} task of group '{task[1]}' scheduled for {datetime.datetime.fromtimestamp(task[0]).isoformat()} failed; retrying in {POLL_RETRY_DELAY}s.", exc_info=result)
+                    heapq.heappush(self.due_tasks, task)
+                    failed += 1
+            if failed < len(due):
+                # Reload, so the performed groups' next recurring tasks are worked out
+                self.calendar_changed.set()
+            if failed > 0:
+                # Failed tasks stay due; waiting first keeps a persistent error from retrying them in a tight loop
+                await asyncio.sleep(POLL_RETRY_DELAY)
+            return
+
+        # Lockdowns coming up within the lead time have their plans made now, so that only the API calls are left when they are due
+        lead = self.scheduler_config('plan_lead_minutes', 15) * 60
+        wake_at = self.due_tasks[0][0] if len(self.due_tasks) > 0 else None
+        if lead > 0:
+            for task in sorted(self.due_tasks):
+                if task[2] != 'LOCKDOWN' or (task[1], task[0]) in self.staged_tasks:
                     continue
-                
-                if action_info[0] == 'LOCKDOWN':
-                    # Check if server is already locked down
-                    if guild_row[1] != None and (guild_row[2] == None or guild_row[1] > guild_row[2]):
-                        continue
-                    
-                    # Lock down server
-                    logger.info(f"Automatically locking down guild {guild_row[0]}.")
-                    await self.bot.server_lockdown(guild, await self.bot.get_target_roles(guild, db=db), await self.bot.get_ignored_roles(guild, db=db), await self.bot.get_ignored_channel_ids(guild, db=db), await self.bot.get_ignore_overwrites_preference(guild, db=db), meta=report_meta, db=db)
+                if task[0] - lead > now:
+                    wake_at = min(wake_at, task[0] - lead)
+                    break
+                self.staged_tasks.add((task[1], task[0]))
+                await self.stage_plans(task[1], task[0])
 
-                elif action_info[0] == 'REOPEN':
-                    # Check if server is already opened
-                    if guild_row[2] != None and (guild_row[1] == None or guild_row[2] > guild_row[1]):
-                        continue
+        check_interval = self.scheduler_config('calendar_check_interval', 60)
+        timeout = check_interval if wake_at == None else max(0, min(wake_at - now, check_interval))
+        try:
+            await asyncio.wait_for(self.calendar_changed.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            if self.get_calendar_signature() != self.calendar_signature:
+                self.calendar_changed.set()
 
-                    # Reopen server
-                    logger.info(f"Automatically reopening guild {guild_row[0]}.")
-                    await self.bot.server_reopen(guild, json.loads(guild_row[3]), meta=report_meta, db=db)
+    async def stage_plans(self, group: str, scheduled_timestamp: float):
+        """
+        Stages the lockdown plans of the guilds the group's lockdown at `scheduled_timestamp` will lock down.
+        """
+        start = datetime.datetime.now().timestamp()
+        db = await self.bot.connect_db()
+        try:
+            guild_rows = await db.execute_fetchall("SELECT GUILD_ID, LAST_LOCKDOWN, LAST_REOPEN FROM STATE_INFO WHERE GUILD_ID IN (SELECT GUILD_ID FROM GUILD_SETTINGS WHERE CALENDAR_GROUP=? AND USE_CALENDAR=1)", (group,))
+        finally:
+            await db.close()
 
-                await asyncio.sleep(2) # Delay to prevent ratelimiting
+        calls = 0
+        staged = 0
+        for guild_row in guild_rows:
+            guild = self.bot.get_guild(guild_row[0])
+            if guild == None or guild.id in self.bot.staged_plans or not guild_needs_action('LOCKDOWN', guild_row):
+                continue
+            try:
+                calls += (await self.bot.stage_lockdown_plan(guild)).estimated_calls
+                staged += 1
+            except Exception:
+                logger.exception(f"Could not stage the lockdown plan of guild {guild.id}; it will be planned when the lockdown is due.")
+            # Planning a guild takes a while for large ones, so other events are handled in between
+            await asyncio.sleep(0)
+        logger.info(f"Staged lockdown plans of {staged} guilds of group '{group}' ({calls} API calls) in {datetime.datetime.now().timestamp() - start:.2f}s, {scheduled_timestamp - start:.0f}s before the lockdown.")
 
-            # Update status of action in calendar
-            logger.info(f"{action_info[0]} task scheduled for {datetime.datetime.fromtimestamp(action_info[1]).isoformat()} ({action_info[1]}) completed.")
-            await cal.execute("UPDATE CALENDAR SET COMPLETION_TIMESTAMP=?, COMPLETED=? WHERE SCHEDULED_TIMESTAMP=?", (datetime.datetime.now().timestamp(), 1, action_info[1]))
-            
-            # Mark older tasks as completed
-            await cal.execute("UPDATE CALENDAR SET COMPLETED=?, COMPLETION_TIMESTAMP=? WHERE COMPLETED=0 AND SCHEDULED_TIMESTAMP<?", (1, datetime.datetime.now().timestamp(), action_info[1]))
+    def update_staged_plan(self, guild: discord.Guild, channel_ids: List[int] = [], roles: bool = False):
+        plan = self.bot.staged_plans.get(guild.id)
+        if plan == None:
+            return
+        if len(channel_ids) > 0:
+            plan.update_channels(channel_ids)
+        if roles:
+            plan.update_roles()
 
-            await cal.commit()
-                
+    @commands.Cog.listener()
+    async def on_guild_channel_create(self, channel: discord.abc.GuildChannel):
+        self.update_staged_plan(channel.guild, channel_ids=[channel.id])
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+        if overwrite_signature(before) != overwrite_signature(after) or before.category_id != after.category_id:
+            self.update_staged_plan(after.guild, channel_ids=[after.id])
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        self.update_staged_plan(channel.guild, channel_ids=[channel.id])
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if before.permissions != after.permissions:
+            self.update_staged_plan(after.guild, roles=True)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        # Overwrites of deleted roles are left out of plans, in every channel that has one
+        self.bot.staged_plans.pop(role.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.bot.staged_plans.pop(guild.id, None)
+
+    async def perform_calendar_task(self, action: str, scheduled_timestamp: float, group: str = utils.DEFAULT_CALENDAR_GROUP, task_id: Optional[int] = None):
+        # Perform the task for the guilds following the calendar group and update the calendar as needed
+        # Connections are only held around their own queries; the guild actions take theirs from the same pools
+        report_meta = {'auto': True, 'scheduled_timestamp': scheduled_timestamp, 'calendar_group': group}
+        lag = datetime.datetime.now().timestamp() - scheduled_timestamp
+        metrics.SCHEDULER_LAG.observe(max(0.0, lag), action=action)
+        logger.info(f"Performing {action} task of group '{group}' scheduled for {datetime.datetime.fromtimestamp(scheduled_timestamp).isoformat()} ({scheduled_timestamp}), {lag:.2f}s after its scheduled time.")
+
+        db = await self.bot.connect_db()
+        try:
+            rows = await db.execute_fetchall("SELECT GUILD_ID, LAST_LOCKDOWN, LAST_REOPEN FROM STATE_INFO WHERE GUILD_ID IN (SELECT GUILD_ID FROM GUILD_SETTINGS WHERE CALENDAR_GROUP=? AND USE_CALENDAR=1)", (group,))
         finally:
-            await cal.close()
             await db.close()
+        # Perform actions on guilds with the least channels first, since they take the least time
+        guild_rows = [r for r in rows if self.bot.get_guild(r[0]) != None]
+        guild_rows.sort(key=lambda r: len(self.bot.get_guild(r[0]).channels))
+
+        # Guilds are processed concurrently; the rate limits of each guild's routes are independent of one another
+        batch_start = datetime.datetime.now().timestamp()
+        summary = await asyncio.gather(*[self.run_guild_action(self.guild_semaphore, action, guild_row, report_meta) for guild_row in guild_rows])
+        self.log_batch_summary(action, batch_start, [x for x in summary if x != None], group=group)
+        await self.bot.prune_history()
+
+        # Update status of action in calendar
+        logger.info(f"{action} task of group '{group}' scheduled for {datetime.datetime.fromtimestamp(scheduled_timestamp).isoformat()} ({scheduled_timestamp}) completed.")
+        cal = await self.bot.connect_calendar()
+        try:
+            await self.complete_calendar_task(cal, group, scheduled_timestamp)
+        finally:
+            await cal.close()
+        self.calendar_signature = self.get_calendar_signature()
+
+    async def complete_calendar_task(self, cal: aiosqlite.Connection, group: str, scheduled_timestamp: float):
+        """
+        Records that this cluster has performed the group's task at `scheduled_timestamp`, and the group's older pending tasks with it.
+        Tasks are marked as completed once every cluster has recorded them; with a single cluster, that is straight away.
+        """
+        now = datetime.datetime.now().timestamp()
+        cluster_id, cluster_count = self.bot.cluster_id, self.bot.cluster_count
+        # Taking the write lock up front keeps clusters finishing at the same time from both missing the last completion
+        await cal.execute("BEGIN IMMEDIATE")
+        try:
+            await self.record_performed_tasks(cal, group, "SCHEDULED_TIMESTAMP<=?", scheduled_timestamp, now)
+
+            # The group's recurring schedule continues after this task, for this cluster and, once all have fired it, for the group
+            await cal.execute(
+                "INSERT INTO CLUSTER_SCHEDULES (CALENDAR_GROUP, CLUSTER_ID, LAST_FIRED_TIMESTAMP) VALUES (?,?,?) ON CONFLICT (CALENDAR_GROUP, CLUSTER_ID) DO UPDATE SET LAST_FIRED_TIMESTAMP=excluded.LAST_FIRED_TIMESTAMP WHERE excluded.LAST_FIRED_TIMESTAMP>LAST_FIRED_TIMESTAMP",
+                (group, cluster_id, scheduled_timestamp)
+            )
+            await cal.execute(
+                "UPDATE SCHEDULE_GROUPS SET LAST_FIRED_TIMESTAMP=? WHERE CALENDAR_GROUP=? AND (LAST_FIRED_TIMESTAMP IS NULL OR LAST_FIRED_TIMESTAMP<?) AND (SELECT COUNT(*) FROM CLUSTER_SCHEDULES WHERE CALENDAR_GROUP=? AND CLUSTER_ID<? AND LAST_FIRED_TIMESTAMP>=?)>=?",
+                (scheduled_timestamp, group, scheduled_timestamp, group, cluster_count, scheduled_timestamp, cluster_count)
+            )
+            await cal.commit()
+        except:
+            await cal.rollback()
+            raise
+
+    async def skip_calendar_tasks(self, cal: aiosqlite.Connection, group: str, scheduled_timestamp: float):
+        """
+        Marks the group's pending tasks older than the one at `scheduled_timestamp` as performed by this cluster without performing them, as only the newest overdue task is.
+        """
+        await cal.execute("BEGIN IMMEDIATE")
+        try:
+            skipped = await self.record_performed_tasks(cal, group, "SCHEDULED_TIMESTAMP<?", scheduled_timestamp, datetime.datetime.now().timestamp())
+            await cal.commit()
+        except:
+            await cal.rollback()
+            raise
+        if skipped > 0:
+            logger.warning(f"Skipped {skipped} overdue tasks of group '{group}' older than the one scheduled for {datetime.datetime.fromtimestamp(scheduled_timestamp).isoformat()}.")
+
+    async def record_performed_tasks(self, cal: aiosqlite.Connection, group: str, condition: str, scheduled_timestamp: float, now: float) -> int:
+        """
+        Records that this cluster has performed the group's pending tasks matching `condition` on SCHEDULED_TIMESTAMP, and marks the ones every cluster has recorded as completed.
+        Runs within the caller's transaction. Returns how many tasks this cluster had not recorded yet.
+        """
+        cluster_id, cluster_count = self.bot.cluster_id, self.bot.cluster_count
+        recorded = (await cal.execute(f"INSERT OR IGNORE INTO CLUSTER_TASKS (TASK_ID, CLUSTER_ID, COMPLETION_TIMESTAMP) SELECT TASK_ID, ?, ? FROM CALENDAR WHERE CALENDAR_GROUP=? AND COMPLETED=0 AND {condition}", (cluster_id, now, group, scheduled_timestamp))).rowcount
+        completed = [r[0] for r in await cal.execute_fetchall(
+            f"SELECT TASK_ID FROM CALENDAR c WHERE CALENDAR_GROUP=? AND COMPLETED=0 AND {condition} AND (SELECT COUNT(*) FROM CLUSTER_TASKS t WHERE t.TASK_ID=c.TASK_ID AND t.CLUSTER_ID<?)>=?",
+            (group, scheduled_timestamp, cluster_count, cluster_count)
+        )]
+        await cal.executemany("UPDATE CALENDAR SET COMPLETED=1, COMPLETION_TIMESTAMP=? WHERE TASK_ID=?", [(now, x) for x in completed])
+        await cal.executemany("DELETE FROM CLUSTER_TASKS WHERE TASK_ID=?", [(x,) for x in completed])
+        return recorded
+
+    async def run_guild_action(self, semaphore: asyncio.Semaphore, action: str, guild_row: tuple, report_meta: dict) -> Optional[dict]:
+        """
+        Locks down or reopens a single guild as part of a calendar batch. Exceptions are logged and recorded in the returned summary entry instead of aborting the batch.
+        """
+        guild = self.bot.get_guild(guild_row[0])
+        if guild == None:
+            return None
+
+        if not guild_needs_action(action, guild_row):
+            return None
+
+        async with semaphore:
+            entry = {'guild_id': guild.id, 'start': datetime.datetime.now().timestamp(), 'finish': None, 'success': False}
+            try:
+                if action == 'LOCKDOWN':
+                    # Lock down server
+                    logger.info(f"Automatically locking down guild {guild.id}.")
+                    await self.bot.server_lockdown(guild, await self.bot.get_target_roles(guild), await self.bot.get_ignored_roles(guild), await self.bot.get_ignored_channel_ids(guild), await self.bot.get_ignore_overwrites_preference(guild), meta=report_meta)
+                else:
+                    # Reopen server
+                    logger.info(f"Automatically reopening guild {guild.id}.")
+                    lockdown_report = await self.bot.get_last_lockdown_report(guild)
+                    if lockdown_report == None:
+                        raise LookupError(f"Guild {guild.id} has no lockdown report to reopen from.")
+                    await self.bot.server_reopen(guild, lockdown_report, meta=report_meta)
+            except Exception:
+                logger.exception(f"Automatic {action} of guild {guild.id} failed; continuing with the rest of the batch.")
+            else:
+                entry['success'] = True
+            finally:
+                entry['finish'] = datetime.datetime.now().timestamp()
+            return entry
+
+    def log_batch_summary(self, action: str, batch_start: float, summary: List[dict], group: str = utils.DEFAULT_CALENDAR_GROUP):
+        self.last_batch_summary = {'action': action, 'group': group, 'start': batch_start, 'finish': datetime.datetime.now().timestamp(), 'guilds': summary}
+        failed = [x['guild_id'] for x in summary if not x['success']]
+        logger.info(f"{action} batch of group '{group}' finished in {self.last_batch_summary['finish'] - batch_start:.2f}s: {len(summary) - len(failed)} guilds succeeded, {len(failed)} failed{f' ({failed})' if len(failed) > 0 else ''}.")
+        for x in summary:
+            logger.debug(f"{action} guild {x['guild_id']}: started +{x['start'] - batch_start:.2f}s, finished +{x['finish'] - batch_start:.2f}s, {'succeeded' if x['success'] else 'failed'}.")
 
 def setup(bot: utils.CurfewBot):
     bot.add_cog(AutoLockdownCog(bot))
\ No newline at end of file
@@ -0,0 +1,39 @@
+import os
+import sys
+sys.path.append(os.getcwd())
+import discord
+from discord.ext import commands
+import utils
+from lockdown import overwrite_signature
+import logging
+
+logger = logging.getLogger('cog-enforcement')
+
+NAME = "Lockdown Enforcement"
+DESCRIPTION = "Keeps servers locked down while they are, as channels and roles change."
+
+class EnforcementCog(commands.Cog, name=NAME, description=DESCRIPTION):
+    def __init__(self, bot: utils.CurfewBot):
+        self.bot = bot
+
+    @commands.Cog.listener()
+    async def on_guild_channel_create(self, channel: discord.abc.GuildChannel):
+        await self.bot.enforce_channel_lockdown(channel)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+        # Renames and moves within a category cannot unlock a channel
+        if overwrite_signature(before) != overwrite_signature(after) or before.category_id != after.category_id:
+            await self.bot.enforce_channel_lockdown(after)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if after.permissions.view_channel and not before.permissions.view_channel:
+            await self.bot.enforce_role_lockdown(after)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.bot.locked_guilds.pop(guild.id, None)
+
+def setup(bot: utils.CurfewBot):
+    bot.add_cog(EnforcementCog(bot))
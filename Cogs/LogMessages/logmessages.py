@@ -50,7 +50,7 @@ class LogMessagesCog(commands.Cog, name=NAME, description=DESCRIPTION):
         await log_channel.send(
             ("**Server Locked Down**\n*The neat-looking embed report was too long to be sent, but all the data is still attached below if you need it.*" if not embed_check else None),
             embed=(embed if embed_check else None),
-            files=[discord.File(fp=BytesIO(json.dumps(report).encode('utf8')), filename='lockdown.json')]
+            files=[await self.bot.report_file(report, 'lockdown.json')]
         )
 
     @commands.Cog.listener()
@@ -65,6 +65,13 @@ class LogMessagesCog(commands.Cog, name=NAME, description=DESCRIPTION):
             description=("This action was **automatic**." if self.is_auto(report) else discord.Embed.Empty),
         )
 
+        if len(report['reopened_roles']) > 0:
+            embed.add_field(name=f"{self.bot.getPlaceholder('success')} Reopened Roles", value=", ".join([guild.get_role(r).mention for r in report['reopened_roles']]), inline=False)
+        if len(report['reopened_channels']) > 0:
+            embed.add_field(name=f"{self.bot.getPlaceholder('success')} Reopened Channels", value=", ".join([guild.get_channel(int(c)).mention for c in report['reopened_channels'].keys()]), inline=False)
+        if len(report['unchanged_roles']) > 0 or len(report['unchanged_channels']) > 0:
+            embed.add_field(name=f"{self.bot.getPlaceholder('success')} Already Open", value=f"{len(report['unchanged_roles'])} roles and {len(report['unchanged_channels'])} channels were already as they were before the lockdown.", inline=False)
+
         if len(report['missing_roles']) > 0:
             embed.add_field(name=f"{self.bot.getPlaceholder('warning')} Missing Roles", value=", ".join([f"Role `{r}`" for r in report['missing_roles']]), inline=False)
         if len(report['missing_channels']) > 0:
@@ -84,7 +91,7 @@ class LogMessagesCog(commands.Cog, name=NAME, description=DESCRIPTION):
         await log_channel.send(
             ("**Server Reopened**\n*The neat-looking embed report was too long to be sent, but all the data is still attached below if you need it.*" if not embed_check else None),
             embed=(embed if embed_check else None),
-            files=[discord.File(fp=BytesIO(json.dumps(report).encode('utf8')), filename='reopening.json'), discord.File(fp=BytesIO(json.dumps(lockdown_report).encode('utf8')), filename='lockdown.json')]
+            files=[await self.bot.report_file(report, 'reopening.json'), await self.bot.report_file(lockdown_report, 'lockdown.json')]
         )
 
 def setup(bot: utils.CurfewBot):
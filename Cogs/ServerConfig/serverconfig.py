@@ -25,27 +25,17 @@ async def list_objects(ctx: ApplicationContext, name: str, fetch_func: Callable,
     await ctx.respond(embed=embed, ephemeral=True)
 
 async def edit_object_list(ctx: ApplicationContext, name: str, fetch_func: Callable, appending: bool, value: Union[discord.Role, discord.abc.GuildChannel], column: str):
-    db = await ctx.bot.connect_db()
-    try:
-        objects = await fetch_func(ctx.guild, db=db)
-        if ((value in objects) and appending) or ((value not in objects) and not appending):
-            await ctx.respond(f"{ctx.bot.getPlaceholder('error')} The {name} {value.mention} is {'already' if appending else 'not'} in the list.", ephemeral=True)
-            return
-        (objects.append if appending else objects.remove)(value)
-        await db.execute(f"UPDATE GUILD_SETTINGS SET \"{column}\"=? WHERE GUILD_ID=?", (','.join([str(o.id) for o in objects]), ctx.guild.id))
-        await db.commit()
-    finally:
-        await db.close()
+    objects = await fetch_func(ctx.guild)
+    if ((value in objects) and appending) or ((value not in objects) and not appending):
+        await ctx.respond(f"{ctx.bot.getPlaceholder('error')} The {name} {value.mention} is {'already' if appending else 'not'} in the list.", ephemeral=True)
+        return
+    (objects.append if appending else objects.remove)(value)
+    await ctx.bot.set_guild_setting(ctx.guild, column, ','.join([str(o.id) for o in objects]))
     await ctx.respond(f"{'Added' if appending else 'Removed'} {name} {value.mention} {'to' if appending else 'from'} the list.", ephemeral=True)
 
 async def toggle_column(ctx: ApplicationContext, column: str) -> bool:
-    db = await ctx.bot.connect_db()
-    try:
-        current_state = (await (await db.execute(f"SELECT \"{column}\" FROM GUILD_SETTINGS WHERE GUILD_ID=?", (ctx.guild.id,))).fetchone())[0]
-        await db.execute(f"UPDATE GUILD_SETTINGS SET \"{column}\"=? WHERE GUILD_ID=?", (0 if current_state else 1, ctx.guild.id))
-        await db.commit()
-    finally:
-        await db.close()
+    current_state = (await ctx.bot.get_guild_settings(ctx.guild)).get(column)
+    await ctx.bot.set_guild_setting(ctx.guild, column, 0 if current_state else 1)
     return not current_state
 
 class ServerConfigCog(commands.Cog, name=NAME, description=DESCRIPTION):
@@ -128,12 +118,7 @@ class ServerConfigCog(commands.Cog, name=NAME, description=DESCRIPTION):
                             if not (channel_perms.view_channel and channel_perms.send_messages and channel_perms.use_external_emojis and channel_perms.embed_links and channel_perms.attach_files):
                                 await ctx.respond(f"{ctx.bot.getPlaceholder('error')} Please make sure I have all of the following permissions in {channel.mention} first: `View Channel`, `Send Messages`, `Embed Links`, `Attach Files`, and `Use External Emojis`.", ephemeral=True)
                                 return
-                            db = await ctx.bot.connect_db()
-                            try:
-                                await db.execute("UPDATE GUILD_SETTINGS SET LOG_CHANNEL=? WHERE GUILD_ID=?", (channel.id, ctx.guild.id))
-                                await db.commit()
-                            finally:
-                                await db.close()
+                            await ctx.bot.set_guild_setting(ctx.guild, "LOG_CHANNEL", channel.id)
                             await ctx.respond(f"{ctx.bot.getPlaceholder('success')} Log channel has been set to {channel.mention}.", ephemeral=True)
 
                         @self.command(name="toggle", description="Toggles logging.")
@@ -143,11 +128,8 @@ class ServerConfigCog(commands.Cog, name=NAME, description=DESCRIPTION):
 
                         @self.command(name="get", description="Allows you to view the current logging settings.")
                         async def get_logging_settings(ctx: ApplicationContext):
-                            db = await ctx.bot.connect_db()
-                            try:
-                                enabled, channel_id = (await (await db.execute("SELECT LOGS_ENABLED, LOG_CHANNEL FROM GUILD_SETTINGS WHERE GUILD_ID=?", (ctx.guild.id,))).fetchone())
-                            finally:
-                                await db.close()
+                            settings = await ctx.bot.get_guild_settings(ctx.guild)
+                            enabled, channel_id = settings.logs_enabled, settings.log_channel
                             await ctx.respond(f"Logging is currently **{'enabled' if enabled else 'disabled'}**{f' in channel <#{channel_id}>' if channel_id != None else ''}.", ephemeral=True)
 
                 @self.subgroup("calendar", "Manage automatic lockdowns/reopenings based on the bot's synchronized calendar.")
@@ -157,23 +139,22 @@ class ServerConfigCog(commands.Cog, name=NAME, description=DESCRIPTION):
 
                         @self.command(name="toggle", description="Toggles whether the bot should automatically lockdown/reopen using the synced calendar.")
                         async def toggle_sync(ctx: ApplicationContext):
-                            db = await ctx.bot.connect_db()
-                            try:
-                                current_state = (await (await db.execute("SELECT USE_CALENDAR FROM GUILD_SETTINGS WHERE GUILD_ID=?", (ctx.guild.id,))).fetchone())[0]
-                                await db.execute("UPDATE GUILD_SETTINGS SET USE_CALENDAR=? WHERE GUILD_ID=?", (0 if current_state else 1, ctx.guild.id))
-                                await db.commit()
-                            finally:
-                                await db.close()
-                            await ctx.respond(f"{ctx.bot.getPlaceholder('success')} Calendar scheduling has been **{'disabled' if current_state else 'enabled'}**.", ephemeral=True)
+                            new_state = await toggle_column(ctx, "USE_CALENDAR")
+                            await ctx.respond(f"{ctx.bot.getPlaceholder('success')} Calendar scheduling has been **{'enabled' if new_state else 'disabled'}**.", ephemeral=True)
+
+                        @self.command(name="setgroup", description="Sets which of the bot's calendars this server follows.")
+                        async def set_calendar_group(ctx: ApplicationContext, group: discord.Option(str, "Name of the calendar group.", max_length=100)):
+                            if await ctx.bot.get_next_calendar_task(group) == None:
+                                await ctx.respond(f"{ctx.bot.getPlaceholder('error')} There is no calendar group named `{discord.utils.escape_markdown(group)}` with upcoming tasks.", ephemeral=True)
+                                return
+                            await ctx.bot.set_guild_setting(ctx.guild, "CALENDAR_GROUP", group)
+                            await ctx.respond(f"{ctx.bot.getPlaceholder('success')} This server now follows the `{discord.utils.escape_markdown(group)}` calendar.", ephemeral=True)
 
                         @self.command(name="get", description="Allows you to view the current calendar settings.")
                         async def get_calendar_settings(ctx: ApplicationContext):
-                            db = await ctx.bot.connect_db()
-                            try:
-                                enabled = (await ((await db.execute("SELECT USE_CALENDAR FROM GUILD_SETTINGS WHERE GUILD_ID=?", (ctx.guild.id,))).fetchone()))[0]
-                            finally:
-                                await db.close()
-                            await ctx.respond(f"Automatic lockdowns and reopenings using the synchronized calendar are currently **{'enabled' if enabled else 'disabled'}**.", ephemeral=True)
+                            settings = await ctx.bot.get_guild_settings(ctx.guild)
+                            next_task = await ctx.bot.get_next_calendar_task(settings.calendar_group)
+                            await ctx.respond(f"Automatic lockdowns and reopenings using the synchronized calendar are currently **{'enabled' if settings.use_calendar else 'disabled'}**. This server follows the `{discord.utils.escape_markdown(settings.calendar_group)}` calendar{f', whose next task is a **{next_task[1].lower()}** <t:{int(next_task[0])}:R>' if next_task != None else ', which has no upcoming tasks'}.", ephemeral=True)
 
 def setup(bot: utils.CurfewBot):
     bot.add_cog(ServerConfigCog(bot))
\ No newline at end of file
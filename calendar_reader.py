@@ -2,9 +2,16 @@ import sqlite3
 import json
 import os
 import sys
+import time
+import hashlib
 import argparse
+import asyncio
 import datetime
-from typing import List, Union
+from typing import Dict, List, Optional, Tuple, Union
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import aiosqlite
+from database import migrate
+from migrations import CALENDAR_MIGRATIONS
 
 try:
     from rich import print
@@ -12,7 +19,9 @@ except ModuleNotFoundError:
     pass
 
 parser = argparse.ArgumentParser(
-    description="Reads calendar JSON files generated by https://github.com/PCS24/calendar-pdf-extractor and creates scheduled tasks in the target sqlite database, assuming it follows the schema of Static/calendar.template_db."
+    description="Reads calendar JSON files generated by https://github.com/PCS24/calendar-pdf-extractor and syncs their scheduled tasks into the target sqlite database, assuming it follows the schema of Static/calendar.template_db. "
+    "By default the calendar is stored as a recurring schedule (a Monday-Friday rule plus exception dates) that the bot expands as it goes; bell times stored in the database are kept across syncs. "
+    "Rerunning it with an updated calendar only applies the differences; completed tasks are never touched."
 )
 
 
@@ -36,12 +45,50 @@ parser.add_argument(
     help="Path to the calendar database following the schema of Static/calendar.template_db.",
 )
 
-args = vars(parser.parse_args())
-path_checker(args["json-path"])
-path_checker(args["database-path"])
+parser.add_argument(
+    "--group",
+    type=str,
+    default="default",
+    help="Calendar group the tasks are synced into. Servers follow the 'default' group unless they pick another one.",
+)
+
+parser.add_argument(
+    "--force",
+    action="store_true",
+    help="Diff against the database even if the calendar has not changed since the last sync.",
+)
+
+parser.add_argument(
+    "--materialize",
+    action="store_true",
+    help="Store one row per scheduled task instead of a recurring schedule.",
+)
+
+
+def timezone_checker(s: str) -> str:
+    try:
+        ZoneInfo(s)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise argparse.ArgumentTypeError(f'"{s}" is not a known IANA time zone.')
+    return s
+
 
-with open(args["json-path"], "r") as f:
-    data = json.load(f)["dates"]
+parser.add_argument(
+    "--timezone",
+    type=timezone_checker,
+    default=None,
+    help="IANA time zone the schedule's times are in, e.g. America/New_York. Defaults to the bot's local time. Ignored with --materialize.",
+)
+
+parser.add_argument(
+    "--watch",
+    type=float,
+    nargs="?",
+    const=5.0,
+    default=None,
+    metavar="SECONDS",
+    help="Keep running and sync again whenever the JSON file changes, checking this often (default 5 seconds).",
+)
 
 _SCHEDULE_T = List[List[Union[str, datetime.datetime]]]
 
@@ -67,31 +114,241 @@ def single_session_schedule(d: datetime.datetime) -> _SCHEDULE_T:
     ]
 
 
-now = datetime.datetime.now()
-pre_tasks = []
+# Schedules of each of the calendar's day types. Later types take precedence when a date is listed more than once
+DAY_TYPE_SCHEDULES = {
+    "regular": regular_schedule,
+    "early_dismissal": single_session_schedule,
+    "student_early_dismissal": single_session_schedule,
+    "delayed": delayed_opening_schedule,
+}
+
+# Day type of the recurring Monday-Friday rule; every other school day is stored as an exception
+DEFAULT_DAY_TYPE = "regular"
+
+
+def build_tasks(data: dict) -> Dict[float, str]:
+    """
+    Expands the calendar's dates into tasks, keyed by scheduled timestamp.
+    """
+    pre_tasks = []
+
+    for date_str in data["regular"]:
+        pre_tasks.append(regular_schedule(datetime.datetime.fromisoformat(date_str)))
+
+    for date_str in data["early_dismissal"] + data["student_early_dismissal"]:
+        pre_tasks.append(single_session_schedule(datetime.datetime.fromisoformat(date_str)))
+
+    for date_str in data["delayed"]:
+        pre_tasks.append(delayed_opening_schedule(datetime.datetime.fromisoformat(date_str)))
+
+    tasks = {}
+    for t in pre_tasks:
+        for p in t:
+            tasks[p[1].timestamp()] = p[0]
+    return tasks
+
 
-for date_str in data["regular"]:
-    pre_tasks.append(regular_schedule(datetime.datetime.fromisoformat(date_str)))
+def build_day_types(data: dict) -> Dict[datetime.date, str]:
+    """
+    Maps each of the calendar's school days to its day type.
+    """
+    day_types = {}
+    for day_type in DAY_TYPE_SCHEDULES:
+        for date_str in data.get(day_type, []):
+            day_types[datetime.date.fromisoformat(date_str)] = day_type
+    return day_types
 
-for date_str in data["early_dismissal"] + data["student_early_dismissal"]:
-    pre_tasks.append(single_session_schedule(datetime.datetime.fromisoformat(date_str)))
 
-for date_str in data["delayed"]:
-    pre_tasks.append(delayed_opening_schedule(datetime.datetime.fromisoformat(date_str)))
+def build_templates() -> List[Tuple[str, str, str]]:
+    """
+    The (day type, local time, action) of every task of each day type.
+    """
+    day = datetime.datetime(2000, 1, 1)
+    return [(day_type, d.strftime("%H:%M"), action) for day_type, schedule in DAY_TYPE_SCHEDULES.items() for action, d in schedule(day)]
 
-tasks = []
-for t in pre_tasks:
-    for p in t:
-        tasks.append(p)
 
-with sqlite3.connect(args["database-path"]) as db:
-    cur = db.cursor()
-    for task in tasks:
-        cur.execute(
-            "INSERT INTO CALENDAR (ACTION, COMPLETED, CREATION_TIMESTAMP, SCHEDULED_TIMESTAMP) VALUES (?,?,?,?)",
-            (task[0], 0, now.timestamp(), task[1].timestamp()),
+def build_rule(day_types: Dict[datetime.date, str]) -> Tuple[Optional[Tuple[datetime.date, datetime.date]], Dict[datetime.date, Optional[str]]]:
+    """
+    Compresses the school days into the date range of a Monday-Friday rule of the default day type, and the exceptions to it (None for weekdays without school).
+    """
+    if len(day_types) == 0:
+        return None, {}
+    first, last = min(day_types), max(day_types)
+    exceptions = {}
+    date = first
+    while date <= last:
+        day_type = day_types.get(date)
+        expected = DEFAULT_DAY_TYPE if date.isoweekday() <= 5 else None
+        if day_type != expected:
+            exceptions[date] = day_type
+        date += datetime.timedelta(days=1)
+    return (first, last), exceptions
+
+
+def content_hash(group: str, tasks: Union[Dict[float, str], Dict[datetime.date, str]], *extra) -> str:
+    # Hashes the expanded tasks rather than the file, so formatting changes are ignored but schedule changes are not
+    return hashlib.sha256(json.dumps([group, sorted((str(k), v) for k, v in tasks.items()), *extra]).encode("utf8")).hexdigest()
+
+
+def diff_tasks(existing: Dict[float, Tuple[int, str, int]], tasks: Dict[float, str]) -> Tuple[list, list, list]:
+    """
+    Compares the desired tasks with the group's existing rows ({timestamp: (task ID, action, completed)}).
+    Returns the rows to insert, update and delete. Completed rows are left as they are.
+    """
+    inserts = [(ts, action) for ts, action in tasks.items() if ts not in existing]
+    updates = [(action, existing[ts][0]) for ts, action in tasks.items() if ts in existing and existing[ts][2] == 0 and existing[ts][1] != action]
+    deletes = [(x[0],) for ts, x in existing.items() if x[2] == 0 and ts not in tasks]
+    return inserts, updates, deletes
+
+
+def sync_calendar(db: sqlite3.Connection, group: str, tasks: Dict[float, str], source_path: Optional[str] = None, force: bool = False) -> Optional[Tuple[int, int, int]]:
+    """
+    Makes the group's pending tasks match `tasks` in a single transaction.
+    Returns the number of inserted, updated and deleted tasks, or None if the calendar is unchanged since the last sync.
+    """
+    digest = content_hash(group, tasks, "materialize")
+    if not force:
+        row = db.execute("SELECT CONTENT_HASH FROM CALENDAR_SOURCES WHERE CALENDAR_GROUP=?", (group,)).fetchone()
+        if row != None and row[0] == digest:
+            return None
+
+    now = datetime.datetime.now().timestamp()
+    existing = {r[0]: (r[1], r[2], r[3]) for r in db.execute("SELECT SCHEDULED_TIMESTAMP, TASK_ID, ACTION, COMPLETED FROM CALENDAR WHERE CALENDAR_GROUP=?", (group,))}
+    inserts, updates, deletes = diff_tasks(existing, tasks)
+    with db:
+        db.executemany("DELETE FROM CALENDAR WHERE TASK_ID=?", deletes)
+        db.executemany("UPDATE CALENDAR SET ACTION=? WHERE TASK_ID=?", updates)
+        # A changed task is still to be performed by every cluster
+        db.executemany("DELETE FROM CLUSTER_TASKS WHERE TASK_ID=?", deletes + [(x[1],) for x in updates])
+        db.executemany(
+            "INSERT INTO CALENDAR (CALENDAR_GROUP, ACTION, COMPLETED, CREATION_TIMESTAMP, SCHEDULED_TIMESTAMP) VALUES (?,?,?,?,?)",
+            [(group, action, 0, now, ts) for ts, action in inserts],
+        )
+        # The rows replace any recurring schedule synced into the group before
+        db.execute("DELETE FROM SCHEDULE_RULES WHERE CALENDAR_GROUP=?", (group,))
+        db.execute("DELETE FROM SCHEDULE_EXCEPTIONS WHERE CALENDAR_GROUP=?", (group,))
+        db.execute(
+            "INSERT OR REPLACE INTO CALENDAR_SOURCES (CALENDAR_GROUP, CONTENT_HASH, SOURCE_PATH, SYNC_TIMESTAMP) VALUES (?,?,?,?)",
+            (group, digest, source_path, now),
+        )
+    return len(inserts), len(updates), len(deletes)
+
+
+def sync_schedule(db: sqlite3.Connection, group: str, day_types: Dict[datetime.date, str], timezone: Optional[str] = None, source_path: Optional[str] = None, force: bool = False) -> Optional[Tuple[int, int]]:
+    """
+    Stores the calendar as the group's recurring schedule in a single transaction, replacing its rules, exceptions and pending task rows.
+    Day types that already have templates in the database keep them as they are, so bell times changed there survive syncs.
+    Returns the number of exceptions stored and of task rows removed, or None if the calendar is unchanged since the last sync.
+    """
+    digest = content_hash(group, day_types, "schedule", timezone)
+    if not force:
+        row = db.execute("SELECT CONTENT_HASH FROM CALENDAR_SOURCES WHERE CALENDAR_GROUP=?", (group,)).fetchone()
+        if row != None and row[0] == digest:
+            return None
+
+    now = datetime.datetime.now().timestamp()
+    date_range, exceptions = build_rule(day_types)
+    with db:
+        # Only day types the group has no templates for are seeded; the times are part of the key, so an edited bell time would otherwise get the default back as a second task
+        day_types_stored = {r[0] for r in db.execute("SELECT DISTINCT DAY_TYPE FROM SCHEDULE_TEMPLATES WHERE CALENDAR_GROUP=?", (group,))}
+        db.executemany(
+            "INSERT OR IGNORE INTO SCHEDULE_TEMPLATES (CALENDAR_GROUP, DAY_TYPE, LOCAL_TIME, ACTION) VALUES (?,?,?,?)",
+            [(group, *x) for x in build_templates() if x[0] not in day_types_stored],
+        )
+        db.execute("DELETE FROM SCHEDULE_RULES WHERE CALENDAR_GROUP=?", (group,))
+        db.execute("DELETE FROM SCHEDULE_EXCEPTIONS WHERE CALENDAR_GROUP=?", (group,))
+        if date_range != None:
+            db.execute(
+                "INSERT INTO SCHEDULE_RULES (CALENDAR_GROUP, DAY_TYPE, WEEKDAYS, START_DATE, END_DATE) VALUES (?,?,?,?,?)",
+                (group, DEFAULT_DAY_TYPE, "12345", date_range[0].isoformat(), date_range[1].isoformat()),
+            )
+        db.executemany(
+            "INSERT INTO SCHEDULE_EXCEPTIONS (CALENDAR_GROUP, DATE, DAY_TYPE) VALUES (?,?,?)",
+            [(group, date.isoformat(), day_type) for date, day_type in exceptions.items()],
         )
-    db.commit()
-    cur.close()
+        # A new group starts from now, rather than firing the calendar's past tasks
+        db.execute("INSERT OR IGNORE INTO SCHEDULE_GROUPS (CALENDAR_GROUP, TIMEZONE, LAST_FIRED_TIMESTAMP) VALUES (?,?,?)", (group, timezone, now))
+        db.execute("UPDATE SCHEDULE_GROUPS SET TIMEZONE=? WHERE CALENDAR_GROUP=?", (timezone, group))
+        removed = db.execute("DELETE FROM CALENDAR WHERE CALENDAR_GROUP=? AND COMPLETED=0", (group,)).rowcount
+        db.execute("DELETE FROM CLUSTER_TASKS WHERE TASK_ID NOT IN (SELECT TASK_ID FROM CALENDAR WHERE COMPLETED=0)")
+        db.execute(
+            "INSERT OR REPLACE INTO CALENDAR_SOURCES (CALENDAR_GROUP, CONTENT_HASH, SOURCE_PATH, SYNC_TIMESTAMP) VALUES (?,?,?,?)",
+            (group, digest, source_path, now),
+        )
+    return len(exceptions), removed
+
+
+async def migrate_calendar(path: str):
+    # Bring the database up to the schema the bot expects, in case the bot has not opened it since it was last updated
+    async with aiosqlite.connect(path) as conn:
+        await migrate(conn, CALENDAR_MIGRATIONS)
+
+
+def sync_file(json_path: str, database_path: str, group: str, force: bool = False, materialize: bool = False, timezone: Optional[str] = None):
+    with open(json_path, "r") as f:
+        data = json.load(f)["dates"]
+
+    db = sqlite3.connect(database_path)
+    try:
+        # Same as the bot's connections, so syncing does not block its reads
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA busy_timeout=5000")
+        start = time.perf_counter()
+        if materialize:
+            tasks = build_tasks(data)
+            result = sync_calendar(db, group, tasks, source_path=os.path.abspath(json_path), force=force)
+        else:
+            day_types = build_day_types(data)
+            result = sync_schedule(db, group, day_types, timezone=timezone, source_path=os.path.abspath(json_path), force=force)
+        elapsed = time.perf_counter() - start
+    finally:
+        db.close()
+
+    if materialize and result == None:
+        print(f"The '{group}' calendar is already up to date ({len(tasks)} tasks).")
+    elif materialize:
+        print(f"Synced {len(tasks)} tasks to the '{group}' calendar in {elapsed * 1000:.1f}ms: {result[0]} added, {result[1]} changed, {result[2]} removed.")
+    elif result == None:
+        print(f"The '{group}' schedule is already up to date ({len(day_types)} school days).")
+    else:
+        print(f"Synced {len(day_types)} school days to the '{group}' schedule in {elapsed * 1000:.1f}ms: 1 rule and {result[0]} exceptions stored, {result[1]} task rows removed.")
+
+
+def file_signature(path: str) -> Optional[tuple]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def main(args: dict):
+    path_checker(args["json-path"])
+    path_checker(args["database-path"])
+    asyncio.run(migrate_calendar(args["database-path"]))
+    options = {"materialize": args["materialize"], "timezone": args["timezone"]}
+    sync_file(args["json-path"], args["database-path"], args["group"], force=args["force"], **options)
+    if args["watch"] == None:
+        return
+
+    # A running bot notices the database changing and reloads its schedule, so it never has to be restarted
+    print(f"Watching {args['json-path']} for changes. Press Ctrl+C to stop.")
+    signature = file_signature(args["json-path"])
+    try:
+        while True:
+            time.sleep(args["watch"])
+            new_signature = file_signature(args["json-path"])
+            if new_signature == None or new_signature == signature:
+                continue
+            signature = new_signature
+            try:
+                sync_file(args["json-path"], args["database-path"], args["group"], **options)
+            except (ValueError, KeyError) as e:
+                # e.g. the file was read while it was still being written; it is synced again on its next change
+                print(f"Could not read {args['json-path']}: {e!r}", file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+
 
-print(f"Added {len(tasks)} tasks to the calendar.")
+if __name__ == "__main__":
+    main(vars(parser.parse_args()))
@@ -0,0 +1,159 @@
+import os
+import time
+import asyncio
+import aiosqlite
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Union
+
+logger = logging.getLogger('database')
+
+# Applied to every pooled connection when it is opened
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "temp_store": "MEMORY",
+    "cache_size": -16000,
+    "mmap_size": 67108864
+}
+
+async def migrate(conn: aiosqlite.Connection, migrations: Sequence[str]) -> int:
+    """
+    Brings a database's schema up to date by running the migration scripts it has not seen yet, in order.
+    The number of scripts already applied is kept in the database's user_version. Returns the new version.
+    """
+    version = (await (await conn.execute("PRAGMA user_version")).fetchone())[0]
+    for i in range(version, len(migrations)):
+        # executescript() commits first, so each migration and its version bump are applied on their own
+        try:
+            await conn.executescript(f"BEGIN;\n{migrations[i]}\nPRAGMA user_version={i + 1};\nCOMMIT;")
+        except:
+            if conn.in_transaction:
+                await conn.rollback()
+            logger.error(f"Database migration {i + 1} failed.")
+            raise
+        logger.info(f"Applied database migration {i + 1}.")
+    return max(version, len(migrations))
+
+class PooledConnection:
+    """
+    Thin proxy around a pooled aiosqlite connection.
+    Behaves like the connection itself, except that close() hands it back to the pool instead of closing it, so existing `db = await bot.connect_db() ... await db.close()` code keeps working unchanged.
+    """
+
+    __slots__ = ('_pool', '_conn', '_released')
+
+    def __init__(self, pool: 'DatabasePool', conn: aiosqlite.Connection):
+        self._pool = pool
+        self._conn = conn
+        self._released = False
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    async def _timed(self, sql: str, func: Callable, *args) -> Any:
+        if self._pool.on_query == None:
+            return await func(*args)
+        start = time.perf_counter()
+        try:
+            return await func(*args)
+        finally:
+            self._pool.on_query(sql, time.perf_counter() - start)
+
+    async def execute(self, sql: str, parameters: Optional[Iterable[Any]] = None) -> aiosqlite.Cursor:
+        return await self._timed(sql, self._conn.execute, sql, parameters)
+
+    async def executemany(self, sql: str, parameters: Iterable[Iterable[Any]]) -> aiosqlite.Cursor:
+        return await self._timed(sql, self._conn.executemany, sql, parameters)
+
+    async def execute_fetchall(self, sql: str, parameters: Optional[Iterable[Any]] = None) -> Iterable[aiosqlite.Row]:
+        return await self._timed(sql, self._conn.execute_fetchall, sql, parameters)
+
+    async def executescript(self, sql_script: str) -> aiosqlite.Cursor:
+        return await self._timed(sql_script, self._conn.executescript, sql_script)
+
+    async def commit(self):
+        await self._timed("COMMIT", self._conn.commit)
+
+    async def close(self):
+        if self._released:
+            return
+        self._released = True
+        await self._pool.release(self._conn)
+
+    async def __aenter__(self) -> 'PooledConnection':
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+class DatabasePool:
+    """
+    Keeps up to `size` long-lived connections open to a single SQLite file.
+    Acquiring never blocks: when every pooled connection is in use, an overflow connection is opened and closed again on release, so nested acquisitions cannot deadlock.
+    """
+
+    def __init__(self, path: Union[os.PathLike, str], size: int = 4, cached_statements: int = 256, pragmas: Optional[Dict[str, Any]] = None, migrations: Sequence[str] = ()):
+        self.path = path
+        self.size = max(1, size)
+        self.cached_statements = cached_statements
+        self.pragmas = DEFAULT_PRAGMAS if pragmas == None else pragmas
+        # Schema migrations, applied when the pool is opened
+        self.migrations = migrations
+        # Optional callback(sql, seconds) for every statement run on a pooled connection, e.g. for metrics
+        self.on_query: Optional[Callable[[str, float], None]] = None
+        self._idle: List[aiosqlite.Connection] = []
+        self._lock = asyncio.Lock()
+        self._in_use = 0
+        self._opened = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path, cached_statements=self.cached_statements)
+        for k, v in self.pragmas.items():
+            # PRAGMA names/values come from code and config, never from users
+            await conn.execute(f"PRAGMA {k}={v}")
+        return conn
+
+    async def open(self):
+        async with self._lock:
+            if self._opened:
+                return
+            self._idle = [await self._connect() for _ in range(self.size)]
+            await migrate(self._idle[0], self.migrations)
+            self._opened = True
+        logger.info(f"Opened connection pool for '{self.path}' ({self.size} connections).")
+
+    async def close(self):
+        async with self._lock:
+            self._opened = False
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            await conn.close()
+        logger.info(f"Closed connection pool for '{self.path}'.")
+
+    async def acquire(self) -> PooledConnection:
+        async with self._lock:
+            conn = self._idle.pop() if len(self._idle) > 0 else None
+            self._in_use += 1
+        if conn == None:
+            try:
+                conn = await self._connect()
+            except:
+                self._in_use -= 1
+                raise
+        return PooledConnection(self, conn)
+
+    async def release(self, conn: aiosqlite.Connection):
+        # Uncommitted work is discarded, the same as closing a plain connection would do
+        if conn.in_transaction:
+            await conn.rollback()
+        async with self._lock:
+            self._in_use -= 1
+            if self._opened and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        await conn.close()
@@ -0,0 +1,131 @@
+import json
+import datetime
+import logging
+import aiosqlite
+from typing import List, Optional, Tuple
+from reports import Report
+
+logger = logging.getLogger('history')
+
+# Report keys stored in REPORT_OVERWRITES: stringified channel IDs -> lists of [role ID, previous state]
+# A report has at most one of them (lockdowns the first, reopens the second), which its header tells apart
+OVERWRITE_KINDS = ('affected_channels', 'reopened_channels')
+# Report keys stored in REPORT_TARGETS with a parent: stringified parent IDs -> lists of IDs
+NESTED_KINDS = {'missing_overwrites'}
+
+def report_header(report: dict) -> dict:
+    """
+    The report with every ID collection emptied, leaving its keys and meta. Stored with the operation; the IDs are stored as rows.
+    """
+    return {k: (v if k == 'meta' else type(v)()) for k, v in report.items()}
+
+def report_rows(operation_id: int, report: dict) -> Tuple[List[tuple], List[tuple]]:
+    """
+    Splits a report into REPORT_OVERWRITES rows and REPORT_TARGETS rows.
+    """
+    if all(x in report for x in OVERWRITE_KINDS):
+        raise ValueError(f"A report can only have one of {', '.join(OVERWRITE_KINDS)}")
+    overwrite_rows = []
+    target_rows = []
+    for kind, value in report.items():
+        if kind == 'meta':
+            continue
+        if kind in OVERWRITE_KINDS:
+            overwrite_rows.extend((operation_id, int(channel_id), x[0], x[1]) for channel_id, changes in value.items() for x in changes)
+        elif kind in NESTED_KINDS:
+            target_rows.extend((operation_id, kind, x, int(parent_id)) for parent_id, ids in value.items() for x in ids)
+        else:
+            target_rows.extend((operation_id, kind, x, None) for x in value)
+    return overwrite_rows, target_rows
+
+async def save_report(db: aiosqlite.Connection, operation_id: int, report: dict):
+    """
+    Stores an operation's report, replacing any report stored for it before. Does not commit.
+    """
+    overwrite_rows, target_rows = report_rows(operation_id, report)
+    await db.execute("DELETE FROM REPORT_OVERWRITES WHERE OPERATION_ID=?", (operation_id,))
+    await db.execute("DELETE FROM REPORT_TARGETS WHERE OPERATION_ID=?", (operation_id,))
+    await db.executemany("INSERT OR REPLACE INTO REPORT_OVERWRITES (OPERATION_ID, CHANNEL_ID, ROLE_ID, PREVIOUS_STATE) VALUES (?, ?, ?, ?)", overwrite_rows)
+    await db.executemany("INSERT INTO REPORT_TARGETS (OPERATION_ID, KIND, TARGET_ID, PARENT_ID) VALUES (?, ?, ?, ?)", target_rows)
+    await db.execute("UPDATE OPERATIONS SET REPORT_HEADER=? WHERE OPERATION_ID=?", (json.dumps(report_header(report)), operation_id))
+
+async def append_report(db: aiosqlite.Connection, operation_id: int, report: dict):
+    """
+    Adds the IDs of a partial report to an operation's stored report, e.g. for channels locked after the lockdown itself finished.
+    Overwrites the stored report already holds keep their previous state. Does not commit.
+    """
+    overwrite_rows, target_rows = report_rows(operation_id, report)
+    await db.executemany("INSERT OR IGNORE INTO REPORT_OVERWRITES (OPERATION_ID, CHANNEL_ID, ROLE_ID, PREVIOUS_STATE) VALUES (?, ?, ?, ?)", overwrite_rows)
+    await db.executemany("INSERT INTO REPORT_TARGETS (OPERATION_ID, KIND, TARGET_ID, PARENT_ID) VALUES (?, ?, ?, ?)", target_rows)
+
+async def load_report(db: aiosqlite.Connection, operation_id: int) -> Optional[dict]:
+    """
+    Rebuilds the report of an operation from its rows, in the same shape it was stored in. Returns None if the operation has no report.
+    """
+    row = await (await db.execute("SELECT REPORT_HEADER FROM OPERATIONS WHERE OPERATION_ID=?", (operation_id,))).fetchone()
+    if row == None or row[0] == None:
+        return None
+    report = Report(json.loads(row[0]))
+
+    overwrite_kind = next((x for x in OVERWRITE_KINDS if x in report), OVERWRITE_KINDS[0])
+    for channel_id, role_id, previous_state in await db.execute_fetchall("SELECT CHANNEL_ID, ROLE_ID, PREVIOUS_STATE FROM REPORT_OVERWRITES WHERE OPERATION_ID=?", (operation_id,)):
+        report.setdefault(overwrite_kind, {}).setdefault(str(channel_id), []).append([role_id, previous_state])
+    for kind, target_id, parent_id in await db.execute_fetchall("SELECT KIND, TARGET_ID, PARENT_ID FROM REPORT_TARGETS WHERE OPERATION_ID=? ORDER BY rowid", (operation_id,)):
+        if kind in NESTED_KINDS:
+            report.setdefault(kind, {}).setdefault(str(parent_id), []).append(target_id)
+        else:
+            report.setdefault(kind, []).append(target_id)
+    return report
+
+async def last_report_operation(db: aiosqlite.Connection, guild_id: int, action: str = 'lockdown') -> Optional[int]:
+    row = await (await db.execute("SELECT OPERATION_ID FROM OPERATIONS WHERE GUILD_ID=? AND ACTION=? AND REPORT_HEADER IS NOT NULL ORDER BY OPERATION_ID DESC LIMIT 1", (guild_id, action))).fetchone()
+    return row[0] if row != None else None
+
+async def load_operation(db: aiosqlite.Connection, operation_id: int) -> Optional[Tuple[str, dict]]:
+    """
+    The status of an operation and the input it was started with, or None if there is no such operation.
+    """
+    row = await (await db.execute("SELECT STATUS, INPUT FROM OPERATIONS WHERE OPERATION_ID=?", (operation_id,))).fetchone()
+    return (row[0], json.loads(row[1])) if row != None else None
+
+async def load_last_report(db: aiosqlite.Connection, guild_id: int, action: str = 'lockdown') -> Optional[dict]:
+    """
+    Loads the guild's most recent stored report of the given action.
+    """
+    operation_id = await last_report_operation(db, guild_id, action)
+    return await load_report(db, operation_id) if operation_id != None else None
+
+async def prune_history(db: aiosqlite.Connection, retention_days: float, max_per_guild: int) -> int:
+    """
+    Deletes finished operations older than `retention_days`, and all but the newest `max_per_guild` of each guild (0 disables either limit).
+    Running operations and each guild's latest lockdown report, which reopening depends on, are always kept.
+    Vacuums the database once a quarter of it is free pages. Returns the number of operations deleted.
+    """
+    cutoff = datetime.datetime.now().timestamp() - retention_days * 86400 if retention_days > 0 else None
+    rows = await db.execute_fetchall("""
+        SELECT OPERATION_ID FROM (
+            SELECT OPERATION_ID, STATUS, FINISHED_TIMESTAMP,
+                ROW_NUMBER() OVER (PARTITION BY GUILD_ID ORDER BY OPERATION_ID DESC) AS GUILD_RANK,
+                ROW_NUMBER() OVER (PARTITION BY GUILD_ID, ACTION, REPORT_HEADER IS NOT NULL ORDER BY OPERATION_ID DESC) = 1 AND ACTION='lockdown' AND REPORT_HEADER IS NOT NULL AS LATEST_LOCKDOWN
+            FROM OPERATIONS
+        )
+        WHERE STATUS != 'running' AND NOT LATEST_LOCKDOWN AND ((? IS NOT NULL AND FINISHED_TIMESTAMP < ?) OR (? > 0 AND GUILD_RANK > ?))
+    """, (cutoff, cutoff, max_per_guild, max_per_guild))
+    operation_ids = [(x[0],) for x in rows]
+    if len(operation_ids) == 0:
+        return 0
+
+    for table in ("REPORT_OVERWRITES", "REPORT_TARGETS", "OPERATION_STEPS", "OPERATIONS"):
+        await db.executemany(f"DELETE FROM {table} WHERE OPERATION_ID=?", operation_ids)
+    await db.commit()
+    logger.info(f"Pruned {len(operation_ids)} operations from the lockdown history.")
+
+    free_pages = (await (await db.execute("PRAGMA freelist_count")).fetchone())[0]
+    total_pages = (await (await db.execute("PRAGMA page_count")).fetchone())[0]
+    if total_pages > 0 and free_pages / total_pages >= 0.25:
+        try:
+            await db.execute("VACUUM")
+        except aiosqlite.OperationalError:
+            # e.g. another connection is mid-transaction; the free pages are reused in the meantime
+            logger.warning("Could not vacuum the database after pruning the lockdown history.", exc_info=True)
+    return len(operation_ids)
@@ -0,0 +1,143 @@
+import json
+import asyncio
+import datetime
+import logging
+import aiosqlite
+import discord
+from typing import Any, Awaitable, Callable, Iterable, List, Optional, Set, Tuple
+import history
+from metrics import OperationTimer
+
+logger = logging.getLogger('journal')
+
+# Report keys whose values are dicts keyed by stringified IDs; every other key holds a list of IDs
+DICT_KINDS = {'affected_channels', 'missing_overwrites', 'reopened_channels'}
+
+class OperationJournal:
+    """
+    Checkpoints of a single lockdown or reopen, written to main.db as each edit completes.
+    Every step is stored under the report key it belongs to, so an interrupted operation's report can be rebuilt and the operation resumed where it stopped.
+    The time spent writing to the database is added to `timer` as the 'db_writes' phase.
+    """
+
+    __slots__ = ('connect', 'operation_id', 'guild_id', 'action', 'input', 'steps', 'next_step', 'timer')
+
+    def __init__(self, connect: Callable[[], Awaitable[aiosqlite.Connection]], operation_id: int, guild_id: int, action: str, input: dict, steps: Optional[List[Tuple[str, int, Any]]] = None, next_step: Optional[int] = None):
+        self.connect = connect
+        self.operation_id = operation_id
+        self.guild_id = guild_id
+        self.action = action
+        self.input = input
+        self.steps = [] if steps == None else steps
+        # Steps are numbered in the order they were reserved, which may leave gaps
+        self.next_step = len(self.steps) if next_step == None else next_step
+        self.timer = OperationTimer(action)
+
+    @classmethod
+    async def begin(cls, connect: Callable[[], Awaitable[aiosqlite.Connection]], guild_id: int, action: str, input: dict) -> 'OperationJournal':
+        # A reopen's input holds the whole lockdown report, which is encoded off the event loop
+        encoded_input = await asyncio.to_thread(json.dumps, input)
+        db = await connect()
+        try:
+            cursor = await db.execute("INSERT INTO OPERATIONS (GUILD_ID, ACTION, STARTED_TIMESTAMP, INPUT) VALUES (?, ?, ?, ?)", (guild_id, action, datetime.datetime.now().timestamp(), encoded_input))
+            await db.commit()
+        finally:
+            await db.close()
+        return cls(connect, cursor.lastrowid, guild_id, action, input)
+
+    @classmethod
+    async def load_unfinished(cls, connect: Callable[[], Awaitable[aiosqlite.Connection]], guild_id: Optional[int] = None, action: Optional[str] = None) -> List['OperationJournal']:
+        """
+        Loads the operations that were still running when the bot stopped, along with the steps they completed.
+        """
+        db = await connect()
+        try:
+            rows = await db.execute_fetchall("SELECT OPERATION_ID, GUILD_ID, ACTION, INPUT FROM OPERATIONS WHERE STATUS='running' AND (? IS NULL OR GUILD_ID=?) AND (? IS NULL OR ACTION=?) ORDER BY OPERATION_ID", (guild_id, guild_id, action, action))
+            journals = []
+            for row in rows:
+                steps = await db.execute_fetchall("SELECT KIND, TARGET_ID, DATA, STEP FROM OPERATION_STEPS WHERE OPERATION_ID=? ORDER BY STEP", (row[0],))
+                journals.append(cls(connect, row[0], row[1], row[2], json.loads(row[3]) if row[3] != None else {}, [(x[0], x[1], json.loads(x[2]) if x[2] != None else None) for x in steps], next_step=steps[-1][3] + 1 if len(steps) > 0 else 0))
+        finally:
+            await db.close()
+        return journals
+
+    @property
+    def resumed(self) -> bool:
+        return len(self.steps) > 0
+
+    async def record(self, kind: str, target_id: int, data: Any = None):
+        await self.record_many([(kind, target_id, data)])
+
+    async def record_many(self, steps: Iterable[Tuple[str, int, Any]]):
+        """
+        Stores completed steps, all in one transaction. Each step is a (report key, target ID, data) tuple.
+        """
+        steps = list(steps)
+        if len(steps) == 0:
+            return
+        # Reserved up front: a write cut short by cancellation may still have been committed, and the next one must not reuse its step numbers
+        start = self.next_step
+        self.next_step += len(steps)
+        with self.timer.phase('db_writes'):
+            db = await self.connect()
+            try:
+                await db.executemany("INSERT INTO OPERATION_STEPS (OPERATION_ID, STEP, KIND, TARGET_ID, DATA) VALUES (?, ?, ?, ?, ?)", [(self.operation_id, start + i, x[0], x[1], json.dumps(x[2]) if x[2] != None else None) for i, x in enumerate(steps)])
+                await db.commit()
+            finally:
+                await db.close()
+        self.steps.extend(steps)
+
+    def target_ids(self, *kinds: str) -> Set[int]:
+        return {x[1] for x in self.steps if x[0] in kinds}
+
+    def step_data(self, kind: str) -> Any:
+        # The data of the first step of the given kind, or None if there is none
+        return next((x[2] for x in self.steps if x[0] == kind), None)
+
+    def replay(self, report: dict):
+        """
+        Adds the recorded steps to a fresh report, as if they had just been made.
+        Steps under keys the report does not have are progress markers and are skipped.
+        """
+        for kind, target_id, data in self.steps:
+            if kind not in report:
+                continue
+            if kind in DICT_KINDS:
+                # Older reopens journaled their restored channels without the overwrites
+                report[kind][str(target_id)] = data if data != None else []
+            else:
+                report[kind].append(target_id)
+
+    def lockdown_arguments(self, guild: discord.Guild) -> tuple:
+        """
+        The arguments a journaled lockdown was started with, as accepted by CurfewBot.server_lockdown().
+        """
+        return ([guild.get_role(x) for x in self.input['target_roles']], [guild.get_role(x) for x in self.input['ignored_roles']], self.input['whitelisted_channel_ids'], self.input['ignore_neutral_overwrites'])
+
+    async def save_report(self, report: dict):
+        """
+        Stores the operation's report so far in the history, without closing the operation.
+        """
+        with self.timer.phase('db_writes'):
+            db = await self.connect()
+            try:
+                await history.save_report(db, self.operation_id, report)
+                await db.commit()
+            finally:
+                await db.close()
+
+    async def finish(self, status: str = 'completed', report: Optional[dict] = None):
+        """
+        Closes the operation, storing its final report in the history in the same transaction. Its steps are dropped, since the report supersedes them.
+        """
+        with self.timer.phase('db_writes'):
+            db = await self.connect()
+            try:
+                if report != None:
+                    await history.save_report(db, self.operation_id, report)
+                await db.execute("UPDATE OPERATIONS SET STATUS=?, FINISHED_TIMESTAMP=? WHERE OPERATION_ID=?", (status, datetime.datetime.now().timestamp(), self.operation_id))
+                await db.execute("DELETE FROM OPERATION_STEPS WHERE OPERATION_ID=?", (self.operation_id,))
+                await db.commit()
+            finally:
+                await db.close()
+        logger.debug(f"Operation {self.operation_id} ({self.action} of guild {self.guild_id}) finished as '{status}'.")
@@ -0,0 +1,657 @@
+import time
+import asyncio
+import discord
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from metrics import OperationTimer
+
+if TYPE_CHECKING:
+    from journal import OperationJournal
+
+STATE_MAP = {
+    True: 1,
+    None: 0,
+    False: -1
+}
+
+STATE_MAP_REVERSE = {y: x for x, y in STATE_MAP.items()}
+
+# Bit of the "View Channel" permission in allow/deny pairs
+VIEW_CHANNEL = discord.Permissions(view_channel=True).value
+
+def overwrite_state(allow: int, deny: int) -> Optional[bool]:
+    """
+    The "View Channel" state of a raw allow/deny pair. Deny wins, the same as in PermissionOverwrite.from_pair().
+    """
+    if deny & VIEW_CHANNEL:
+        return False
+    if allow & VIEW_CHANNEL:
+        return True
+    return None
+
+def overwrite_signature(channel: discord.abc.GuildChannel) -> frozenset:
+    return frozenset((x.id, x.allow, x.deny, x.type) for x in channel._overwrites)
+
+# How channel overwrites are written: 'full' replaces the channel's whole overwrite map in one call, 'per_overwrite' writes each changed role overwrite with its own call, and 'auto' picks whichever takes fewer calls
+EDIT_MODES = ('auto', 'full', 'per_overwrite')
+
+# Default number of edits of a single guild kept in flight at once
+DEFAULT_CONCURRENCY = 8
+
+def build_channel_overwrites(channel: discord.abc.GuildChannel, role_states: Dict[int, Optional[bool]]) -> dict:
+    """
+    Builds the channel's full overwrite map with "View Channel" set to the given state for each role ID, creating overwrites where needed.
+    Unlike GuildChannel.overwrites, overwrites of uncached members are kept (as discord.Object), so editing with this map never deletes them.
+    """
+    guild = channel.guild
+    overwrites = {}
+    for ow in channel._overwrites:
+        if ow.is_role():
+            target = guild.get_role(ow.id)
+            if target == None:
+                continue
+        else:
+            target = guild.get_member(ow.id) or discord.Object(id=ow.id)
+        overwrite = discord.PermissionOverwrite.from_pair(discord.Permissions(ow.allow), discord.Permissions(ow.deny))
+        if ow.id in role_states:
+            overwrite.view_channel = role_states[ow.id]
+        overwrites[target] = overwrite
+
+    for role_id, state in role_states.items():
+        role = guild.get_role(role_id)
+        if role != None and role not in overwrites.keys():
+            overwrites[role] = discord.PermissionOverwrite(view_channel=state)
+    return overwrites
+
+def choose_edit_mode(mode: str, changed_count: int) -> str:
+    if mode != 'auto':
+        return mode
+    # Both take one call for a single change; a single overwrite is the smaller payload and cannot clobber unrelated overwrites
+    return 'per_overwrite' if changed_count <= 1 else 'full'
+
+async def apply_overwrite_changes(channel: discord.abc.GuildChannel, role_states: Dict[int, Optional[bool]], mode: str = 'auto') -> int:
+    """
+    Sets "View Channel" on the channel's overwrites for the given role IDs, using the given edit mode. Returns the number of API calls made.
+    """
+    if len(role_states) == 0:
+        return 0
+    overwrites = build_channel_overwrites(channel, role_states)
+    if choose_edit_mode(mode, len(role_states)) == 'full':
+        await channel.edit(overwrites=overwrites)
+        return 1
+
+    guild = channel.guild
+    calls = 0
+    for role_id in role_states.keys():
+        role = guild.get_role(role_id)
+        # Roles deleted since the plan was made have no overwrite to set
+        if role == None:
+            continue
+        await channel.set_permissions(role, overwrite=overwrites[role])
+        calls += 1
+    return calls
+
+class ChannelEdit:
+    """
+    A planned edit of a single channel's overwrites.
+    `changes` holds (role ID, previous state) pairs, as they are recorded in lockdown reports.
+    """
+
+    __slots__ = ('channel', 'changes')
+
+    def __init__(self, channel: discord.abc.GuildChannel, changes: List[Tuple[int, int]]):
+        self.channel = channel
+        self.changes = changes
+
+    @property
+    def role_states(self) -> Dict[int, Optional[bool]]:
+        return {x[0]: False for x in self.changes}
+
+class RoleEdit:
+    """
+    A planned edit of a role's permissions.
+    """
+
+    __slots__ = ('role', 'permissions')
+
+    def __init__(self, role: discord.Role, permissions: discord.Permissions):
+        self.role = role
+        self.permissions = permissions
+
+class LockdownRules:
+    """
+    A guild's lockdown settings, reduced to what is needed to decide how a single channel is locked down.
+    """
+
+    __slots__ = ('guild', 'target_roles', 'target_role_ids', 'ignored_role_ids', 'ignore_neutral_overwrites')
+
+    def __init__(self, guild: discord.Guild, target_roles: Iterable[discord.Role], ignored_roles: Iterable[discord.Role], ignore_neutral_overwrites: bool):
+        self.guild = guild
+        self.target_roles = [x for x in target_roles if x != None]
+        self.target_role_ids = {x.id for x in self.target_roles}
+        self.ignored_role_ids = {x.id for x in ignored_roles if x != None}
+        self.ignore_neutral_overwrites = ignore_neutral_overwrites
+
+    def plan_channel(self, channel: discord.abc.GuildChannel) -> Optional[ChannelEdit]:
+        # Works on the raw allow/deny integers; PermissionOverwrite objects are only built for channels that are actually edited
+        default_role_id = self.guild.default_role.id
+        role_overwrites = [(x.id, overwrite_state(x.allow, x.deny)) for x in channel._overwrites if x.is_role() and self.guild.get_role(x.id) != None]
+        changes = []
+
+        # If no overwrite present for the default role, one will be created
+        if default_role_id not in {x[0] for x in role_overwrites}:
+            changes.append((default_role_id, STATE_MAP[None]))
+
+        # Iterate over each role in the channel's overwrites:
+        for role_id, view_channel in role_overwrites:
+            # If the role is not ignored, set "View Channel" to False if not already disabled
+            if role_id in self.ignored_role_ids:
+                continue
+            if role_id in self.target_role_ids or role_id == default_role_id or (view_channel != False and not self.ignore_neutral_overwrites) or (view_channel == True and self.ignore_neutral_overwrites):
+                changes.append((role_id, STATE_MAP[view_channel]))
+
+        if len(changes) == 0:
+            return None
+        return ChannelEdit(channel, changes)
+
+class LockdownPlan:
+    """
+    Every edit a lockdown of a guild consists of, computed without touching the Discord API.
+    """
+
+    __slots__ = ('guild_id', 'rules', '_channel_edits', 'role_edits', 'whitelisted_channel_ids', '_edits_by_id')
+
+    def __init__(self, guild_id: int, rules: LockdownRules, channel_edits: List[ChannelEdit], role_edits: List[RoleEdit], whitelisted_channel_ids: Iterable[int] = ()):
+        self.guild_id = guild_id
+        self.rules = rules
+        self._channel_edits = channel_edits
+        self.role_edits = role_edits
+        self.whitelisted_channel_ids = frozenset(whitelisted_channel_ids)
+        # Edits by channel ID; only made once the plan is first updated
+        self._edits_by_id: Optional[Dict[int, ChannelEdit]] = None
+
+    @property
+    def channel_edits(self) -> List[ChannelEdit]:
+        if self._channel_edits == None:
+            self._channel_edits = list(self._edits_by_id.values())
+        return self._channel_edits
+
+    @property
+    def estimated_calls(self) -> int:
+        return self.estimate_calls('auto')
+
+    def estimate_calls(self, edit_mode: str) -> int:
+        channel_calls = sum(1 if choose_edit_mode(edit_mode, len(x.changes)) == 'full' else len(x.changes) for x in self.channel_edits)
+        return channel_calls + len(self.role_edits)
+
+    def remaining(self, edited_channel_ids: Set[int], failed_channel_ids: Set[int], done_role_ids: Set[int]) -> 'LockdownPlan':
+        """
+        Returns the part of this plan that is still left to do, given the channels and roles that were already handled (e.g. before a restart).
+        Works both on the plan the operation started with (see from_dict()) and on one made after those edits.
+        """
+        channel_edits = [x for x in self.channel_edits if x.channel.id not in edited_channel_ids and x.channel.id not in failed_channel_ids]
+        return LockdownPlan(self.guild_id, self.rules, channel_edits, [x for x in self.role_edits if x.role.id not in done_role_ids], self.whitelisted_channel_ids)
+
+    def matches(self, guild: discord.Guild, target_roles: List[discord.Role], ignored_roles: List[discord.Role], whitelisted_channel_ids: Iterable[int], ignore_neutral_overwrites: bool) -> bool:
+        """
+        Whether this plan was made for the given guild object with the given lockdown arguments, so it can stand in for a new one.
+        """
+        # After a reconnect, the guild and its channels are new objects; the plan's ones are no longer updated
+        return (
+            self.rules.guild is guild and self.rules.target_role_ids == {x.id for x in target_roles if x != None} and self.rules.ignored_role_ids == {x.id for x in ignored_roles if x != None}
+            and self.whitelisted_channel_ids == set(whitelisted_channel_ids) and self.rules.ignore_neutral_overwrites == ignore_neutral_overwrites
+        )
+
+    def update_channels(self, channel_ids: Iterable[int]):
+        """
+        Plans the given channels again, e.g. after they were created, edited or deleted, leaving the rest of the plan as it is.
+        The result is the same as planning the whole guild again, short of the order of the edits. Takes time in proportion to the channels planned again, not to the size of the guild.
+        """
+        if self._edits_by_id == None:
+            self._edits_by_id = {x.channel.id: x for x in self.channel_edits}
+        guild = self.rules.guild
+        for channel_id in set(channel_ids):
+            self._edits_by_id.pop(channel_id, None)
+            channel = guild.get_channel(channel_id)
+            if channel == None or channel_id in self.whitelisted_channel_ids:
+                continue
+            edit = self.rules.plan_channel(channel)
+            if edit != None:
+                self._edits_by_id[channel_id] = edit
+        self._channel_edits = None
+
+    def update_roles(self):
+        """
+        Plans the role edits again, e.g. after a target role's permissions were changed.
+        """
+        self.role_edits = plan_role_edits(self.rules.guild, self.rules.target_roles)
+
+    @classmethod
+    def from_dict(cls, guild: discord.Guild, data: dict, target_roles: List[discord.Role], ignored_roles: List[discord.Role], whitelisted_channel_ids: Iterable[int], ignore_neutral_overwrites: bool) -> 'LockdownPlan':
+        """
+        Rebuilds a plan saved with to_dict(), with the previous states it was made with rather than the current ones. Channels and roles that no longer exist are left out.
+        """
+        rules = LockdownRules(guild, target_roles, ignored_roles, ignore_neutral_overwrites)
+        channel_edits = []
+        for channel_id, changes in data['channel_edits'].items():
+            channel = guild.get_channel(int(channel_id))
+            if channel == None:
+                continue
+            channel_edits.append(ChannelEdit(channel, [tuple(x) for x in changes]))
+        role_edits = []
+        for role in (guild.get_role(x) for x in data['role_edits']):
+            if role == None:
+                continue
+            new_permissions = role.permissions
+            new_permissions.update(view_channel=False)
+            role_edits.append(RoleEdit(role, new_permissions))
+        return cls(guild.id, rules, channel_edits, role_edits, whitelisted_channel_ids)
+
+    def to_dict(self) -> dict:
+        return {
+            'guild_id': self.guild_id,
+            'channel_edits': {str(x.channel.id): [list(y) for y in x.changes] for x in self.channel_edits},
+            'role_edits': [x.role.id for x in self.role_edits],
+            'estimated_calls': self.estimated_calls
+        }
+
+def plan_lockdown(guild: discord.Guild, target_roles: List[discord.Role], ignored_roles: List[discord.Role], whitelisted_channel_ids: Iterable[int], ignore_neutral_overwrites: bool) -> LockdownPlan:
+    """
+    Works out which channel overwrites and role permissions a lockdown has to change. Has no side effects.
+    """
+    rules = LockdownRules(guild, target_roles, ignored_roles, ignore_neutral_overwrites)
+
+    whitelisted_channel_ids = set(whitelisted_channel_ids)
+    channel_edits = []
+    for ch in guild.channels:
+        if ch.id in whitelisted_channel_ids:
+            continue
+        edit = rules.plan_channel(ch)
+        if edit != None:
+            channel_edits.append(edit)
+
+    return LockdownPlan(guild.id, rules, channel_edits, plan_role_edits(guild, rules.target_roles), whitelisted_channel_ids)
+
+def plan_role_edits(guild: discord.Guild, target_roles: List[discord.Role]) -> List[RoleEdit]:
+    # The given roles + the server default role
+    role_edits = []
+    seen_role_ids = set()
+    for r in [x for x in target_roles if x != None] + [guild.default_role]:
+        if r.id in seen_role_ids:
+            continue
+        seen_role_ids.add(r.id)
+        # Set "View Channels" to False if not already disabled
+        if r.permissions.view_channel != False:
+            new_permissions = r.permissions
+            new_permissions.update(view_channel=False)
+            role_edits.append(RoleEdit(r, new_permissions))
+    return role_edits
+
+def add_span(spans: Dict[str, List[float]], kind: str, start: float):
+    # First start and last finish of each kind of edit; they overlap, so each phase is the span rather than a sum
+    span = spans.setdefault(kind, [start, start])
+    span[0] = min(span[0], start)
+    span[1] = max(span[1], time.perf_counter())
+
+async def run_pipelined(items: list, perform: Callable[[Any], Awaitable[Any]], record: Callable[[Any, Any], Awaitable[None]], concurrency: int = DEFAULT_CONCURRENCY):
+    """
+    Runs perform(item) for each item with up to `concurrency` of them in flight, and record(item, result) for each in the list's order,
+    as soon as it and every item before it are done. record() may append items to the list, which are then performed too.
+    If an item fails, no more items are started; the ones in flight are waited for, and every item that went through is recorded, in the list's order, before the error is raised.
+    If the pipeline is cancelled, the items in flight are cancelled instead, and those that had already gone through are recorded.
+    Either way, what is recorded is not necessarily a prefix of the list: items after a failed one may be recorded too.
+    """
+    running: Dict[int, asyncio.Task] = {}
+    in_flight = 0
+    started = 0
+    recorded = 0
+
+    def finished(task: asyncio.Task):
+        nonlocal in_flight
+        in_flight -= 1
+
+    try:
+        while recorded < len(items):
+            while started < len(items) and in_flight < max(1, concurrency):
+                task = running[started] = asyncio.ensure_future(perform(items[started]))
+                in_flight += 1
+                task.add_done_callback(finished)
+                started += 1
+            task = running[recorded]
+            if not task.done():
+                await asyncio.wait([x for x in running.values() if not x.done()], return_when=asyncio.FIRST_COMPLETED)
+                continue
+            del running[recorded]
+            await record(items[recorded], task.result())
+            recorded += 1
+    except BaseException as error:
+        if not isinstance(error, Exception):
+            for task in running.values():
+                task.cancel()
+        # Requests already sent may have gone through, so they are waited for and recorded rather than abandoned
+        await asyncio.gather(*running.values(), return_exceptions=True)
+        for index in sorted(running):
+            task = running[index]
+            if task.cancelled() or task.exception() != None:
+                continue
+            await record(items[index], task.result())
+        raise
+
+async def execute_lockdown_plan(plan: LockdownPlan, report: dict, edit_mode: str = 'auto', journal: Optional['OperationJournal'] = None, timer: Optional[OperationTimer] = None, concurrency: int = DEFAULT_CONCURRENCY):
+    """
+    Applies a lockdown plan and records the outcome of every edit in the given lockdown report.
+    Up to `concurrency` channel and role edits are in flight at once; the rate limits of their routes are left to the HTTP client's scheduler.
+    Outcomes are recorded in the plan's order regardless of the order the edits finish in.
+    If a journal is given, every outcome is also checkpointed to it as soon as it is recorded. If a timer is given, the time spent on edits is added to it.
+    """
+    if timer == None:
+        timer = OperationTimer('lockdown')
+    items = [('channel', x) for x in plan.channel_edits] + [('role', x) for x in plan.role_edits]
+    spans = {}
+
+    async def perform(item: tuple) -> bool:
+        kind, edit = item
+        start = time.perf_counter()
+        try:
+            if kind == 'channel':
+                # Update channel permissions with new overwrites
+                await apply_overwrite_changes(edit.channel, edit.role_states, mode=edit_mode)
+            else:
+                await edit.role.edit(permissions=edit.permissions)
+            return True
+        except discord.errors.Forbidden:
+            return False
+        finally:
+            add_span(spans, kind, start)
+
+    async def record(item: tuple, success: bool):
+        kind, edit = item
+        if kind == 'channel':
+            if not success:
+                # Record error in report, continue to next edit
+                report['no_perms_channels'].append(edit.channel.id)
+                if journal != None:
+                    await journal.record('no_perms_channels', edit.channel.id)
+                return
+
+            # Record all affected roles in the report dict
+            # The plan's (role ID, previous state) pairs are shared rather than copied into lists; they serialize the same
+            report['affected_channels'][str(edit.channel.id)] = edit.changes
+            if journal != None:
+                await journal.record('affected_channels', edit.channel.id, edit.changes)
+        else:
+            if not success:
+                # Record error in report, continue to next edit
+                report['no_perms_roles'].append(edit.role.id)
+                if journal != None:
+                    await journal.record('no_perms_roles', edit.role.id)
+                return
+
+            # Record all affected roles in the report dict
+            report['affected_roles'].append(edit.role.id)
+            if journal != None:
+                await journal.record('affected_roles', edit.role.id)
+
+    try:
+        await run_pipelined(items, perform, record, concurrency=concurrency)
+    finally:
+        for kind, (start, end) in spans.items():
+            timer.add(f'{kind}_edits', end - start)
+
+class LockedGuild:
+    """
+    A guild that is locked down, with what is needed to keep channels and roles that change during the lockdown locked as well:
+    the rules the lockdown was made with, and which channels and roles its report covers. Built from the report once, after which
+    deciding about a single channel or role takes time in proportion to that channel's overwrites, not to the size of the guild.
+    The record_*() methods return the part of a report to add to the stored one, or None if it already holds everything.
+    """
+
+    __slots__ = ('operation_id', 'rules', 'whitelisted_channel_ids', 'channel_roles', 'category_changes', 'failed_channel_ids', 'role_ids', 'failed_role_ids', 'additions', 'lock')
+
+    def __init__(self, operation_id: int, rules: LockdownRules, lockdown_report: dict, whitelisted_channel_ids: Iterable[int] = ()):
+        self.operation_id = operation_id
+        self.rules = rules
+        self.whitelisted_channel_ids = frozenset(whitelisted_channel_ids)
+        # IDs of the roles whose previous state the report holds, by channel ID
+        self.channel_roles: Dict[int, Set[int]] = {int(k): {x[0] for x in v} for k, v in lockdown_report.get('affected_channels', {}).items()}
+        # The report's entries of locked categories; see record_inherited()
+        self.category_changes: Dict[int, List[list]] = {
+            int(k): [list(x) for x in v] for k, v in lockdown_report.get('affected_channels', {}).items() if isinstance(rules.guild.get_channel(int(k)), discord.CategoryChannel)
+        }
+        self.failed_channel_ids: Set[int] = set(lockdown_report.get('no_perms_channels', []))
+        self.role_ids: Set[int] = set(lockdown_report.get('affected_roles', []))
+        self.failed_role_ids: Set[int] = set(lockdown_report.get('no_perms_roles', []))
+        # Everything recorded since, in the report's shape; see merge_into()
+        self.additions = {'affected_channels': {}, 'affected_roles': [], 'no_perms_channels': [], 'no_perms_roles': []}
+        # Held while a change of the guild is being enforced, so they are handled one at a time
+        self.lock = asyncio.Lock()
+
+    def bind(self, guild: discord.Guild):
+        """
+        Points the rules at the given guild object, which is a new one after a reconnect.
+        """
+        if self.rules.guild is not guild:
+            self.rules = LockdownRules(guild, [guild.get_role(x) for x in self.rules.target_role_ids], [guild.get_role(x) for x in self.rules.ignored_role_ids], self.rules.ignore_neutral_overwrites)
+
+    def plan_channel(self, channel: discord.abc.GuildChannel) -> Optional[ChannelEdit]:
+        """
+        The edit that locks the channel again, with only the overwrites that are not locked yet, or None if there are none.
+        Whitelisted channels and channels the lockdown could not edit are left alone.
+        """
+        if channel.id in self.whitelisted_channel_ids or channel.id in self.failed_channel_ids:
+            return None
+        edit = self.rules.plan_channel(channel)
+        if edit == None:
+            return None
+        # Overwrites that are already denied need no call; this is also what makes the updates of the bot's own edits no-ops
+        edit.changes = [x for x in edit.changes if x[1] != STATE_MAP[False]]
+        return edit if len(edit.changes) > 0 else None
+
+    def plan_role(self, role: discord.Role) -> Optional[RoleEdit]:
+        """
+        The edit that takes "View Channels" from a target role (or the default role) again, or None if it does not have it.
+        """
+        if role.id not in self.rules.target_role_ids and role.id != self.rules.guild.default_role.id:
+            return None
+        if role.id in self.failed_role_ids or role.permissions.view_channel == False:
+            return None
+        new_permissions = role.permissions
+        new_permissions.update(view_channel=False)
+        return RoleEdit(role, new_permissions)
+
+    def _add(self, part: dict) -> dict:
+        for kind, value in part.items():
+            if isinstance(value, dict):
+                for k, v in value.items():
+                    self.additions[kind].setdefault(k, []).extend(v)
+            else:
+                self.additions[kind].extend(value)
+        return part
+
+    def record_channel(self, edit: ChannelEdit) -> Optional[dict]:
+        # Overwrites the report already holds keep the state they had before the lockdown, rather than the one they were changed to since
+        recorded = self.channel_roles.setdefault(edit.channel.id, set())
+        changes = [list(x) for x in edit.changes if x[0] not in recorded]
+        if len(changes) == 0:
+            return None
+        recorded.update(x[0] for x in changes)
+        if isinstance(edit.channel, discord.CategoryChannel):
+            self.category_changes.setdefault(edit.channel.id, []).extend(changes)
+        return self._add({'affected_channels': {str(edit.channel.id): changes}})
+
+    def record_inherited(self, channel: discord.abc.GuildChannel) -> Optional[dict]:
+        """
+        Records a channel that needs no edit because it already has the overwrites of its locked category, e.g. one created in it with its permissions synced.
+        It is given the category's previous states, so that reopening opens it along with the category.
+        """
+        if channel.id in self.channel_roles or channel.id in self.whitelisted_channel_ids or channel.id in self.failed_channel_ids or channel.category_id not in self.category_changes:
+            return None
+        category = self.rules.guild.get_channel(channel.category_id)
+        if category == None or overwrite_signature(channel) != overwrite_signature(category):
+            return None
+        changes = [list(x) for x in self.category_changes[category.id]]
+        self.channel_roles[channel.id] = {x[0] for x in changes}
+        return self._add({'affected_channels': {str(channel.id): changes}})
+
+    def record_failed_channel(self, channel_id: int) -> Optional[dict]:
+        if channel_id in self.failed_channel_ids:
+            return None
+        self.failed_channel_ids.add(channel_id)
+        return self._add({'no_perms_channels': [channel_id]})
+
+    def record_role(self, role_id: int, success: bool) -> Optional[dict]:
+        ids, kind = (self.role_ids, 'affected_roles') if success else (self.failed_role_ids, 'no_perms_roles')
+        if role_id in ids:
+            return None
+        ids.add(role_id)
+        return self._add({kind: [role_id]})
+
+    def merge_into(self, lockdown_report: dict):
+        """
+        Adds everything recorded by this object to a lockdown report, e.g. one that was loaded before the last of it was stored. What the report already holds is left as it is.
+        """
+        for kind, value in self.additions.items():
+            if isinstance(value, dict):
+                target = lockdown_report.setdefault(kind, {})
+                for k, v in value.items():
+                    existing = target.setdefault(k, [])
+                    held = {x[0] if kind == 'affected_channels' else x for x in existing}
+                    existing.extend(x for x in v if (x[0] if kind == 'affected_channels' else x) not in held)
+            else:
+                target = lockdown_report.setdefault(kind, [])
+                held = set(target)
+                target.extend(x for x in value if x not in held)
+
+class ReopenEdit:
+    """
+    What reopening a single channel takes, worked out from the lockdown report and the channel's current overwrites.
+    `role_states` holds the overwrites to restore, and `changes` the (role ID, state before reopening) pairs of the same overwrites, as they are recorded in reopen reports.
+    """
+
+    __slots__ = ('channel_id', 'channel', 'overwrite_list', 'role_states', 'changes', 'missing_roles', 'missing_overwrites')
+
+    def __init__(self, channel_id: int, channel: Optional[discord.abc.GuildChannel], overwrite_list: List[List[int]]):
+        self.channel_id = channel_id
+        self.channel = channel
+        # The channel's entry in the lockdown report
+        self.overwrite_list = overwrite_list
+        self.role_states: Dict[int, Optional[bool]] = {}
+        self.changes: List[Tuple[int, int]] = []
+        self.missing_roles: List[int] = []
+        self.missing_overwrites: List[int] = []
+
+def plan_reopen_channel(guild: discord.Guild, channel_id: int, overwrite_list: List[List[int]]) -> ReopenEdit:
+    channel = guild.get_channel(channel_id)
+    edit = ReopenEdit(channel_id, channel, overwrite_list)
+    if channel == None:
+        return edit
+
+    current_states = {x.id: overwrite_state(x.allow, x.deny) for x in channel._overwrites if x.is_role()}
+    for role_id, state in overwrite_list:
+        if guild.get_role(role_id) == None:
+            edit.missing_roles.append(role_id)
+        elif role_id not in current_states:
+            # The overwrite was removed since the lockdown
+            if role_id not in edit.missing_overwrites:
+                edit.missing_overwrites.append(role_id)
+        elif current_states[role_id] != STATE_MAP_REVERSE[state] and role_id not in edit.role_states:
+            # Overwrites already in their state from before the lockdown are left alone
+            edit.role_states[role_id] = STATE_MAP_REVERSE[state]
+            edit.changes.append((role_id, STATE_MAP[current_states[role_id]]))
+    return edit
+
+class ReopenPlan:
+    """
+    Every edit reopening a guild from a lockdown report consists of, computed without touching the Discord API.
+    Only what differs from the report is edited; roles are checked when they are edited, since role edits come last.
+    """
+
+    __slots__ = ('guild', 'channel_edits', 'role_ids')
+
+    def __init__(self, guild: discord.Guild, channel_edits: List[ReopenEdit], role_ids: List[int]):
+        self.guild = guild
+        self.channel_edits = channel_edits
+        self.role_ids = role_ids
+
+    def estimate_calls(self, edit_mode: str) -> int:
+        channel_calls = sum(1 if choose_edit_mode(edit_mode, len(x.role_states)) == 'full' else len(x.role_states) for x in self.channel_edits if len(x.role_states) > 0)
+        return channel_calls + sum(1 for x in self.role_ids if self.guild.get_role(x) != None and not self.guild.get_role(x).permissions.view_channel)
+
+def plan_reopen(guild: discord.Guild, lockdown_report: dict, done_channel_ids: Set[int] = set(), done_role_ids: Set[int] = set()) -> ReopenPlan:
+    """
+    Works out which channel overwrites and role permissions reopening from a lockdown report has to change. Has no side effects.
+    Channels and roles already handled (e.g. before a restart) are left out.
+    """
+    plan = ReopenPlan(guild, [], [x for x in lockdown_report['affected_roles'] if x not in done_role_ids])
+    for k, overwrite_list in lockdown_report['affected_channels'].items():
+        if int(k) not in done_channel_ids:
+            plan.channel_edits.append(plan_reopen_channel(guild, int(k), overwrite_list))
+    return plan
+
+async def execute_reopen_plan(plan: ReopenPlan, report: dict, edit_mode: str = 'auto', journal: Optional['OperationJournal'] = None, timer: Optional[OperationTimer] = None, concurrency: int = DEFAULT_CONCURRENCY):
+    """
+    Applies a reopen plan and records the outcome for every channel and role in the given reopen report, the same way execute_lockdown_plan() does.
+    Channels and roles that are already as they were before the lockdown are recorded as unchanged without an API call.
+    """
+    if timer == None:
+        timer = OperationTimer('reopen')
+    items = [('channel', x) for x in plan.channel_edits] + [('role', x) for x in plan.role_ids]
+    spans = {}
+
+    async def perform(item: tuple) -> str:
+        kind, edit = item
+        if kind == 'channel':
+            if edit.channel == None:
+                return 'missing'
+            if len(edit.role_states) == 0:
+                return 'unchanged'
+        else:
+            role = plan.guild.get_role(edit)
+            if role == None:
+                return 'missing'
+            # Lockdown reports only hold roles that could view channels before
+            if role.permissions.view_channel:
+                return 'unchanged'
+
+        start = time.perf_counter()
+        try:
+            if kind == 'channel':
+                # Update channel, writing only the overwrites that change
+                await apply_overwrite_changes(edit.channel, edit.role_states, mode=edit_mode)
+            else:
+                new_permissions = role.permissions
+                new_permissions.update(view_channel=True)
+                await role.edit(permissions=new_permissions)
+            return 'reopened'
+        except discord.errors.Forbidden:
+            return 'no_perms'
+        finally:
+            add_span(spans, kind, start)
+
+    async def record(item: tuple, outcome: str):
+        kind, edit = item
+        if kind == 'role':
+            report[f'{outcome}_roles'].append(edit)
+            if journal != None:
+                await journal.record(f'{outcome}_roles', edit)
+            return
+
+        steps = [('missing_roles', x, None) for x in edit.missing_roles]
+        report['missing_roles'].extend(edit.missing_roles)
+        if len(edit.missing_overwrites) > 0:
+            report['missing_overwrites'][str(edit.channel_id)] = edit.missing_overwrites
+            steps.append(('missing_overwrites', edit.channel_id, edit.missing_overwrites))
+        if outcome == 'reopened':
+            # The overwrites that were restored, with their states from before reopening
+            report['reopened_channels'][str(edit.channel_id)] = edit.changes
+            steps.append(('reopened_channels', edit.channel_id, edit.changes))
+        else:
+            report[f'{outcome}_channels'].append(edit.channel_id)
+            steps.append((f'{outcome}_channels', edit.channel_id, None))
+        if journal != None:
+            await journal.record_many(steps)
+
+    try:
+        await run_pipelined(items, perform, record, concurrency=concurrency)
+    finally:
+        for kind, (start, end) in spans.items():
+            timer.add(f'{kind}_edits', end - start)
@@ -0,0 +1,166 @@
+"""
+The bot's logging pipeline. Loggers only put records on a queue; a background thread formats them and writes them to stdout and the log file,
+so a slow disk never holds up the event loop. Log files are rotated by size and age, rotated files are gzip-compressed, and they can be written
+as JSON lines carrying the guild and operation a record is about.
+"""
+import os
+import glob
+import gzip
+import json
+import time
+import queue
+import shutil
+import logging
+import datetime
+import contextvars
+import logging.handlers
+from typing import List, Optional
+
+# Fields added to every record logged in the current context, e.g. the guild and operation a lockdown is logging about
+LOG_FIELDS: contextvars.ContextVar = contextvars.ContextVar('log_fields', default={})
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s | %(message)s'
+
+def set_log_fields(**fields) -> contextvars.Token:
+    """
+    Adds fields to the records logged from here on in the current context (and the tasks it starts). Returns a token for LOG_FIELDS.reset().
+    """
+    return LOG_FIELDS.set({**LOG_FIELDS.get(), **fields})
+
+class FieldsFilter(logging.Filter):
+    """
+    Copies the context's LOG_FIELDS onto each record, in the thread that logs it; fields given with `extra` take precedence.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in LOG_FIELDS.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on a bounded queue without ever waiting. While the queue is full, records are dropped and counted, and a warning with the count is logged once there is room again.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super(DroppingQueueHandler, self).__init__(log_queue)
+        self.dropped = 0
+        self.addFilter(FieldsFilter())
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Tracebacks refer to live frames, so they are formatted here; the rest of the formatting is left to the writing thread, which is where the log format is known
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            if self.dropped > 0:
+                warning = logging.LogRecord('logpipeline', logging.WARNING, __file__, 0, f"{self.dropped} log records were dropped while the log queue was full.", None, None)
+                self.queue.put_nowait(warning)
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats a record as a single line of JSON, with the guild and operation it is about (see LOG_FIELDS) where there are any.
+    """
+
+    FIELDS = ('guild_id', 'operation_id', 'action')
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {'time': self.formatTime(record, self.datefmt), 'level': record.levelname, 'logger': record.name, 'message': record.getMessage()}
+        for key in self.FIELDS:
+            value = getattr(record, key, None)
+            if value != None:
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        if record.stack_info:
+            data['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(data, default=str)
+
+class RotatingLogFileHandler(logging.handlers.BaseRotatingHandler):
+    """
+    Writes to a log file, moving it aside once it reaches `max_bytes` or is `interval` seconds old (0 disables either).
+    Rotated files are named after the time they were rotated and gzip-compressed if `compress` is set; only the newest `backup_count` are kept (0 keeps all).
+    """
+
+    def __init__(self, filename: str, max_bytes: int = 0, interval: float = 0, backup_count: int = 0, compress: bool = True, encoding: str = 'utf-8'):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        super(RotatingLogFileHandler, self).__init__(filename, 'a', encoding=encoding)
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backup_count = backup_count
+        self.compress = compress
+        self.rollover_at = time.time() + interval if interval > 0 else None
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.rollover_at != None and time.time() >= self.rollover_at:
+            return True
+        if self.max_bytes > 0 and self.stream != None:
+            return self.stream.tell() + len(self.format(record)) + 1 >= self.max_bytes and self.stream.tell() > 0
+        return False
+
+    def rotated_paths(self) -> List[str]:
+        root, ext = os.path.splitext(self.baseFilename)
+        # The timestamps sort in the order the files were rotated in
+        return sorted(glob.glob(glob.escape(root) + ".*" + ext + "*"))
+
+    def rotated_path(self) -> str:
+        root, ext = os.path.splitext(self.baseFilename)
+        # With microseconds, so files rotated within the same second get different names that still sort in order
+        return f"{root}.{datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')}{ext}"
+
+    def doRollover(self):
+        if self.stream != None:
+            self.stream.close()
+            self.stream = None
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            path = self.rotated_path()
+            if self.compress:
+                with open(self.baseFilename, 'rb') as source, gzip.open(path + ".gz", 'wb') as target:
+                    shutil.copyfileobj(source, target)
+                os.remove(self.baseFilename)
+            else:
+                os.replace(self.baseFilename, path)
+        if self.backup_count > 0:
+            for path in self.rotated_paths()[:-self.backup_count]:
+                os.remove(path)
+        self.stream = self._open()
+        if self.interval > 0:
+            self.rollover_at = time.time() + self.interval
+
+def start_logging(level: int, date_format: str, stdout: bool = True, file_path: Optional[str] = None, file_format: str = 'text',
+                  max_bytes: int = 0, interval: float = 0, backup_count: int = 0, queue_size: int = 10000) -> logging.handlers.QueueListener:
+    """
+    Routes the root logger through a queue to a background thread writing to stdout and/or `file_path`. Returns the thread's listener, to be stopped (which writes what is left on the queue) before exiting.
+    """
+    text_formatter = logging.Formatter(fmt=TEXT_FORMAT, datefmt=date_format)
+    handlers = []
+    if stdout:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(text_formatter)
+        handlers.append(stream_handler)
+    if file_path != None:
+        file_handler = RotatingLogFileHandler(file_path, max_bytes=max_bytes, interval=interval, backup_count=backup_count)
+        file_handler.setFormatter(JsonLinesFormatter(datefmt=date_format) if file_format == 'json' else text_formatter)
+        handlers.append(file_handler)
+
+    log_queue = queue.Queue(maxsize=max(0, queue_size))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel(level)
+    listener.start()
+    return listener
@@ -1,4 +1,3 @@
-import traceback
 import discord
 from discord.ext import commands
 from discord.commands.context import ApplicationContext
@@ -7,12 +6,18 @@ import aiosqlite
 import logging
 import os
 import utils
+import metrics
 import discord_emoji
 from dotenv import load_dotenv
 import datetime
+import time
 import sys
 from typing import List, Set
 import json
+import argparse
+import sharding
+import logpipeline
+import atexit
 
 load_dotenv()
 
@@ -20,11 +25,17 @@ load_dotenv()
 ROOT_PATH = utils.getRootPath()
 os.chdir(ROOT_PATH)
 
+parser = argparse.ArgumentParser(description="Runs CurfewBot.")
+parser.add_argument("--cluster", type=int, default=None, help="Run only this cluster's shards. Set by main.py itself when Sharding.clusters is more than 1.")
+ARGS = parser.parse_args()
+
 # Get config data
 CONFIG = utils.getConfig('Static/config.template_yaml', 'Config/config.yaml')
+SHARD_COUNT = CONFIG.get('Sharding', {}).get('shard_count', 0)
+CLUSTER_COUNT = max(1, CONFIG.get('Sharding', {}).get('clusters', 1))
 
 # Configure logging
-LOG_PATH = 'Logs/' + datetime.datetime.now().strftime("%m-%d-%Y_%H%M%S") + ".log"
+LOG_PATH = 'Logs/' + datetime.datetime.now().strftime("%m-%d-%Y_%H%M%S") + (f"_cluster{ARGS.cluster}" if ARGS.cluster != None else "") + ".log"
 log_level_switch = (
     {
         "DEBUG": logging.DEBUG,
@@ -35,12 +46,15 @@ log_level_switch = (
         "CRITICAL": logging.CRITICAL
     }
 )
-logging.basicConfig(level=log_level_switch[CONFIG['Logging']['logging_level'].upper()], format='%(asctime)s %(levelname)s %(name)s | %(message)s', datefmt=CONFIG['Logging']['date_format'])
+# Records are written by a background thread, so that logging never waits for the disk; whatever is still queued is written on exit
+LOG_LISTENER = logpipeline.start_logging(
+    log_level_switch[CONFIG['Logging']['logging_level'].upper()], CONFIG['Logging']['date_format'], stdout=CONFIG['Logging'].get('log_stdout', True),
+    file_path=(LOG_PATH if CONFIG['Logging']['log_files'] else None), file_format=CONFIG['Logging'].get('file_format', 'text'),
+    max_bytes=int(CONFIG['Logging'].get('rotate_size_mib', 20) * 2 ** 20), interval=CONFIG['Logging'].get('rotate_hours', 24) * 3600,
+    backup_count=CONFIG['Logging'].get('backup_count', 30), queue_size=CONFIG['Logging'].get('queue_size', 10000)
+)
+atexit.register(LOG_LISTENER.stop)
 logger = logging.getLogger()
-fileHandler = logging.FileHandler(LOG_PATH)
-fileHandler.setFormatter(logging.Formatter(fmt='%(asctime)s %(levelname)s %(name)s | %(message)s', datefmt=CONFIG['Logging']['date_format']))
-if CONFIG['Logging']['log_files']:
-    logger.addHandler(fileHandler)
 logging.info("Config loaded, logger started")
 logging.info("Python " + sys.version.split(" ")[0])
 logging.info("Discord.py version " + discord.__version__)
@@ -55,12 +69,30 @@ if CONFIG['Bot']['token'] == 'env':
 for p in CONFIG['Bot']['placeholders']:
     CONFIG['Bot']['placeholders'][p] = discord_emoji.to_unicode(CONFIG['Bot']['placeholders'][p])
 
+if CLUSTER_COUNT > 1:
+    if SHARD_COUNT < CLUSTER_COUNT:
+        logging.critical("Sharding.clusters is more than 1, so Sharding.shard_count must be set, to at least as many shards as clusters. Quitting.")
+        sys.exit()
+    if ARGS.cluster == None:
+        # This process only supervises the clusters
+        logging.info(f"Starting {CLUSTER_COUNT} clusters of {SHARD_COUNT} shards.")
+        asyncio.run(sharding.ClusterSupervisor([sys.executable, os.path.join(ROOT_PATH, "main.py")], CLUSTER_COUNT).run())
+        sys.exit()
+    if not 0 <= ARGS.cluster < CLUSTER_COUNT:
+        logging.critical(f"Cluster {ARGS.cluster} does not exist; Sharding.clusters is {CLUSTER_COUNT}. Quitting.")
+        sys.exit()
+
 # Create bot instance
-bot = utils.CurfewBot(CONFIG, command_prefix=utils.getPrefix, intents=discord.Intents.all(), case_insensitive=True, debug_guilds=(CONFIG['Bot']['debug_guild_ids'] if CONFIG['Bot']['dev_mode'] else None))
+if CLUSTER_COUNT > 1:
+    shard_options = {'shard_count': SHARD_COUNT, 'shard_ids': sharding.cluster_shards(SHARD_COUNT, CLUSTER_COUNT, ARGS.cluster), 'cluster_id': ARGS.cluster, 'cluster_count': CLUSTER_COUNT}
+    logging.info(f"Running cluster {ARGS.cluster} of {CLUSTER_COUNT}, with shards {shard_options['shard_ids']}.")
+else:
+    shard_options = {'shard_count': SHARD_COUNT if SHARD_COUNT > 0 else None}
+bot = utils.CurfewBot(CONFIG, case_insensitive=True, debug_guilds=(CONFIG['Bot']['debug_guild_ids'] if CONFIG['Bot']['dev_mode'] else None), **utils.getGatewayOptions(CONFIG), **shard_options)
 
 # Load cogs
 # Add cog paths each time one is created
-COGS = ['Cogs.ServerConfig.serverconfig', 'Cogs.LogMessages.logmessages', 'Cogs.AutoLockdown.autolockdown', 'Cogs.AdminCommands.admincommands']
+COGS = ['Cogs.ServerConfig.serverconfig', 'Cogs.LogMessages.logmessages', 'Cogs.AutoLockdown.autolockdown', 'Cogs.Enforcement.enforcement', 'Cogs.AdminCommands.admincommands']
 
 for cog in COGS:
     try:
@@ -83,30 +115,66 @@ async def ping(ctx: ApplicationContext):
 async def help(ctx: ApplicationContext):
     await ctx.respond(ctx.bot.config['Messages']['help_command_response'])
 
+if CONFIG['Bot']['dev_mode']:
+    @commands.is_owner()
+    @bot.slash_command()
+    async def stats(ctx: ApplicationContext):
+        """
+        Summarizes the bot's lockdown, API and database metrics
+        """
+        # Discord's message length limit, less the code block
+        await ctx.respond(f"```\n{metrics.summary()[:1990]}\n```", ephemeral=True)
+
 @bot.event
 async def on_application_command_error(ctx: ApplicationContext, error: commands.CommandError):
     error = getattr(error, "original", error)
     if hasattr(ctx.command, 'name'):
-        logger.error(f"'{type(error)}' exception occurred while executing command \'{ctx.command.name}\': {error}")
-        formatted_exc = traceback.format_exception(error, value=error, tb=error.__traceback__)
-        for l in ''.join(formatted_exc).split('\n'):
-            logger.error(l)
+        logger.error(f"'{type(error)}' exception occurred while executing command \'{ctx.command.name}\': {error}", exc_info=error)
+
+# Ready-to-serve time is measured from launch for the first ready event, and from the last connect for later ones
+START_TIME = time.perf_counter()
+connect_time = None
+cold_start = True
+
+@bot.event
+async def on_connect():
+    global connect_time
+    connect_time = time.perf_counter()
+    # Replaces the library's on_connect, which syncs every time
+    start = time.perf_counter()
+    await bot.sync_commands_if_changed()
+    metrics.READY_SECONDS.observe(time.perf_counter() - start, start="cold" if cold_start else "reconnect", step="commands")
 
 @bot.event
 async def on_ready():
+    global cold_start
     logging.info("CurfewBot online")
-    await bot.update_guilds()
-    await bot.sync_commands(bot.commands)
+    kind = "cold" if cold_start else "reconnect"
+    start = time.perf_counter()
+    added = await bot.update_guilds()
+    metrics.READY_SECONDS.observe(time.perf_counter() - start, start=kind, step="guilds")
+    ready = time.perf_counter() - (START_TIME if cold_start or connect_time == None else connect_time)
+    metrics.READY_SECONDS.observe(ready, start=kind, step="total")
+    logging.info(f"Ready to serve {len(bot.guilds)} guilds {ready:.2f}s after {'launch' if cold_start else 'reconnecting'} ({added} new guilds registered).")
+    cold_start = False
+    # Finish any lockdowns/reopens that were cut short by the last shutdown
+    await bot.resume_operations()
+    await bot.prune_history()
 
 @bot.event
 async def on_guild_join(guild: discord.Guild):
     await bot.update_guilds()
     await asyncio.sleep(2)
-    await guild.owner.send(bot.config['Messages']['on_guild_join_owner_dm'].format(owner_mention=guild.owner.mention, guild_name=guild.name))
+    # Members are not cached in the lean gateway mode, so the owner may need to be fetched
+    owner = await bot.get_or_fetch_user(guild.owner_id)
+    await owner.send(bot.config['Messages']['on_guild_join_owner_dm'].format(owner_mention=owner.mention, guild_name=guild.name))
 
 if bot.config['Bot']['jishaku']:
-    bot.load_extension('jishaku')
-    logging.info("Loaded jishaku")
+    if bot.prefix_commands:
+        bot.load_extension('jishaku')
+        logging.info("Loaded jishaku")
+    else:
+        logging.warning("Not loading jishaku, which needs Bot.gateway_mode to be 'full'.")
 
 try:
     bot.run(bot.config['Bot']['token'])
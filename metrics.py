@@ -0,0 +1,292 @@
+import re
+import time
+import bisect
+import logging
+import contextlib
+from typing import Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+from aiohttp import web
+
+logger = logging.getLogger('metrics')
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+_SNOWFLAKE = re.compile(r"/\d{5,}")
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{k}="{_escape(v)}"' for k, v in zip(names, values)]
+    if extra != "":
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if len(pairs) > 0 else ""
+
+class Metric:
+    """
+    A named family of samples, one per combination of label values.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Mapping[str, object]) -> Tuple[str, ...]:
+        return tuple(str(labels[x]) for x in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key in sorted(self._values):
+            lines.extend(self._render_sample(key))
+        return lines
+
+    def _render_sample(self, key: Tuple[str, ...]) -> List[str]:
+        raise NotImplementedError
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def items(self) -> Iterator[Tuple[Dict[str, str], float]]:
+        for key, value in self._values.items():
+            yield dict(zip(self.labelnames, key)), value
+
+    def _render_sample(self, key: Tuple[str, ...]) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {self._values[key]}"]
+
+class HistogramSample:
+    __slots__ = ('counts', 'count', 'sum', 'last')
+
+    def __init__(self, buckets: int):
+        # Per-bucket counts, not cumulative; the last one is the +Inf bucket
+        self.counts = [0] * (buckets + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.last = 0.0
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        sample = self._values.get(key)
+        if sample == None:
+            sample = self._values[key] = HistogramSample(len(self.buckets))
+        sample.counts[bisect.bisect_left(self.buckets, value)] += 1
+        sample.count += 1
+        sample.sum += value
+        sample.last = value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get(self, **labels) -> Optional[HistogramSample]:
+        return self._values.get(self._key(labels))
+
+    def items(self) -> Iterator[Tuple[Dict[str, str], HistogramSample]]:
+        for key, sample in self._values.items():
+            yield dict(zip(self.labelnames, key)), sample
+
+    def quantile(self, q: float, sample: HistogramSample) -> Optional[float]:
+        """
+        Estimates a quantile from the bucket counts, interpolating within the bucket it falls in (the same as Prometheus' histogram_quantile()).
+        """
+        if sample.count == 0:
+            return None
+        rank = q * sample.count
+        seen = 0
+        for i, count in enumerate(sample.counts):
+            if count > 0 and seen + count >= rank:
+                if i == len(self.buckets):
+                    # Beyond the largest bucket; its bound is the best estimate there is
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def _render_sample(self, key: Tuple[str, ...]) -> List[str]:
+        sample = self._values[key]
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), sample.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            labels = _format_labels(self.labelnames, key, 'le="' + le + '"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {sample.sum}")
+        lines.append(f"{self.name}_count{labels} {sample.count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+OPERATIONS = REGISTRY.register(Counter("curfewbot_operations_total", "Lockdowns and reopens by outcome.", ("action", "status")))
+OPERATION_SECONDS = REGISTRY.register(Histogram("curfewbot_operation_seconds", "Total duration of lockdowns and reopens.", ("action",)))
+PHASE_SECONDS = REGISTRY.register(Histogram("curfewbot_operation_phase_seconds", "Time each lockdown or reopen spent per phase: planning, channel edits, role edits, database writes and event dispatch.", ("action", "phase")))
+API_REQUESTS = REGISTRY.register(Counter("curfewbot_api_requests_total", "Discord API responses by route and status code.", ("route", "status")))
+API_RATE_LIMITS = REGISTRY.register(Counter("curfewbot_api_rate_limits_total", "429 responses from the Discord API by route and scope.", ("route", "scope")))
+SCHEDULER_LAG = REGISTRY.register(Histogram("curfewbot_scheduler_lag_seconds", "Delay between a calendar task's scheduled time and when it was started.", ("action",)))
+READY_SECONDS = REGISTRY.register(Histogram("curfewbot_ready_seconds", "Time from starting or reconnecting until the bot is ready to serve, and the part of it spent per step.", ("start", "step")))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram("curfewbot_db_query_seconds", "Latency of database statements by database and statement type.", ("database", "statement"), buckets=QUERY_BUCKETS))
+
+class OperationTimer:
+    """
+    Adds up the time a single lockdown or reopen spends in each phase, and records it once the operation is finished.
+    """
+
+    __slots__ = ('action', 'start', 'phases')
+
+    def __init__(self, action: str):
+        self.action = action
+        self.start = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def finish(self, status: str):
+        OPERATIONS.inc(action=self.action, status=status)
+        OPERATION_SECONDS.observe(time.perf_counter() - self.start, action=self.action)
+        for name, seconds in self.phases.items():
+            PHASE_SECONDS.observe(seconds, action=self.action, phase=name)
+
+def route_label(key: str) -> str:
+    # Rate limit keys contain the channel or guild ID, which would make a sample per channel
+    return _SNOWFLAKE.sub("/{id}", key)
+
+def observe_response(key: str, status: int, headers: Mapping[str, str]):
+    """
+    Callback for RequestScheduler.on_response.
+    """
+    route = route_label(key)
+    API_REQUESTS.inc(route=route, status=status)
+    if status == 429:
+        API_RATE_LIMITS.inc(route=route, scope=headers.get('X-RateLimit-Scope', 'global' if headers.get('X-RateLimit-Global', '').lower() == 'true' else 'user'))
+
+def observe_query(database: str, sql: str, seconds: float):
+    """
+    Callback for DatabasePool.on_query, with the database's name bound.
+    """
+    words = sql.split(None, 1)
+    DB_QUERY_SECONDS.observe(seconds, database=database, statement=words[0].upper() if len(words) > 0 else "")
+
+def _format_seconds(seconds: Optional[float]) -> str:
+    if seconds == None:
+        return "-"
+    return f"{seconds * 1000:.1f}ms" if seconds < 1 else f"{seconds:.2f}s"
+
+def summary(top_routes: int = 5) -> str:
+    """
+    A short plain text digest of the metrics, for the /stats command.
+    """
+    lines = ["Operations"]
+    for labels, sample in sorted(OPERATION_SECONDS.items(), key=lambda x: x[0]['action']):
+        action = labels['action']
+        outcomes = ", ".join(f"{x['status']} {v:g}" for x, v in OPERATIONS.items() if x['action'] == action)
+        lines.append(f"  {action}: {outcomes}; p50 {_format_seconds(OPERATION_SECONDS.quantile(0.5, sample))}, p95 {_format_seconds(OPERATION_SECONDS.quantile(0.95, sample))}")
+        phases = [(x['phase'], v) for x, v in PHASE_SECONDS.items() if x['action'] == action]
+        if len(phases) > 0:
+            lines.append("    mean per phase: " + ", ".join(f"{name} {_format_seconds(v.sum / v.count)}" for name, v in sorted(phases)))
+    if len(lines) == 1:
+        lines.append("  none yet")
+
+    requests = {}
+    for labels, value in API_REQUESTS.items():
+        requests[labels['route']] = requests.get(labels['route'], 0) + value
+    rate_limits = {}
+    for labels, value in API_RATE_LIMITS.items():
+        rate_limits[labels['route']] = rate_limits.get(labels['route'], 0) + value
+    lines.append(f"API: {sum(requests.values()):g} responses, {sum(rate_limits.values()):g} rate limited")
+    for route, count in sorted(requests.items(), key=lambda x: -x[1])[:top_routes]:
+        lines.append(f"  {route}: {count:g} ({rate_limits.get(route, 0):g} rate limited)")
+
+    lines.append("Scheduler lag")
+    for labels, sample in SCHEDULER_LAG.items():
+        lines.append(f"  {labels['action']}: last {_format_seconds(sample.last)}, p95 {_format_seconds(SCHEDULER_LAG.quantile(0.95, sample))} over {sample.count} tasks")
+
+    for labels, sample in sorted(READY_SECONDS.items(), key=lambda x: x[0]['start']):
+        if labels['step'] == "total":
+            lines.append(f"Ready after {labels['start']} start: last {_format_seconds(sample.last)} over {sample.count}")
+
+    queries = {}
+    for labels, sample in DB_QUERY_SECONDS.items():
+        queries.setdefault(labels['database'], []).append((labels['statement'], sample))
+    lines.append("Database")
+    for database, samples in sorted(queries.items()):
+        count = sum(x[1].count for x in samples)
+        slowest = max(samples, key=lambda x: DB_QUERY_SECONDS.quantile(0.95, x[1]))
+        lines.append(f"  {database}: {count} statements, mean {_format_seconds(sum(x[1].sum for x in samples) / count)}, slowest p95 {slowest[0]} {_format_seconds(DB_QUERY_SECONDS.quantile(0.95, slowest[1]))}")
+    return "\n".join(lines)
+
+class MetricsServer:
+    """
+    Serves a registry in the Prometheus text format over HTTP, at /metrics.
+    """
+
+    def __init__(self, registry: Registry = REGISTRY, host: str = "127.0.0.1", port: int = 9108):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8", headers={"X-Content-Type-Options": "nosniff"})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Serving metrics at http://{self.host}:{self.port}/metrics.")
+
+    async def stop(self):
+        if self._runner != None:
+            await self._runner.cleanup()
+            self._runner = None
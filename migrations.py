@@ -0,0 +1,166 @@
+"""
+Schema migrations, applied in order by database.migrate() when the connection pools are opened.
+Append new scripts to the end of a list; never edit or reorder scripts that have already shipped.
+"""
+
+MAIN_MIGRATIONS = [
+    # 1: Lockdown/reopen journal
+    """
+    CREATE TABLE IF NOT EXISTS "OPERATIONS" (
+        "OPERATION_ID"	INTEGER NOT NULL,
+        "GUILD_ID"	INTEGER NOT NULL,
+        "ACTION"	TEXT NOT NULL CHECK("ACTION" == 'lockdown' OR "ACTION" == 'reopen'),
+        "STATUS"	TEXT NOT NULL DEFAULT 'running' CHECK("STATUS" IN ('running', 'completed', 'failed', 'abandoned')),
+        "STARTED_TIMESTAMP"	NUMERIC NOT NULL,
+        "FINISHED_TIMESTAMP"	NUMERIC,
+        "INPUT"	TEXT,
+        PRIMARY KEY("OPERATION_ID" AUTOINCREMENT)
+    );
+    CREATE INDEX IF NOT EXISTS "OPERATIONS_BY_STATUS" ON "OPERATIONS" ("STATUS", "GUILD_ID");
+    CREATE TABLE IF NOT EXISTS "OPERATION_STEPS" (
+        "OPERATION_ID"	INTEGER NOT NULL REFERENCES "OPERATIONS"("OPERATION_ID") ON DELETE CASCADE,
+        "STEP"	INTEGER NOT NULL,
+        "KIND"	TEXT NOT NULL,
+        "TARGET_ID"	INTEGER NOT NULL,
+        "DATA"	TEXT,
+        PRIMARY KEY("OPERATION_ID", "STEP")
+    ) WITHOUT ROWID;
+    """,
+    # 2: Lockdown history, replacing STATE_INFO.LAST_LOCKDOWN_REPORT
+    """
+    ALTER TABLE "OPERATIONS" ADD COLUMN "REPORT_HEADER" TEXT;
+    CREATE INDEX IF NOT EXISTS "OPERATIONS_BY_GUILD" ON "OPERATIONS" ("GUILD_ID", "ACTION", "OPERATION_ID");
+    CREATE TABLE IF NOT EXISTS "REPORT_OVERWRITES" (
+        "OPERATION_ID"	INTEGER NOT NULL REFERENCES "OPERATIONS"("OPERATION_ID") ON DELETE CASCADE,
+        "CHANNEL_ID"	INTEGER NOT NULL,
+        "ROLE_ID"	INTEGER NOT NULL,
+        "PREVIOUS_STATE"	INTEGER NOT NULL CHECK("PREVIOUS_STATE" IN (-1, 0, 1)),
+        PRIMARY KEY("OPERATION_ID", "CHANNEL_ID", "ROLE_ID")
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS "REPORT_TARGETS" (
+        "OPERATION_ID"	INTEGER NOT NULL REFERENCES "OPERATIONS"("OPERATION_ID") ON DELETE CASCADE,
+        "KIND"	TEXT NOT NULL,
+        "TARGET_ID"	INTEGER NOT NULL,
+        "PARENT_ID"	INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS "REPORT_TARGETS_BY_OPERATION" ON "REPORT_TARGETS" ("OPERATION_ID", "KIND");
+
+    -- Existing reports become completed lockdown operations
+    INSERT INTO "OPERATIONS" ("GUILD_ID", "ACTION", "STATUS", "STARTED_TIMESTAMP", "FINISHED_TIMESTAMP", "INPUT", "REPORT_HEADER")
+        SELECT "GUILD_ID", 'lockdown', 'completed', COALESCE(json_extract("LAST_LOCKDOWN_REPORT", '$.meta.timestamp'), "LAST_LOCKDOWN", 0), COALESCE(json_extract("LAST_LOCKDOWN_REPORT", '$.meta.timestamp'), "LAST_LOCKDOWN", 0), '{"migrated": true}',
+            json_object('affected_channels', json('{}'), 'affected_roles', json('[]'), 'no_perms_channels', json('[]'), 'no_perms_roles', json('[]'), 'meta', json(COALESCE(json_extract("LAST_LOCKDOWN_REPORT", '$.meta'), '{}')))
+        FROM "STATE_INFO" WHERE "LAST_LOCKDOWN_REPORT" IS NOT NULL AND json_valid("LAST_LOCKDOWN_REPORT");
+    CREATE TEMP TABLE "MIGRATED_REPORTS" AS
+        SELECT o."OPERATION_ID" AS "OPERATION_ID", s."LAST_LOCKDOWN_REPORT" AS "REPORT" FROM "OPERATIONS" o JOIN "STATE_INFO" s ON s."GUILD_ID" = o."GUILD_ID" WHERE o."INPUT" = '{"migrated": true}';
+    INSERT OR IGNORE INTO "REPORT_OVERWRITES" ("OPERATION_ID", "CHANNEL_ID", "ROLE_ID", "PREVIOUS_STATE")
+        SELECT m."OPERATION_ID", CAST(c.key AS INTEGER), json_extract(r.value, '$[0]'), json_extract(r.value, '$[1]')
+        FROM "MIGRATED_REPORTS" m, json_each(m."REPORT", '$.affected_channels') c, json_each(c.value) r;
+    INSERT INTO "REPORT_TARGETS" ("OPERATION_ID", "KIND", "TARGET_ID")
+        SELECT m."OPERATION_ID", k.key, t.value
+        FROM "MIGRATED_REPORTS" m, json_each(m."REPORT") k, json_each(k.value) t
+        WHERE k.key IN ('affected_roles', 'no_perms_channels', 'no_perms_roles');
+    DROP TABLE "MIGRATED_REPORTS";
+    UPDATE "STATE_INFO" SET "LAST_LOCKDOWN_REPORT" = NULL WHERE json_valid("LAST_LOCKDOWN_REPORT");
+    """,
+    # 3: Calendar groups
+    """
+    ALTER TABLE "GUILD_SETTINGS" ADD COLUMN "CALENDAR_GROUP" TEXT NOT NULL DEFAULT 'default';
+    CREATE INDEX IF NOT EXISTS "GUILD_SETTINGS_BY_CALENDAR_GROUP" ON "GUILD_SETTINGS" ("CALENDAR_GROUP", "USE_CALENDAR");
+    """,
+    # 4: State the bot keeps between runs, such as the hash of the last command tree synced with Discord
+    """
+    CREATE TABLE IF NOT EXISTS "BOT_STATE" (
+        "KEY"	TEXT NOT NULL,
+        "VALUE"	TEXT,
+        PRIMARY KEY("KEY")
+    ) WITHOUT ROWID;
+    """
+]
+
+CALENDAR_MIGRATIONS = [
+    # 1: Calendar groups. SCHEDULED_TIMESTAMP is only unique within a group now, which needs the table to be rebuilt
+    """
+    CREATE TABLE "CALENDAR_NEW" (
+        "TASK_ID"	INTEGER NOT NULL,
+        "CALENDAR_GROUP"	TEXT NOT NULL DEFAULT 'default',
+        "ACTION"	TEXT NOT NULL,
+        "COMPLETED"	INTEGER NOT NULL DEFAULT 0 CHECK("COMPLETED"=0 OR COMPLETED=1),
+        "CREATION_TIMESTAMP"	NUMERIC NOT NULL,
+        "SCHEDULED_TIMESTAMP"	NUMERIC NOT NULL,
+        "COMPLETION_TIMESTAMP"	NUMERIC,
+        PRIMARY KEY("TASK_ID"),
+        UNIQUE("CALENDAR_GROUP", "SCHEDULED_TIMESTAMP")
+    );
+    INSERT INTO "CALENDAR_NEW" ("ACTION", "COMPLETED", "CREATION_TIMESTAMP", "SCHEDULED_TIMESTAMP", "COMPLETION_TIMESTAMP")
+        SELECT "ACTION", "COMPLETED", "CREATION_TIMESTAMP", "SCHEDULED_TIMESTAMP", "COMPLETION_TIMESTAMP" FROM "CALENDAR" ORDER BY "SCHEDULED_TIMESTAMP";
+    DROP TABLE "CALENDAR";
+    ALTER TABLE "CALENDAR_NEW" RENAME TO "CALENDAR";
+    -- Next pending tasks overall, and per group; both are a single index seek
+    CREATE INDEX "CALENDAR_PENDING" ON "CALENDAR" ("COMPLETED", "SCHEDULED_TIMESTAMP");
+    CREATE INDEX "CALENDAR_PENDING_BY_GROUP" ON "CALENDAR" ("CALENDAR_GROUP", "COMPLETED", "SCHEDULED_TIMESTAMP");
+    """,
+    # 2: Content hashes of the calendars synced into each group by calendar_reader.py
+    """
+    CREATE TABLE IF NOT EXISTS "CALENDAR_SOURCES" (
+        "CALENDAR_GROUP"	TEXT NOT NULL,
+        "CONTENT_HASH"	TEXT NOT NULL,
+        "SOURCE_PATH"	TEXT,
+        "SYNC_TIMESTAMP"	NUMERIC NOT NULL,
+        PRIMARY KEY("CALENDAR_GROUP")
+    );
+    """,
+    # 3: Recurring schedules, expanded by the scheduler instead of being stored as one row per task
+    """
+    -- TIMEZONE is an IANA name (NULL for the bot's local time). Tasks up to LAST_FIRED_TIMESTAMP have been performed
+    CREATE TABLE IF NOT EXISTS "SCHEDULE_GROUPS" (
+        "CALENDAR_GROUP"	TEXT NOT NULL,
+        "TIMEZONE"	TEXT,
+        "LAST_FIRED_TIMESTAMP"	NUMERIC,
+        PRIMARY KEY("CALENDAR_GROUP")
+    );
+    -- The tasks of each named day type, at local times ('HH:MM')
+    CREATE TABLE IF NOT EXISTS "SCHEDULE_TEMPLATES" (
+        "CALENDAR_GROUP"	TEXT NOT NULL,
+        "DAY_TYPE"	TEXT NOT NULL,
+        "LOCAL_TIME"	TEXT NOT NULL CHECK(time("LOCAL_TIME") IS NOT NULL),
+        "ACTION"	TEXT NOT NULL CHECK("ACTION" == 'LOCKDOWN' OR "ACTION" == 'REOPEN'),
+        PRIMARY KEY("CALENDAR_GROUP", "DAY_TYPE", "LOCAL_TIME")
+    ) WITHOUT ROWID;
+    -- Every date from START_DATE to END_DATE (open-ended if NULL) on one of WEEKDAYS (ISO numbers, e.g. '12345' for Monday-Friday) is of DAY_TYPE
+    CREATE TABLE IF NOT EXISTS "SCHEDULE_RULES" (
+        "RULE_ID"	INTEGER NOT NULL,
+        "CALENDAR_GROUP"	TEXT NOT NULL,
+        "DAY_TYPE"	TEXT NOT NULL,
+        "WEEKDAYS"	TEXT NOT NULL DEFAULT '12345',
+        "START_DATE"	TEXT NOT NULL CHECK(date("START_DATE") IS NOT NULL),
+        "END_DATE"	TEXT CHECK("END_DATE" IS NULL OR date("END_DATE") IS NOT NULL),
+        "PRIORITY"	INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY("RULE_ID")
+    );
+    CREATE INDEX IF NOT EXISTS "SCHEDULE_RULES_BY_GROUP" ON "SCHEDULE_RULES" ("CALENDAR_GROUP");
+    -- Overrides the rules for a single date. A NULL DAY_TYPE means no tasks that day
+    CREATE TABLE IF NOT EXISTS "SCHEDULE_EXCEPTIONS" (
+        "CALENDAR_GROUP"	TEXT NOT NULL,
+        "DATE"	TEXT NOT NULL CHECK(date("DATE") IS NOT NULL),
+        "DAY_TYPE"	TEXT,
+        PRIMARY KEY("CALENDAR_GROUP", "DATE")
+    ) WITHOUT ROWID;
+    """,
+    # 4: Progress of each cluster (bot process) through the calendar, for bots whose shards are split between processes
+    """
+    -- Clusters that have performed a stored task. The task is marked COMPLETED once every cluster has
+    CREATE TABLE IF NOT EXISTS "CLUSTER_TASKS" (
+        "TASK_ID"	INTEGER NOT NULL,
+        "CLUSTER_ID"	INTEGER NOT NULL,
+        "COMPLETION_TIMESTAMP"	NUMERIC NOT NULL,
+        PRIMARY KEY("TASK_ID", "CLUSTER_ID")
+    ) WITHOUT ROWID;
+    -- Each cluster's last fired task of a recurring schedule. SCHEDULE_GROUPS.LAST_FIRED_TIMESTAMP follows once every cluster has fired it
+    CREATE TABLE IF NOT EXISTS "CLUSTER_SCHEDULES" (
+        "CALENDAR_GROUP"	TEXT NOT NULL,
+        "CLUSTER_ID"	INTEGER NOT NULL,
+        "LAST_FIRED_TIMESTAMP"	NUMERIC NOT NULL,
+        PRIMARY KEY("CALENDAR_GROUP", "CLUSTER_ID")
+    ) WITHOUT ROWID;
+    """
+]
@@ -0,0 +1,228 @@
+import re
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Mapping, Optional
+
+import aiohttp
+from yarl import URL
+
+logger = logging.getLogger('ratelimit')
+
+# Methods that are paced by the scheduler; reads are passed straight through
+MUTATING_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+# Length of the global rate limit window, with some slack for the time requests spend in transit
+GLOBAL_WINDOW = 1.05
+
+# Whether aiohttp takes per-request middlewares, which is how the scheduler sees the headers of the bot's responses
+SUPPORTS_MIDDLEWARES = hasattr(aiohttp, 'ClientMiddlewareType')
+
+# Seconds between sweeps of idle buckets, which would otherwise pile up for every channel ever edited
+BUCKET_SWEEP_INTERVAL = 60
+
+_API_PREFIX = re.compile(r"^/api(/v\d+)?")
+_MAJOR_PARAMETER = re.compile(r"^/(channels|guilds|webhooks)/(\d+)")
+_SNOWFLAKE = re.compile(r"/\d{5,}")
+
+def route_key(method: str, url: str) -> str:
+    """
+    Reduces a request to the key Discord rate limits it by: the method, the path with minor IDs templated out, and the major parameter (channel, guild or webhook ID).
+    e.g. PUT https://discord.com/api/v10/channels/1/permissions/2 -> "PUT /channels/1/permissions/{id}"
+    """
+    path = _API_PREFIX.sub("", URL(url).path)
+    major = _MAJOR_PARAMETER.match(path)
+    if major == None:
+        return f"{method.upper()} {_SNOWFLAKE.sub('/{id}', path)}"
+    return f"{method.upper()} {major.group(0)}{_SNOWFLAKE.sub('/{id}', path[major.end():])}"
+
+class Bucket:
+    """
+    Rate limit state of a single route, as last reported by Discord.
+    Until the first response arrives the limit is unknown, so only one request is let through at a time.
+    """
+
+    __slots__ = ('limit', 'remaining', 'reset_at', 'outgoing', 'learned', 'lock', 'changed')
+
+    def __init__(self):
+        self.limit = 1
+        self.remaining = 1
+        self.reset_at = 0.0
+        self.outgoing = 0
+        self.learned = False
+        self.lock = asyncio.Lock()
+        self.changed = asyncio.Event()
+
+class RateLimited(Exception):
+    """
+    Raised by RequestScheduler.request() when a request is still being rate limited after every retry.
+    """
+
+    def __init__(self, key: str, retry_after: float):
+        super(RateLimited, self).__init__(f"Route '{key}' is rate limited for another {retry_after:.2f}s")
+        self.key = key
+        self.retry_after = retry_after
+
+class RequestScheduler:
+    """
+    Central pacing for Discord mutations. Tracks per-route buckets and the global limit from response headers, and holds requests back only when a bucket is actually exhausted.
+    """
+
+    def __init__(self, global_limit: int = 50, max_retries: int = 3):
+        self.global_limit = global_limit
+        self.max_retries = max_retries
+        self._buckets: Dict[str, Bucket] = {}
+        self._global_sends: Deque[float] = deque()
+        self._global_reset_at = 0.0
+        self._global_lock = asyncio.Lock()
+        self._next_sweep = 0.0
+        # Optional callback(key, status, headers), e.g. for metrics
+        self.on_response: Optional[Callable[[str, int, Mapping[str, str]], None]] = None
+
+    def get_bucket(self, key: str) -> Bucket:
+        bucket = self._buckets.get(key)
+        if bucket == None:
+            self.evict_idle_buckets()
+            bucket = self._buckets[key] = Bucket()
+        return bucket
+
+    def evict_idle_buckets(self):
+        """
+        Drops the buckets with no requests in flight or waiting whose window has reset, at most once every BUCKET_SWEEP_INTERVAL seconds.
+        A route whose bucket was dropped relearns its limit from its next response.
+        """
+        now = time.monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + BUCKET_SWEEP_INTERVAL
+        idle = [k for k, v in self._buckets.items() if v.outgoing == 0 and v.reset_at <= now and not v.lock.locked()]
+        for key in idle:
+            del self._buckets[key]
+
+    async def _acquire_global(self):
+        async with self._global_lock:
+            while True:
+                now = time.monotonic()
+                if self._global_reset_at > now:
+                    await asyncio.sleep(self._global_reset_at - now)
+                    continue
+                while len(self._global_sends) > 0 and self._global_sends[0] <= now - GLOBAL_WINDOW:
+                    self._global_sends.popleft()
+                if len(self._global_sends) < self.global_limit:
+                    self._global_sends.append(now)
+                    return
+                await asyncio.sleep(self._global_sends[0] + GLOBAL_WINDOW - now)
+
+    async def acquire(self, key: str):
+        """
+        Waits until a request on the given route may be sent, and reserves it.
+        """
+        bucket = self.get_bucket(key)
+        async with bucket.lock:
+            while True:
+                now = time.monotonic()
+                if not bucket.learned and bucket.outgoing > 0:
+                    # Wait for the first response to tell us the real limit
+                    bucket.changed.clear()
+                    await bucket.changed.wait()
+                    continue
+                if bucket.reset_at <= now and bucket.remaining <= 0:
+                    bucket.remaining = bucket.limit
+                if bucket.remaining > 0:
+                    break
+                await asyncio.sleep(bucket.reset_at - now)
+            bucket.remaining -= 1
+            bucket.outgoing += 1
+        await self._acquire_global()
+
+    def release(self, key: str):
+        bucket = self.get_bucket(key)
+        bucket.outgoing = max(0, bucket.outgoing - 1)
+        bucket.changed.set()
+
+    def observe(self, key: str, status: int, headers: Mapping[str, str]):
+        """
+        Updates the bucket (and global) state from the headers of a response on the given route.
+        """
+        bucket = self.get_bucket(key)
+        now = time.monotonic()
+
+        if 'X-RateLimit-Limit' in headers:
+            bucket.limit = int(headers['X-RateLimit-Limit'])
+            bucket.learned = True
+        if 'X-RateLimit-Remaining' in headers:
+            # Requests reserved after this one was sent are still in flight
+            bucket.remaining = int(headers['X-RateLimit-Remaining']) - max(0, bucket.outgoing - 1)
+        if 'X-RateLimit-Reset-After' in headers:
+            bucket.reset_at = now + float(headers['X-RateLimit-Reset-After'])
+
+        if status == 429:
+            retry_after = float(headers.get('Retry-After', headers.get('X-RateLimit-Reset-After', 1)))
+            if headers.get('X-RateLimit-Global', '').lower() == 'true' or headers.get('X-RateLimit-Scope') == 'global':
+                self._global_reset_at = max(self._global_reset_at, now + retry_after)
+                logger.warning(f"Hit the global rate limit, pausing all requests for {retry_after:.2f}s.")
+            else:
+                bucket.remaining = 0
+                bucket.reset_at = max(bucket.reset_at, now + retry_after)
+                logger.warning(f"Rate limited on route '{key}' for {retry_after:.2f}s.")
+
+        bucket.changed.set()
+        if self.on_response != None:
+            self.on_response(key, status, headers)
+
+    async def middleware(self, request: aiohttp.ClientRequest, handler: Callable[[aiohttp.ClientRequest], Awaitable[aiohttp.ClientResponse]]) -> aiohttp.ClientResponse:
+        """
+        An aiohttp client middleware that feeds the headers of every response into observe().
+        """
+        response = await handler(request)
+        self.observe(route_key(request.method, str(request.url)), response.status, response.headers)
+        return response
+
+    async def run(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Calls func once the route's bucket allows it. Headers must be delivered to observe() separately (see middleware()).
+        """
+        await self.acquire(key)
+        try:
+            return await func()
+        finally:
+            self.release(key)
+
+    async def request(self, session: aiohttp.ClientSession, method: str, url: str, **kwargs) -> aiohttp.ClientResponse:
+        """
+        Sends a request through the scheduler with a plain aiohttp session, retrying 429 responses.
+        The response body is read before returning.
+        """
+        key = route_key(method, url)
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(key)
+            try:
+                response = await session.request(method, url, **kwargs)
+                await response.read()
+                self.observe(key, response.status, response.headers)
+            finally:
+                self.release(key)
+            if response.status != 429:
+                return response
+        raise RateLimited(key, float(response.headers.get('Retry-After', 0)))
+
+    def install(self, http: Any):
+        """
+        Routes the mutations of a discord.py HTTPClient through the scheduler, and has every request it sends report its response headers through middleware().
+        Only public interfaces are used: HTTPClient.request() passes extra keyword arguments on to aiohttp, which takes per-request middlewares (aiohttp 3.12+).
+        py-cord's own per-bucket locks still apply underneath; the scheduler adds the global limit and lets a bucket's remaining requests go out together.
+        """
+        if not SUPPORTS_MIDDLEWARES:
+            logger.warning(f"aiohttp {aiohttp.__version__} does not support client middlewares (3.12+ is needed); Discord mutations are left to py-cord's own rate limiting.")
+            return
+        original_request = http.request
+        middlewares = (self.middleware,)
+
+        async def request(route, **kwargs):
+            kwargs['middlewares'] = middlewares
+            if route.method.upper() not in MUTATING_METHODS:
+                return await original_request(route, **kwargs)
+            return await self.run(route_key(route.method, route.url), lambda: original_request(route, **kwargs))
+
+        http.request = request
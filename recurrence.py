@@ -0,0 +1,112 @@
+import datetime
+import logging
+import aiosqlite
+from typing import Dict, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+logger = logging.getLogger('recurrence')
+
+class GroupSchedule:
+    """
+    A calendar group's recurring schedule: named day types with their task times (templates), weekday recurrence rules and per-date exceptions.
+    Tasks are never stored; fire_times() works them out a day at a time, for a window of dates loaded up front.
+    """
+
+    __slots__ = ('group', 'timezone', 'last_fired', 'templates', 'rules', 'exceptions', 'first_date', 'last_date')
+
+    def __init__(self, group: str, timezone: Optional[str], last_fired: Optional[float], templates: Dict[str, List[Tuple[datetime.time, str]]], rules: List[tuple], exceptions: Dict[datetime.date, Optional[str]], first_date: datetime.date, last_date: datetime.date):
+        self.group = group
+        # None means the bot's local time
+        self.timezone = None
+        if timezone != None:
+            try:
+                self.timezone = ZoneInfo(timezone)
+            except ZoneInfoNotFoundError:
+                logger.error(f"Unknown time zone '{timezone}' for calendar group '{group}'; using local time instead.")
+        self.last_fired = last_fired
+        self.templates = templates
+        # (weekdays, start date, end date or None, day type), highest priority first
+        self.rules = rules
+        # Dates whose day type is overridden; None means no tasks that day
+        self.exceptions = exceptions
+        self.first_date = first_date
+        self.last_date = last_date
+
+    def day_type(self, date: datetime.date) -> Optional[str]:
+        if date in self.exceptions:
+            return self.exceptions[date]
+        for weekdays, start, end, day_type in self.rules:
+            if start <= date and (end == None or date <= end) and date.isoweekday() in weekdays:
+                return day_type
+        return None
+
+    def fire_times(self, after: float) -> Iterator[Tuple[float, str]]:
+        """
+        Yields the (timestamp, action) of every task after the given timestamp, in order, up to the end of the loaded window.
+        """
+        date = max(self.first_date, datetime.datetime.fromtimestamp(after, tz=self.timezone).date())
+        while date <= self.last_date:
+            day_type = self.day_type(date)
+            for local_time, action in self.templates.get(day_type, []) if day_type != None else []:
+                timestamp = datetime.datetime.combine(date, local_time, tzinfo=self.timezone).timestamp()
+                if timestamp > after:
+                    yield timestamp, action
+            date += datetime.timedelta(days=1)
+
+    def next_tasks(self, now: float) -> List[Tuple[float, str]]:
+        """
+        Returns the latest task that is due but has not fired yet (if any), followed by the first upcoming task.
+        """
+        result = []
+        overdue = None
+        for timestamp, action in self.fire_times(self.last_fired if self.last_fired != None else now):
+            if timestamp <= now:
+                overdue = (timestamp, action)
+                continue
+            result.append((timestamp, action))
+            break
+        return ([overdue] if overdue != None else []) + result
+
+async def load_schedules(cal: aiosqlite.Connection, start: float, end: float, group: Optional[str] = None, cluster_id: int = 0) -> Dict[str, GroupSchedule]:
+    """
+    Loads the recurring schedules of every calendar group (or just the given one), with the exceptions for dates from each group's last fired task (or `start`) to `end`.
+    Tasks are fired from where the given cluster left off.
+    """
+    schedules = {}
+    groups = await cal.execute_fetchall(
+        """SELECT g.CALENDAR_GROUP, g.TIMEZONE, MAX(COALESCE(g.LAST_FIRED_TIMESTAMP, c.LAST_FIRED_TIMESTAMP), COALESCE(c.LAST_FIRED_TIMESTAMP, g.LAST_FIRED_TIMESTAMP))
+        FROM SCHEDULE_GROUPS g LEFT JOIN CLUSTER_SCHEDULES c ON c.CALENDAR_GROUP=g.CALENDAR_GROUP AND c.CLUSTER_ID=?
+        WHERE ? IS NULL OR g.CALENDAR_GROUP=?""",
+        (cluster_id, group, group)
+    )
+    for name, timezone, last_fired in groups:
+        templates = {}
+        for day_type, local_time, action in await cal.execute_fetchall("SELECT DAY_TYPE, LOCAL_TIME, ACTION FROM SCHEDULE_TEMPLATES WHERE CALENDAR_GROUP=? ORDER BY LOCAL_TIME", (name,)):
+            templates.setdefault(day_type, []).append((datetime.time.fromisoformat(local_time), action))
+        rules = [
+            ({int(x) for x in r[0]}, datetime.date.fromisoformat(r[1]), datetime.date.fromisoformat(r[2]) if r[2] != None else None, r[3])
+            for r in await cal.execute_fetchall("SELECT WEEKDAYS, START_DATE, END_DATE, DAY_TYPE FROM SCHEDULE_RULES WHERE CALENDAR_GROUP=? ORDER BY PRIORITY DESC, RULE_ID DESC", (name,))
+        ]
+
+        # A day of slack on each side covers time zones differing from the bot's local time
+        first_date = datetime.date.fromtimestamp(min(start, last_fired) if last_fired != None else start) - datetime.timedelta(days=1)
+        last_date = datetime.date.fromtimestamp(end) + datetime.timedelta(days=1)
+        exceptions = {
+            datetime.date.fromisoformat(r[0]): r[1]
+            for r in await cal.execute_fetchall("SELECT DATE, DAY_TYPE FROM SCHEDULE_EXCEPTIONS WHERE CALENDAR_GROUP=? AND DATE BETWEEN ? AND ?", (name, first_date.isoformat(), last_date.isoformat()))
+        }
+        schedules[name] = GroupSchedule(name, timezone, last_fired, templates, rules, exceptions, first_date, last_date)
+    return schedules
+
+async def next_task(cal: aiosqlite.Connection, group: str, now: float, lookahead_days: float, cluster_id: int = 0) -> Optional[Tuple[float, str]]:
+    """
+    The group's next pending task, whether it is a stored calendar row or comes from its recurring schedule.
+    """
+    candidates = []
+    row = await (await cal.execute("SELECT SCHEDULED_TIMESTAMP, ACTION FROM CALENDAR WHERE CALENDAR_GROUP=? AND COMPLETED=0 AND TASK_ID NOT IN (SELECT TASK_ID FROM CLUSTER_TASKS WHERE CLUSTER_ID=?) ORDER BY SCHEDULED_TIMESTAMP LIMIT 1", (group, cluster_id))).fetchone()
+    if row != None:
+        candidates.append(tuple(row))
+    schedule = (await load_schedules(cal, now, now + lookahead_days * 86400, group=group, cluster_id=cluster_id)).get(group)
+    if schedule != None:
+        candidates.extend(schedule.next_tasks(now)[:1])
+    return min(candidates) if len(candidates) > 0 else None
@@ -0,0 +1,162 @@
+import zlib
+import gzip
+import json
+import asyncio
+from io import BytesIO
+from typing import Any, Optional
+import discord
+
+# First bytes of every gzip stream
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Discord snowflakes are unsigned 64-bit integers; IDs from 2015 on have 17 digits, newer ones 19 and eventually 20
+MIN_SNOWFLAKE = 10 ** 16
+MAX_SNOWFLAKE = 2 ** 64 - 1
+
+# Keys of a lockdown report holding lists of IDs
+ID_LIST_KEYS = ('affected_roles', 'no_perms_channels', 'no_perms_roles')
+
+class ReportError(ValueError):
+    """
+    Raised when a report cannot be read or is not a valid lockdown report. `path` locates the offending value, e.g. $.affected_channels["1234"][0][1].
+    """
+
+    def __init__(self, path: str, message: str):
+        super(ReportError, self).__init__(f"{path}: {message}")
+        self.path = path
+        self.message = message
+
+class Report(dict):
+    """
+    A lockdown or reopen report. Behaves exactly like the plain dict reports have always been, but keeps its encodings once made,
+    so the reply, the log message and any other attachment of the same report share a single serialization.
+    A report must not be changed once it has been serialized.
+    """
+
+    __slots__ = ('_json', '_gzip')
+
+    def __init__(self, *args, **kwargs):
+        super(Report, self).__init__(*args, **kwargs)
+        self._json: Optional[bytes] = None
+        self._gzip: Optional[bytes] = None
+
+def encode(report: dict) -> bytes:
+    # Without the default separators' spaces, which are a good part of a large report
+    return json.dumps(report, separators=(",", ":")).encode("utf8")
+
+def decode(data: bytes, max_size: int = 0) -> Any:
+    """
+    Reads a report from JSON, gzip-compressed or not. With a `max_size` (in bytes), larger reports are rejected before they are parsed, however well they compress.
+    """
+    if max_size > 0 and len(data) > max_size:
+        raise ReportError("$", f"the report is larger than {max_size // 1024} KiB")
+    if data[:2] == GZIP_MAGIC:
+        decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        try:
+            data = decompressor.decompress(data, max_size + 1 if max_size > 0 else 0)
+        except zlib.error as e:
+            raise ReportError("$", f"the report is not valid gzip ({e})")
+        if max_size > 0 and len(data) > max_size:
+            raise ReportError("$", f"the report is larger than {max_size // 1024} KiB once decompressed")
+    try:
+        return json.loads(data)
+    except ValueError as e:
+        raise ReportError("$", f"the report is not valid JSON ({e})")
+
+def _check_snowflake(value: Any, path: str):
+    # bool is a subclass of int, but true/false are never IDs
+    if type(value) is not int or value < MIN_SNOWFLAKE or value > MAX_SNOWFLAKE:
+        raise ReportError(path, f"expected a Discord ID, got {json.dumps(value)[:40]}")
+
+def _is_snowflake_key(key: str) -> bool:
+    return 17 <= len(key) <= 20 and key.isascii() and key.isdigit() and int(key) <= MAX_SNOWFLAKE
+
+def _key_path(name: str, key: str) -> str:
+    # Keys come from the upload, so they are quoted and cut short rather than trusted
+    return f"$.{name}[{json.dumps(key)[:32]}]"
+
+def _check_id_list(value: Any, path: str):
+    if type(value) is not list:
+        raise ReportError(path, "expected a list of IDs")
+    for i, x in enumerate(value):
+        if type(x) is not int or x < MIN_SNOWFLAKE or x > MAX_SNOWFLAKE:
+            _check_snowflake(x, f"{path}[{i}]")
+
+def validate_lockdown_report(report: Any):
+    """
+    Checks that an uploaded lockdown report has the shape server_reopen() expects, in a single pass over it.
+    Raises ReportError at the first problem found.
+    """
+    if type(report) is not dict:
+        raise ReportError("$", "expected an object")
+    for key in report:
+        if key not in ('affected_channels', 'meta') and key not in ID_LIST_KEYS:
+            raise ReportError(f"$[{json.dumps(key)[:32]}]", "unexpected key")
+    for key in ('affected_channels', 'meta') + ID_LIST_KEYS:
+        if key not in report:
+            raise ReportError(f"$.{key}", "missing")
+
+    affected_channels = report['affected_channels']
+    if type(affected_channels) is not dict:
+        raise ReportError("$.affected_channels", "expected an object")
+    for channel_id, changes in affected_channels.items():
+        if not _is_snowflake_key(channel_id):
+            raise ReportError(_key_path('affected_channels', channel_id), "expected a Discord ID as the key")
+        if type(changes) is not list:
+            raise ReportError(_key_path('affected_channels', channel_id), "expected a list of [role ID, previous state] pairs")
+        for i, change in enumerate(changes):
+            # The common case is checked inline; the path is only made to describe a problem
+            if type(change) is list and len(change) == 2 and type(change[0]) is int and MIN_SNOWFLAKE <= change[0] <= MAX_SNOWFLAKE and type(change[1]) is int and -1 <= change[1] <= 1:
+                continue
+            path = _key_path('affected_channels', channel_id)
+            if type(change) is not list or len(change) != 2:
+                raise ReportError(f"{path}[{i}]", "expected a [role ID, previous state] pair")
+            _check_snowflake(change[0], f"{path}[{i}][0]")
+            raise ReportError(f"{path}[{i}][1]", f"expected -1, 0 or 1, got {json.dumps(change[1])[:40]}")
+
+    for key in ID_LIST_KEYS:
+        _check_id_list(report[key], f"$.{key}")
+
+    if type(report['meta']) is not dict:
+        raise ReportError("$.meta", "expected an object")
+
+async def serialize(report: dict) -> bytes:
+    """
+    The report's JSON encoding, made in a worker thread so large reports do not block the event loop.
+    """
+    if isinstance(report, Report) and report._json != None:
+        return report._json
+    data = await asyncio.to_thread(encode, report)
+    if isinstance(report, Report):
+        report._json = data
+    return data
+
+async def serialize_compressed(report: dict) -> bytes:
+    if isinstance(report, Report) and report._gzip != None:
+        return report._gzip
+    data = await serialize(report)
+    # A fixed mtime makes the same report compress to the same bytes
+    compressed = await asyncio.to_thread(gzip.compress, data, 6, mtime=0)
+    if isinstance(report, Report):
+        report._gzip = compressed
+    return compressed
+
+def decode_lockdown_report(data: bytes, max_size: int = 0) -> dict:
+    report = decode(data, max_size=max_size)
+    validate_lockdown_report(report)
+    return report
+
+async def load_lockdown_report(data: bytes, max_size: int = 0) -> dict:
+    """
+    Parses and validates an uploaded lockdown report in a worker thread. Raises ReportError, locating the problem, if it is not a valid one.
+    """
+    return await asyncio.to_thread(decode_lockdown_report, data, max_size)
+
+async def to_file(report: dict, filename: str, compress_over: int = 0) -> discord.File:
+    """
+    The report as an attachment. If it is larger than `compress_over` bytes (0 never compresses), it is gzip-compressed and '.gz' is added to the file name.
+    """
+    data = await serialize(report)
+    if compress_over > 0 and len(data) > compress_over:
+        return discord.File(fp=BytesIO(await serialize_compressed(report)), filename=filename + ".gz")
+    return discord.File(fp=BytesIO(data), filename=filename)
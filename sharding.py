@@ -0,0 +1,62 @@
+"""
+Splitting the bot's shards between processes ("clusters"). Every cluster runs its own CurfewBot over a share of the shards, and so of the guilds,
+against the same databases. main.py starts one process per cluster when more than one is configured.
+"""
+import sys
+import asyncio
+import logging
+import signal
+from typing import List, Optional, Sequence
+
+logger = logging.getLogger('sharding')
+
+# Seconds to wait before restarting a cluster that exited with an error
+RESTART_DELAY = 5
+
+def shard_id(guild_id: int, shard_count: int) -> int:
+    # How Discord assigns guilds to shards
+    return (guild_id >> 22) % shard_count
+
+def cluster_shards(shard_count: int, cluster_count: int, cluster_id: int) -> List[int]:
+    """
+    The shards run by a cluster. Shards are dealt out in turn, so clusters differ in size by at most one shard.
+    """
+    return [x for x in range(shard_count) if x % cluster_count == cluster_id]
+
+class ClusterSupervisor:
+    """
+    Runs a process per cluster, restarting any that exits with an error, until it is stopped.
+    """
+
+    def __init__(self, command: Sequence[str], cluster_count: int):
+        self.command = list(command)
+        self.cluster_count = cluster_count
+        self.processes: List[Optional[asyncio.subprocess.Process]] = [None] * cluster_count
+        self.stopping = False
+
+    async def run_cluster(self, cluster_id: int):
+        while not self.stopping:
+            process = self.processes[cluster_id] = await asyncio.create_subprocess_exec(*self.command, "--cluster", str(cluster_id))
+            logger.info(f"Started cluster {cluster_id} (pid {process.pid}).")
+            code = await process.wait()
+            if self.stopping or code == 0:
+                logger.info(f"Cluster {cluster_id} exited.")
+                return
+            logger.error(f"Cluster {cluster_id} exited with status {code}; restarting it in {RESTART_DELAY}s.")
+            await asyncio.sleep(RESTART_DELAY)
+
+    def stop(self):
+        self.stopping = True
+        for process in self.processes:
+            if process != None and process.returncode == None:
+                process.terminate()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        if sys.platform != "win32":
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, self.stop)
+        try:
+            await asyncio.gather(*[self.run_cluster(x) for x in range(self.cluster_count)])
+        finally:
+            self.stop()
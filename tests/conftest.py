@@ -0,0 +1,62 @@
+import os
+import sys
+import asyncio
+import inspect
+import pytest
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT_PATH)
+# Synthetic guilds and the request recorder are shared with the benchmarks
+sys.path.insert(0, os.path.join(ROOT_PATH, "Benchmarks"))
+
+import discord
+from synthetic import build_guild, install_recorder
+from lockdown import LockdownPlan, overwrite_state
+
+GUILD_ID = 10 ** 17
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    # Runs `async def` tests in a fresh event loop of their own
+    if inspect.iscoroutinefunction(pyfuncitem.obj):
+        arguments = {x: pyfuncitem.funcargs[x] for x in pyfuncitem._fixtureinfo.argnames}
+        asyncio.run(pyfuncitem.obj(**arguments))
+        return True
+
+@pytest.fixture
+def make_guild():
+    """
+    Returns a function building a synthetic guild (see Benchmarks/synthetic.py) whose edits are recorded and applied to the cache instead of being sent.
+    Must be called from within the test's event loop. See recorder() for the requests made.
+    """
+    def make(**kwargs) -> discord.Guild:
+        client = discord.Client(intents=discord.Intents.none())
+        install_recorder(client, apply=True)
+        return build_guild(client._connection, GUILD_ID, **{'seed': 0, **kwargs})
+
+    return make
+
+def recorder(guild: discord.Guild):
+    # The RequestRecorder standing in for the HTTP client of the guild's connection
+    return guild._state.http.request
+
+def empty_lockdown_report() -> dict:
+    return {'affected_channels': {}, 'affected_roles': [], 'no_perms_channels': [], 'no_perms_roles': [], 'meta': {}}
+
+def empty_reopen_report() -> dict:
+    return {
+        'missing_channels': [], 'missing_roles': [], 'missing_overwrites': {}, 'no_perms_roles': [], 'no_perms_channels': [],
+        'reopened_channels': {}, 'unchanged_channels': [], 'reopened_roles': [], 'unchanged_roles': [], 'meta': {}
+    }
+
+def view_states(channel: discord.abc.GuildChannel) -> dict:
+    # Overwrites that neither allow nor deny "View Channel" are the same as none
+    return {x.id: overwrite_state(x.allow, x.deny) for x in channel._overwrites if overwrite_state(x.allow, x.deny) != None}
+
+def planned_channel_ids(plan: LockdownPlan) -> set:
+    return {x.channel.id for x in plan.channel_edits}
+
+def normalized(plan: LockdownPlan) -> tuple:
+    # The plan as saved, short of the order of the edits
+    data = plan.to_dict()
+    return data['channel_edits'], sorted(data['role_edits'])
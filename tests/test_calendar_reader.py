@@ -0,0 +1,43 @@
+import os
+import shutil
+import sqlite3
+import datetime
+import pytest
+import calendar_reader
+from conftest import ROOT_PATH
+
+@pytest.fixture
+def calendar_db(tmp_path):
+    path = str(tmp_path / "calendar.db")
+    shutil.copy(os.path.join(ROOT_PATH, "Static", "calendar.template_db"), path)
+    return path
+
+def templates(db: sqlite3.Connection, group: str, day_type: str) -> list:
+    return db.execute("SELECT LOCAL_TIME, ACTION FROM SCHEDULE_TEMPLATES WHERE CALENDAR_GROUP=? AND DAY_TYPE=? ORDER BY LOCAL_TIME", (group, day_type)).fetchall()
+
+async def test_edited_templates_survive_a_sync(calendar_db):
+    await calendar_reader.migrate_calendar(calendar_db)
+    db = sqlite3.connect(calendar_db)
+    try:
+        day_types = {datetime.date(2026, 9, 1) + datetime.timedelta(days=x): calendar_reader.DEFAULT_DAY_TYPE for x in range(30)}
+        calendar_reader.sync_schedule(db, 'regular', day_types)
+        seeded = templates(db, 'regular', calendar_reader.DEFAULT_DAY_TYPE)
+        assert len(seeded) > 0
+
+        # A bell time moved in the database
+        local_time, action = seeded[0]
+        moved = (datetime.datetime.strptime(local_time, "%H:%M") + datetime.timedelta(minutes=10)).strftime("%H:%M")
+        with db:
+            db.execute("UPDATE SCHEDULE_TEMPLATES SET LOCAL_TIME=? WHERE CALENDAR_GROUP=? AND DAY_TYPE=? AND LOCAL_TIME=?", (moved, 'regular', calendar_reader.DEFAULT_DAY_TYPE, local_time))
+        # And one day type's tasks removed altogether, which seeds it again
+        with db:
+            db.execute("DELETE FROM SCHEDULE_TEMPLATES WHERE CALENDAR_GROUP=? AND DAY_TYPE=?", ('regular', 'early_dismissal'))
+
+        calendar_reader.sync_schedule(db, 'regular', day_types, force=True)
+        assert templates(db, 'regular', calendar_reader.DEFAULT_DAY_TYPE) == sorted([(moved, action)] + seeded[1:])
+        assert len(templates(db, 'regular', 'early_dismissal')) > 0
+        # Other groups are seeded with the defaults
+        calendar_reader.sync_schedule(db, 'other', day_types)
+        assert templates(db, 'other', calendar_reader.DEFAULT_DAY_TYPE) == seeded
+    finally:
+        db.close()
@@ -0,0 +1,183 @@
+import os
+import json
+import shutil
+import aiosqlite
+import discord
+import pytest
+import history
+from database import migrate
+from journal import OperationJournal
+from lockdown import LockdownPlan, execute_lockdown_plan, execute_reopen_plan, overwrite_state, plan_lockdown, plan_reopen
+from migrations import MAIN_MIGRATIONS
+from conftest import ROOT_PATH, empty_lockdown_report, empty_reopen_report, normalized, planned_channel_ids, recorder
+
+@pytest.fixture
+def connect(tmp_path):
+    """
+    Returns a function opening connections to a fresh main.db with every migration applied.
+    """
+    path = str(tmp_path / "main.db")
+    shutil.copy(os.path.join(ROOT_PATH, "Static", "main.template_db"), path)
+    migrated = False
+
+    async def connect() -> aiosqlite.Connection:
+        nonlocal migrated
+        db = await aiosqlite.connect(path)
+        if not migrated:
+            await migrate(db, MAIN_MIGRATIONS)
+            migrated = True
+        return db
+
+    return connect
+
+def interrupt_channel(guild: discord.Guild, channel_id: int):
+    # The edit of the given channel fails with an error the lockdown does not handle, as a crash or lost connection would
+    send = recorder(guild)
+
+    async def request(route, **kwargs):
+        if f"/channels/{channel_id}" in route.url:
+            raise ConnectionResetError("connection lost")
+        return await send(route, **kwargs)
+
+    guild._state.http.request = request
+
+def as_json(report: dict) -> dict:
+    return json.loads(json.dumps(report))
+
+def unordered(report: dict) -> dict:
+    # The stored report keeps what each list holds, not the order it was written in
+    return {k: {x: sorted(y) for x, y in v.items()} if isinstance(v, dict) else sorted(v) for k, v in as_json(report).items() if k != 'meta'}
+
+async def test_replay_rebuilds_the_report(connect, make_guild):
+    guild = make_guild(channels=60, categories=4, roles=6)
+    plan = plan_lockdown(guild, guild.roles[1:3], [], [], False)
+    journal = await OperationJournal.begin(connect, guild.id, 'lockdown', {'target_roles': [guild.roles[1].id]})
+    report = empty_lockdown_report()
+    await execute_lockdown_plan(plan, report, journal=journal)
+
+    loaded = await OperationJournal.load_unfinished(connect, guild_id=guild.id)
+    assert [x.operation_id for x in loaded] == [journal.operation_id]
+    assert loaded[0].resumed and loaded[0].input == {'target_roles': [guild.roles[1].id]}
+    assert loaded[0].next_step == journal.next_step
+    replayed = empty_lockdown_report()
+    loaded[0].replay(replayed)
+    assert as_json(replayed) == as_json(report)
+
+async def test_finish_stores_the_report_and_drops_the_steps(connect, make_guild):
+    guild = make_guild(channels=30, categories=3, roles=6)
+    journal = await OperationJournal.begin(connect, guild.id, 'lockdown', {})
+    report = empty_lockdown_report()
+    await execute_lockdown_plan(plan_lockdown(guild, guild.roles[1:3], [], [], False), report, journal=journal)
+    await journal.finish('completed', report=report)
+
+    assert await OperationJournal.load_unfinished(connect, guild_id=guild.id) == []
+    db = await connect()
+    try:
+        assert (await db.execute_fetchall("SELECT COUNT(*) FROM OPERATION_STEPS"))[0][0] == 0
+        stored = await history.load_report(db, journal.operation_id)
+    finally:
+        await db.close()
+    assert unordered(stored) == unordered(report)
+
+async def test_interrupted_lockdown_resumes_where_it_stopped(connect, make_guild):
+    guild = make_guild(channels=80, categories=5, roles=6)
+    before = {x.id: {y.id: overwrite_state(y.allow, y.deny) for y in x._overwrites} for x in guild.channels}
+    target_roles = guild.roles[1:3]
+    plan = plan_lockdown(guild, target_roles, [], [], False)
+    # Interrupted part of the way through the channels
+    interrupted_at = plan.channel_edits[len(plan.channel_edits) // 2].channel
+    send = recorder(guild)
+    interrupt_channel(guild, interrupted_at.id)
+
+    journal = await OperationJournal.begin(connect, guild.id, 'lockdown', {})
+    await journal.record('plan', guild.id, plan.to_dict())
+    with pytest.raises(ConnectionResetError):
+        await execute_lockdown_plan(plan, empty_lockdown_report(), journal=journal, concurrency=8)
+
+    # Every edit that went through was journaled, including ones after the interruption
+    journal = (await OperationJournal.load_unfinished(connect, guild_id=guild.id))[0]
+    edited = journal.target_ids('affected_channels')
+    order = [x.channel.id for x in plan.channel_edits]
+    assert len(edited) > 0 and interrupted_at.id not in edited and edited < set(order)
+    assert any(order.index(x) > order.index(interrupted_at.id) for x in edited)
+
+    # Resumed the way server_lockdown() does, from the saved plan
+    guild._state.http.request = send
+    resumed = LockdownPlan.from_dict(guild, journal.step_data('plan'), target_roles, [], [], False)
+    remaining = resumed.remaining(edited, journal.target_ids('no_perms_channels'), journal.target_ids('affected_roles', 'no_perms_roles'))
+    assert [x.channel.id for x in remaining.channel_edits] == [x for x in order if x not in edited]
+    report = empty_lockdown_report()
+    journal.replay(report)
+    await execute_lockdown_plan(remaining, report, journal=journal)
+    assert all(any(y.id == guild.default_role.id and overwrite_state(y.allow, y.deny) == False for y in x._overwrites) for x in guild.channels)
+
+    # The combined report reopens the guild to where it was before the lockdown
+    await execute_reopen_plan(plan_reopen(guild, report), empty_reopen_report())
+    after = {x.id: {y.id: overwrite_state(y.allow, y.deny) for y in x._overwrites} for x in guild.channels}
+    assert all({k: v for k, v in after[x].items() if v != None} == {k: v for k, v in before[x].items() if v != None} for x in before)
+
+async def test_from_dict_restores_saved_plan(make_guild):
+    guild = make_guild(channels=60, categories=4, roles=6)
+    target_roles = guild.roles[1:3]
+    plan = plan_lockdown(guild, target_roles, [], [], False)
+    data = json.loads(json.dumps(plan.to_dict()))
+    restored = LockdownPlan.from_dict(guild, data, target_roles, [], [], False)
+    assert normalized(restored) == normalized(plan)
+    assert restored.estimated_calls == plan.estimated_calls
+
+    # Channels that no longer exist are left out
+    gone = [next(x for x in plan.channel_edits if x.channel.type == discord.ChannelType.category).channel, next(x for x in plan.channel_edits if x.channel.type != discord.ChannelType.category).channel]
+    for channel in gone:
+        guild._remove_channel(channel)
+    restored = LockdownPlan.from_dict(guild, data, target_roles, [], [], False)
+    assert planned_channel_ids(restored) == planned_channel_ids(plan) - {x.id for x in gone}
+
+async def test_remaining_leaves_out_handled_edits(make_guild):
+    guild = make_guild(channels=80, categories=5, roles=6)
+    plan = plan_lockdown(guild, guild.roles[1:3], [], [], False)
+    edited = {x.channel.id for x in plan.channel_edits[:10]}
+    failed = {plan.channel_edits[10].channel.id, plan.channel_edits[-1].channel.id}
+    done_roles = {plan.role_edits[0].role.id}
+
+    remaining = plan.remaining(edited, failed, done_roles)
+    assert [x.channel.id for x in remaining.channel_edits] == [x.channel.id for x in plan.channel_edits if x.channel.id not in edited | failed]
+    # With the previous states the plan was made with
+    assert all(x.changes is y.changes for x, y in zip(remaining.channel_edits, plan.channel_edits[11:]))
+    assert [x.role.id for x in remaining.role_edits] == [x.role.id for x in plan.role_edits if x.role.id not in done_roles]
+
+async def test_step_numbers_continue_after_loading(connect):
+    journal = await OperationJournal.begin(connect, 1, 'reopen', {'lockdown_report': {}})
+    await journal.record_many([('reopened_roles', 10, None), ('unchanged_roles', 11, None)])
+    await journal.record('reopened_channels', 12, [[10, 1]])
+    loaded = (await OperationJournal.load_unfinished(connect, action='reopen'))[0]
+    assert loaded.next_step == 3
+    assert loaded.target_ids('reopened_roles', 'unchanged_roles') == {10, 11}
+    await loaded.record('missing_channels', 13)
+    report = empty_reopen_report()
+    (await OperationJournal.load_unfinished(connect, action='reopen'))[0].replay(report)
+    assert report['reopened_roles'] == [10] and report['unchanged_roles'] == [11]
+    assert report['reopened_channels'] == {'12': [[10, 1]]} and report['missing_channels'] == [13]
+
+async def test_migrate_applies_each_script_once(tmp_path):
+    scripts = ["CREATE TABLE A (X INTEGER);", "ALTER TABLE A ADD COLUMN Y INTEGER;"]
+    db = await aiosqlite.connect(str(tmp_path / "test.db"))
+    try:
+        assert await migrate(db, scripts[:1]) == 1
+        assert await migrate(db, scripts) == 2
+        # Already applied scripts are not run again
+        assert await migrate(db, scripts) == 2
+        assert [x[1] for x in await db.execute_fetchall("PRAGMA table_info(A)")] == ['X', 'Y']
+    finally:
+        await db.close()
+
+async def test_migrate_stops_at_a_failing_script(tmp_path):
+    scripts = ["CREATE TABLE A (X INTEGER);", "CREATE TABLE B (X INTEGER); ALTER TABLE MISSING ADD COLUMN Y INTEGER;", "CREATE TABLE C (X INTEGER);"]
+    db = await aiosqlite.connect(str(tmp_path / "test.db"))
+    try:
+        with pytest.raises(aiosqlite.OperationalError):
+            await migrate(db, scripts)
+        # The failing script is rolled back as a whole, and the ones before it stay applied
+        assert (await db.execute_fetchall("PRAGMA user_version"))[0][0] == 1
+        assert [x[0] for x in await db.execute_fetchall("SELECT name FROM sqlite_master WHERE type='table'")] == ['A']
+    finally:
+        await db.close()
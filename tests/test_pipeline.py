@@ -0,0 +1,123 @@
+import asyncio
+import random
+import discord
+import pytest
+from lockdown import apply_overwrite_changes, execute_lockdown_plan, plan_lockdown, run_pipelined
+from conftest import empty_lockdown_report, recorder, view_states
+
+class Forbidden403:
+    status = 403
+    reason = "Forbidden"
+
+def deny_channels(guild: discord.Guild, channel_ids: set):
+    """
+    Makes requests on the given channels fail with 403 Forbidden, the way Discord answers edits the bot has no permission for.
+    """
+    send = recorder(guild)
+
+    async def request(route, **kwargs):
+        if any(f"/channels/{x}" in route.url for x in channel_ids):
+            raise discord.Forbidden(Forbidden403(), "Missing Permissions")
+        return await send(route, **kwargs)
+
+    guild._state.http.request = request
+
+async def test_run_pipelined_records_in_order():
+    rng = random.Random(0)
+    items = list(range(40))
+    in_flight = 0
+    most_in_flight = 0
+    recorded = []
+
+    async def perform(item):
+        nonlocal in_flight, most_in_flight
+        in_flight += 1
+        most_in_flight = max(most_in_flight, in_flight)
+        await asyncio.sleep(rng.random() / 200)
+        in_flight -= 1
+        return item * 2
+
+    async def record(item, result):
+        assert result == item * 2
+        recorded.append(item)
+        # Items added while recording are performed too
+        if item == 10:
+            items.extend([100, 101])
+
+    await run_pipelined(items, perform, record, concurrency=4)
+    assert recorded == list(range(40)) + [100, 101]
+    assert most_in_flight == 4
+
+async def test_run_pipelined_records_what_went_through_before_a_failure():
+    recorded = []
+    performed = []
+
+    async def perform(item):
+        # The failing item is slow, so items after it finish first
+        await asyncio.sleep(0.02 if item == 5 else 0.001)
+        performed.append(item)
+        if item == 5:
+            raise RuntimeError("edit failed")
+        return item
+
+    async def record(item, result):
+        recorded.append(item)
+
+    with pytest.raises(RuntimeError):
+        await run_pipelined(list(range(100)), perform, record, concurrency=4)
+    # Items after the failed one that went through are recorded too, in order
+    assert recorded == sorted(x for x in performed if x != 5)
+    assert any(x > 5 for x in recorded)
+    # No more items are started after the failure
+    assert len(performed) < 100
+
+async def test_run_pipelined_records_what_went_through_when_cancelled():
+    recorded = []
+    started = asyncio.Event()
+
+    async def perform(item):
+        if item == 3:
+            started.set()
+            await asyncio.sleep(10)
+        return item
+
+    async def record(item, result):
+        recorded.append(item)
+
+    task = asyncio.ensure_future(run_pipelined(list(range(10)), perform, record, concurrency=8))
+    await started.wait()
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    # The item still in flight is cancelled instead of waited for
+    assert recorded == [0, 1, 2, 4, 5, 6, 7, 8, 9]
+
+async def test_lockdown_edits_each_channel_and_role(make_guild):
+    guild = make_guild(channels=120, categories=6, roles=6)
+    plan = plan_lockdown(guild, guild.roles[1:3], [], [], False)
+    denied = {plan.channel_edits[3].channel.id, plan.channel_edits[40].channel.id}
+    requests = recorder(guild)
+    deny_channels(guild, denied)
+
+    report = empty_lockdown_report()
+    await execute_lockdown_plan(plan, report, concurrency=8)
+    # In the plan's order, whatever order the edits finished in
+    assert [int(x) for x in report['affected_channels']] == [x.channel.id for x in plan.channel_edits if x.channel.id not in denied]
+    assert report['no_perms_channels'] == [x.channel.id for x in plan.channel_edits if x.channel.id in denied]
+    assert report['affected_roles'] == [x.role.id for x in plan.role_edits]
+    # In 'auto' mode, every channel takes a single call
+    assert len(requests.calls) == plan.estimated_calls - len(denied)
+    assert all(view_states(x).get(guild.default_role.id) == False for x in guild.channels if x.id not in denied)
+
+async def test_per_overwrite_edits_skip_deleted_roles(make_guild):
+    guild = make_guild(channels=10, categories=1, roles=6)
+    channel = next(x for x in guild.channels if x.type != discord.ChannelType.category)
+    roles = guild.roles[1:4]
+    # A role deleted after the lockdown was planned
+    guild._remove_role(roles[1].id)
+    requests = recorder(guild)
+
+    calls = await apply_overwrite_changes(channel, {x.id: False for x in roles}, mode='per_overwrite')
+    assert calls == len(requests.calls) == 2
+    assert all(view_states(channel).get(x.id) == False for x in (roles[0], roles[2]))
@@ -0,0 +1,45 @@
+import discord
+from lockdown import STATE_MAP, overwrite_state, plan_lockdown
+from conftest import planned_channel_ids
+
+def view_state(channel: discord.abc.GuildChannel, role_id: int):
+    return next((overwrite_state(x.allow, x.deny) for x in channel._overwrites if x.id == role_id), None)
+
+async def test_plans_every_channel_except_whitelisted(make_guild):
+    guild = make_guild(channels=60, categories=4, roles=6)
+    whitelisted = {guild.channels[5].id, guild.channels[-1].id}
+    plan = plan_lockdown(guild, guild.roles[1:3], [], whitelisted, False)
+    # The default role's overwrite is always changed (or created), so no channel is left out
+    assert planned_channel_ids(plan) == {x.id for x in guild.channels} - whitelisted
+    assert len(planned_channel_ids(plan)) == len(plan.channel_edits)
+
+async def test_changes_hold_previous_states(make_guild):
+    guild = make_guild(channels=40, categories=4, roles=6)
+    target_roles = guild.roles[1:3]
+    plan = plan_lockdown(guild, target_roles, [], [], False)
+    for edit in plan.channel_edits:
+        changed = dict(edit.changes)
+        assert changed[guild.default_role.id] == STATE_MAP[view_state(edit.channel, guild.default_role.id)]
+        for role in target_roles:
+            if any(x.id == role.id for x in edit.channel._overwrites):
+                assert changed[role.id] == STATE_MAP[view_state(edit.channel, role.id)]
+        assert all(x == False for x in edit.role_states.values())
+
+async def test_ignored_roles_and_neutral_overwrites(make_guild):
+    guild = make_guild(channels=40, categories=4, roles=6, overwrites=5)
+    ignored = guild.roles[4]
+    target_roles = guild.roles[1:3]
+    plan = plan_lockdown(guild, target_roles, [ignored], [], True)
+    target_role_ids = {x.id for x in target_roles} | {guild.default_role.id}
+    for edit in plan.channel_edits:
+        for role_id, state in edit.changes:
+            assert role_id != ignored.id
+            # Only target roles (and the default role) have neutral overwrites changed
+            if role_id not in target_role_ids:
+                assert state == STATE_MAP[True]
+
+async def test_role_edits(make_guild):
+    guild = make_guild(channels=10, categories=2, roles=6)
+    plan = plan_lockdown(guild, [guild.roles[1], guild.roles[1], None], [], [], False)
+    assert [x.role.id for x in plan.role_edits] == [guild.roles[1].id, guild.default_role.id]
+    assert all(x.permissions.view_channel == False for x in plan.role_edits)
@@ -0,0 +1,26 @@
+import ratelimit
+from ratelimit import RequestScheduler
+
+async def test_idle_buckets_are_evicted(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(ratelimit.time, 'monotonic', lambda: now)
+    scheduler = RequestScheduler()
+    for key in ("PUT /channels/1/permissions/{id}", "PUT /channels/2/permissions/{id}", "PATCH /channels/3"):
+        await scheduler.acquire(key)
+        scheduler.observe(key, 200, {'X-RateLimit-Limit': '5', 'X-RateLimit-Remaining': '4', 'X-RateLimit-Reset-After': '600'})
+    # Released, but still within its window
+    scheduler.release("PUT /channels/1/permissions/{id}")
+    # Released, with its window over
+    scheduler.release("PUT /channels/2/permissions/{id}")
+    scheduler.get_bucket("PUT /channels/2/permissions/{id}").reset_at = now - 1
+
+    now += ratelimit.BUCKET_SWEEP_INTERVAL - 1
+    scheduler.get_bucket("PATCH /channels/4")
+    # Buckets are only swept once per interval; the last sweep was when the first one was created
+    assert len(scheduler._buckets) == 4
+
+    now += 1
+    scheduler.get_bucket("PATCH /channels/5")
+    assert "PUT /channels/2/permissions/{id}" not in scheduler._buckets and "PATCH /channels/4" not in scheduler._buckets
+    # Buckets with requests in flight or a window still running are kept
+    assert {"PUT /channels/1/permissions/{id}", "PATCH /channels/3", "PATCH /channels/5"} <= set(scheduler._buckets)
@@ -0,0 +1,68 @@
+import datetime
+from zoneinfo import ZoneInfo
+from recurrence import GroupSchedule
+
+EVERY_DAY = {1, 2, 3, 4, 5, 6, 7}
+NEW_YORK = ZoneInfo("America/New_York")
+
+def schedule(first_date: datetime.date, last_date: datetime.date, templates: dict, exceptions: dict = {}, last_fired: float = None, rules: list = None) -> GroupSchedule:
+    if rules == None:
+        rules = [(EVERY_DAY, first_date, None, 'school')]
+    return GroupSchedule('group', "America/New_York", last_fired, templates, rules, exceptions, first_date, last_date)
+
+def timestamp(*args, fold: int = 0) -> float:
+    return datetime.datetime(*args, tzinfo=NEW_YORK, fold=fold).timestamp()
+
+def utc(value: float) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(value, tz=datetime.timezone.utc).replace(tzinfo=None)
+
+def test_spring_forward():
+    # Clocks go from 02:00 to 03:00 on 8 March 2026
+    group = schedule(datetime.date(2026, 3, 7), datetime.date(2026, 3, 9), {'school': [(datetime.time(2, 30), 'lockdown'), (datetime.time(8, 0), 'reopen')]})
+    tasks = list(group.fire_times(timestamp(2026, 3, 7)))
+    assert [x[1] for x in tasks] == ['lockdown', 'reopen'] * 3
+    reopens = [x[0] for x in tasks if x[1] == 'reopen']
+    # The day is an hour shorter, but the task stays at 08:00 local time
+    assert reopens[1] - reopens[0] == 23 * 3600 and reopens[2] - reopens[1] == 24 * 3600
+    # 02:30 does not exist that day; it fires once, an hour later on the clock (03:30 EDT)
+    assert utc(tasks[2][0]) == datetime.datetime(2026, 3, 8, 7, 30)
+    assert datetime.datetime.fromtimestamp(tasks[2][0], tz=NEW_YORK).time() == datetime.time(3, 30)
+
+def test_fall_back():
+    # Clocks go from 02:00 back to 01:00 on 1 November 2026
+    group = schedule(datetime.date(2026, 10, 31), datetime.date(2026, 11, 2), {'school': [(datetime.time(1, 30), 'lockdown'), (datetime.time(8, 0), 'reopen')]})
+    tasks = list(group.fire_times(timestamp(2026, 10, 31)))
+    assert [x[1] for x in tasks] == ['lockdown', 'reopen'] * 3
+    reopens = [x[0] for x in tasks if x[1] == 'reopen']
+    assert reopens[1] - reopens[0] == 25 * 3600 and reopens[2] - reopens[1] == 24 * 3600
+    # 01:30 happens twice that day; the task fires once, at the first (EDT)
+    assert tasks[2][0] == timestamp(2026, 11, 1, 1, 30, fold=0)
+    assert utc(tasks[2][0]) == datetime.datetime(2026, 11, 1, 5, 30)
+    # Starting between the two 01:30s does not fire it again
+    assert [x[1] for x in group.fire_times(timestamp(2026, 11, 1, 1, 45, fold=0))][:2] == ['reopen', 'lockdown']
+
+def test_day_types():
+    templates = {'school': [(datetime.time(8, 0), 'reopen')], 'half': [(datetime.time(12, 0), 'reopen')]}
+    rules = [({6, 7}, datetime.date(2026, 1, 1), None, 'half'), ({1, 2, 3, 4, 5}, datetime.date(2026, 1, 1), datetime.date(2026, 6, 30), 'school')]
+    exceptions = {datetime.date(2026, 3, 4): None, datetime.date(2026, 3, 5): 'half'}
+    group = schedule(datetime.date(2026, 3, 2), datetime.date(2026, 3, 8), templates, exceptions=exceptions, rules=rules)
+    assert [group.day_type(datetime.date(2026, 3, x)) for x in range(2, 9)] == ['school', 'school', None, 'half', 'school', 'half', 'half']
+    assert group.day_type(datetime.date(2026, 7, 1)) == None
+    # No tasks on a day excepted with None
+    days = [datetime.datetime.fromtimestamp(x, tz=NEW_YORK) for x, action in group.fire_times(timestamp(2026, 3, 1))]
+    assert [(x.day, x.hour) for x in days] == [(2, 8), (3, 8), (5, 12), (6, 8), (7, 12), (8, 12)]
+
+def test_next_tasks():
+    templates = {'school': [(datetime.time(8, 0), 'reopen'), (datetime.time(15, 0), 'lockdown')]}
+    now = timestamp(2026, 5, 5, 10, 0)
+    # Nothing has fired since yesterday's 08:00; only the latest missed task is due, then the next one
+    group = schedule(datetime.date(2026, 5, 3), datetime.date(2026, 5, 7), templates, last_fired=timestamp(2026, 5, 4, 8, 0))
+    assert group.next_tasks(now) == [(timestamp(2026, 5, 5, 8, 0), 'reopen'), (timestamp(2026, 5, 5, 15, 0), 'lockdown')]
+    # Up to date
+    group.last_fired = timestamp(2026, 5, 5, 8, 0)
+    assert group.next_tasks(now) == [(timestamp(2026, 5, 5, 15, 0), 'lockdown')]
+    # Never fired: only upcoming tasks
+    group.last_fired = None
+    assert group.next_tasks(now) == [(timestamp(2026, 5, 5, 15, 0), 'lockdown')]
+    # Past the end of the loaded window
+    assert group.next_tasks(timestamp(2026, 5, 8)) == []
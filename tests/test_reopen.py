@@ -0,0 +1,53 @@
+import discord
+from lockdown import STATE_MAP_REVERSE, execute_lockdown_plan, execute_reopen_plan, plan_lockdown, plan_reopen
+from conftest import empty_lockdown_report, empty_reopen_report, recorder, view_states
+
+async def test_reopen_restores_the_lockdown(make_guild):
+    guild = make_guild(channels=120, categories=6, roles=6)
+    before = {x.id: view_states(x) for x in guild.channels}
+    roles_before = {x.id: x.permissions.view_channel for x in guild.roles}
+    report = empty_lockdown_report()
+    await execute_lockdown_plan(plan_lockdown(guild, guild.roles[1:3], [], [], False), report)
+
+    reopen_report = empty_reopen_report()
+    plan = plan_reopen(guild, report)
+    await execute_reopen_plan(plan, reopen_report)
+    assert {x.id: view_states(x) for x in guild.channels} == before
+    assert {x.id: x.permissions.view_channel for x in guild.roles} == roles_before
+    assert reopen_report['no_perms_channels'] == [] and reopen_report['missing_channels'] == []
+
+    # Everything is as the report says it was, so reopening again changes nothing
+    recorder(guild).reset()
+    again = empty_reopen_report()
+    await execute_reopen_plan(plan_reopen(guild, report), again)
+    assert len(recorder(guild).calls) == 0
+    assert again['reopened_channels'] == {}
+
+async def test_reopen_diffs_against_the_current_state(make_guild):
+    guild = make_guild(channels=60, categories=4, roles=6)
+    report = empty_lockdown_report()
+    await execute_lockdown_plan(plan_lockdown(guild, guild.roles[1:3], [], [], False), report)
+
+    channel_ids = [int(x) for x in report['affected_channels']]
+    # Restored by hand already
+    restored = guild.get_channel(channel_ids[0])
+    restored_states = {role_id: state for role_id, state in report['affected_channels'][str(restored.id)]}
+    await restored.edit(overwrites={
+        guild.get_role(x): discord.PermissionOverwrite(view_channel=STATE_MAP_REVERSE[y]) for x, y in restored_states.items()
+    })
+    # An overwrite removed since the lockdown
+    removed = guild.get_channel(channel_ids[1])
+    removed_role_id = report['affected_channels'][str(removed.id)][0][0]
+    await removed.set_permissions(guild.get_role(removed_role_id), overwrite=None)
+    # Deleted since the lockdown
+    deleted = guild.get_channel(channel_ids[2])
+    guild._remove_channel(deleted)
+
+    reopen_report = empty_reopen_report()
+    plan = plan_reopen(guild, report, done_channel_ids={channel_ids[3]})
+    assert channel_ids[3] not in {x.channel_id for x in plan.channel_edits}
+    await execute_reopen_plan(plan, reopen_report)
+    assert restored.id in reopen_report['unchanged_channels']
+    assert reopen_report['missing_overwrites'] == {str(removed.id): [removed_role_id]}
+    assert reopen_report['missing_channels'] == [deleted.id]
+    assert str(channel_ids[3]) not in reopen_report['reopened_channels']
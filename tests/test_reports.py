@@ -0,0 +1,44 @@
+import copy
+import pytest
+from reports import ReportError, validate_lockdown_report
+
+CHANNEL_ID = "100000000000100000"
+ROLE_ID = 100000000000000000
+
+REPORT = {
+    'affected_channels': {CHANNEL_ID: [[ROLE_ID, 0], [ROLE_ID + 1, -1]], "100000000000100001": []},
+    'affected_roles': [ROLE_ID],
+    'no_perms_channels': [100000000000100004],
+    'no_perms_roles': [],
+    'meta': {'version': 1}
+}
+
+def test_valid_reports():
+    validate_lockdown_report(REPORT)
+    validate_lockdown_report({**REPORT, 'affected_channels': {}, 'affected_roles': []})
+
+@pytest.mark.parametrize('change, path', [
+    (lambda x: x['affected_channels'][CHANNEL_ID][0].__setitem__(1, 2), f'$.affected_channels["{CHANNEL_ID}"][0][1]'),
+    (lambda x: x['affected_channels'][CHANNEL_ID][1].__setitem__(1, True), f'$.affected_channels["{CHANNEL_ID}"][1][1]'),
+    (lambda x: x['affected_channels'][CHANNEL_ID][1].__setitem__(0, 1234), f'$.affected_channels["{CHANNEL_ID}"][1][0]'),
+    (lambda x: x['affected_channels'][CHANNEL_ID].append([ROLE_ID]), f'$.affected_channels["{CHANNEL_ID}"][2]'),
+    (lambda x: x['affected_channels'].__setitem__("general", []), '$.affected_channels["general"]'),
+    (lambda x: x['affected_channels'].__setitem__(CHANNEL_ID, {}), f'$.affected_channels["{CHANNEL_ID}"]'),
+    (lambda x: x.pop('no_perms_roles'), '$.no_perms_roles'),
+    (lambda x: x.__setitem__('extra', 1), '$["extra"]'),
+    (lambda x: x['affected_roles'].append(str(ROLE_ID)), '$.affected_roles[1]'),
+    (lambda x: x['no_perms_channels'].append(None), '$.no_perms_channels[1]'),
+    (lambda x: x.__setitem__('no_perms_roles', {}), '$.no_perms_roles'),
+    (lambda x: x.__setitem__('meta', []), '$.meta'),
+])
+def test_invalid_reports(change, path):
+    report = copy.deepcopy(REPORT)
+    change(report)
+    with pytest.raises(ReportError) as e:
+        validate_lockdown_report(report)
+    assert e.value.path == path
+
+def test_not_an_object():
+    with pytest.raises(ReportError) as e:
+        validate_lockdown_report([REPORT])
+    assert e.value.path == "$"
@@ -0,0 +1,76 @@
+import os
+import types
+import shutil
+import asyncio
+import datetime
+import aiosqlite
+import pytest
+import calendar_reader
+from conftest import ROOT_PATH
+from Cogs.AutoLockdown import autolockdown
+from Cogs.AutoLockdown.autolockdown import AutoLockdownCog
+
+@pytest.fixture
+def calendar_db(tmp_path):
+    path = str(tmp_path / "calendar.db")
+    shutil.copy(os.path.join(ROOT_PATH, "Static", "calendar.template_db"), path)
+    return path
+
+async def make_cog(path: str) -> AutoLockdownCog:
+    await calendar_reader.migrate_calendar(path)
+    # The scheduler loop waits for a bot that never becomes ready, so only the methods under test run
+    bot = types.SimpleNamespace(config={'Scheduler': {'heap_size': 4}}, cluster_id=0, cluster_count=1, wait_until_ready=asyncio.Event().wait, connect_calendar=lambda: aiosqlite.connect(path))
+    return AutoLockdownCog(bot)
+
+async def add_tasks(cog: AutoLockdownCog, group: str, timestamps: list):
+    cal = await cog.bot.connect_calendar()
+    try:
+        await cal.executemany("INSERT INTO CALENDAR (CALENDAR_GROUP, ACTION, CREATION_TIMESTAMP, SCHEDULED_TIMESTAMP) VALUES (?,?,?,?)", [(group, 'LOCKDOWN' if i % 2 == 0 else 'REOPEN', 0, x) for i, x in enumerate(timestamps)])
+        await cal.commit()
+    finally:
+        await cal.close()
+
+async def test_only_the_newest_overdue_task_of_each_group_is_loaded(calendar_db):
+    cog = await make_cog(calendar_db)
+    now = datetime.datetime.now().timestamp()
+    # Downtime left more overdue tasks than the heap holds
+    overdue = [now - 3600 * (20 - x) for x in range(20)]
+    await add_tasks(cog, 'a', overdue + [now + 3600, now + 7200])
+    await add_tasks(cog, 'b', [now - 60, now + 1800])
+
+    await cog.load_due_tasks()
+    due = sorted(cog.due_tasks)
+    assert [(x[0], x[1]) for x in due if x[0] <= now] == [(overdue[-1], 'a'), (now - 60, 'b')]
+    # The heap's size only limits the future tasks
+    assert [(x[0], x[1]) for x in due if x[0] > now] == [(now + 1800, 'b'), (now + 3600, 'a'), (now + 7200, 'a')]
+
+    # The older overdue tasks are completed without being performed
+    cal = await cog.bot.connect_calendar()
+    try:
+        pending = await cal.execute_fetchall("SELECT SCHEDULED_TIMESTAMP FROM CALENDAR WHERE CALENDAR_GROUP='a' AND COMPLETED=0 ORDER BY SCHEDULED_TIMESTAMP")
+    finally:
+        await cal.close()
+    assert [x[0] for x in pending] == [overdue[-1], now + 3600, now + 7200]
+    cog.calendar_poll.cancel()
+
+async def test_failed_tasks_are_retried_after_a_delay(calendar_db, monkeypatch):
+    cog = await make_cog(calendar_db)
+    now = datetime.datetime.now().timestamp()
+    await add_tasks(cog, 'a', [now - 60, now + 3600])
+    await cog.load_due_tasks()
+    attempts = []
+
+    async def perform_calendar_task(action, scheduled_timestamp, group, task_id):
+        attempts.append(datetime.datetime.now().timestamp())
+        raise ConnectionResetError("connection lost")
+
+    cog.perform_calendar_task = perform_calendar_task
+    monkeypatch.setattr(autolockdown, 'POLL_RETRY_DELAY', 0.2)
+    await cog.poll_calendar()
+    # The task stays due without the calendar being reloaded, and is only tried again after the delay
+    assert datetime.datetime.now().timestamp() - attempts[0] >= 0.2
+    assert not cog.calendar_changed.is_set()
+    assert min(cog.due_tasks)[0] == now - 60
+    await cog.poll_calendar()
+    assert len(attempts) == 2
+    cog.calendar_poll.cancel()
@@ -0,0 +1,23 @@
+import discord
+from lockdown import overwrite_signature, plan_lockdown
+from conftest import normalized
+
+async def test_update_channels_matches_a_new_plan(make_guild):
+    guild = make_guild(channels=80, categories=5, roles=6)
+    target_roles = guild.roles[1:3]
+    plan = plan_lockdown(guild, target_roles, [], [], False)
+    categories = [x for x in guild.channels if isinstance(x, discord.CategoryChannel)]
+    text_channels = [x for x in guild.channels if not isinstance(x, discord.CategoryChannel)]
+
+    # A channel takes its category's overwrites, another loses all of its own, one is deleted and a category gains an overwrite
+    copied = next(x for x in text_channels if x.category_id != None and overwrite_signature(x) != overwrite_signature(guild.get_channel(x.category_id)))
+    copied._overwrites = list(guild.get_channel(copied.category_id)._overwrites)
+    cleared = next(x for x in text_channels if x.id != copied.id and len(x._overwrites) > 0)
+    cleared._overwrites = []
+    deleted = text_channels[-1]
+    guild._remove_channel(deleted)
+    category = categories[0]
+    category._overwrites = category._overwrites + [discord.abc._Overwrites({'id': str(guild.roles[5].id), 'type': 0, 'allow': str(discord.Permissions(view_channel=True).value), 'deny': '0'})]
+
+    plan.update_channels([copied.id, cleared.id, deleted.id, category.id])
+    assert normalized(plan) == normalized(plan_lockdown(guild, target_roles, [], [], False))
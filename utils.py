@@ -1,7 +1,7 @@
 import os
 from ruamel.yaml import YAML
 yaml = YAML()
-from typing import Sequence, List, Iterable, Set, Union, Optional
+from typing import Sequence, List, Iterable, Set, Union, Optional, Dict, Tuple
 import discord
 from discord.ext import commands
 import copy
@@ -9,12 +9,26 @@ import aiosqlite
 import logging
 import datetime
 import json
-import traceback
 import asyncio
-from schema import Schema, And
+import functools
+import hashlib
+from database import DatabasePool
+from migrations import MAIN_MIGRATIONS, CALENDAR_MIGRATIONS
+from journal import OperationJournal
+import history
+import recurrence
+import metrics
+import sharding
+import logpipeline
+from reports import Report
+import reports
+from ratelimit import RequestScheduler
+from lockdown import STATE_MAP, STATE_MAP_REVERSE, LockdownPlan, LockdownRules, LockedGuild, plan_lockdown, execute_lockdown_plan, plan_reopen, execute_reopen_plan, apply_overwrite_changes, overwrite_state
 
 DATABASE_PATH = "Database\main.db"
 CALENDAR_PATH = "Database\calendar.db"
+# Calendar group of guilds that have not picked one
+DEFAULT_CALENDAR_GROUP = "default"
 
 def getRootPath() -> Union[os.PathLike, str]:
     """
@@ -72,48 +86,193 @@ def getConfig(template_path: os.PathLike, target_path: os.PathLike):
     genFromTemplate(template_path, target_path)
     return updateConfig(template_path, target_path)
 
-STATE_MAP = {
-    True: 1,
-    None: 0,
-    False: -1
-}
+def _parse_id_list(raw: Optional[str]) -> tuple:
+    if raw == None:
+        return ()
+    return tuple(int(x) for x in raw.split(",") if x.isnumeric())
 
-STATE_MAP_REVERSE = {y: x for x, y in STATE_MAP.items()}
-
-class CurfewBot(commands.Bot):
+class GuildSettings:
+    """
+    In-memory copy of a guild's GUILD_SETTINGS row. List columns are parsed once, when loaded or written.
+    """
 
-    def __init__(self, config, *args, **kwargs):
+    # Column name -> (attribute name, parser)
+    COLUMN_MAP = {
+        "TARGET_ROLES": ("target_roles", _parse_id_list),
+        "IGNORED_ROLES": ("ignored_roles", _parse_id_list),
+        "IGNORED_CHANNELS": ("ignored_channels", _parse_id_list),
+        "LOG_CHANNEL": ("log_channel", lambda x: x),
+        "LOGS_ENABLED": ("logs_enabled", bool),
+        "USE_CALENDAR": ("use_calendar", bool),
+        "IGNORE_NEUTRAL_OVERWRITES": ("ignore_neutral_overwrites", bool),
+        "CALENDAR_GROUP": ("calendar_group", lambda x: DEFAULT_CALENDAR_GROUP if x == None else x)
+    }
+    COLUMNS = tuple(COLUMN_MAP.keys())
+
+    __slots__ = ('guild_id',) + tuple(x[0] for x in COLUMN_MAP.values())
+
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        for column in self.COLUMNS:
+            self.apply(column, None)
+
+    @classmethod
+    def from_row(cls, guild_id: int, row: Sequence) -> 'GuildSettings':
+        settings = cls(guild_id)
+        for column, value in zip(cls.COLUMNS, row):
+            settings.apply(column, value)
+        return settings
+
+    def apply(self, column: str, value: Union[str, int, None]):
+        attr, parser = self.COLUMN_MAP[column]
+        setattr(self, attr, parser(value))
+
+    def get(self, column: str):
+        return getattr(self, self.COLUMN_MAP[column][0])
+
+class CurfewBot(commands.AutoShardedBot):
+
+    def __init__(self, config, *args, cluster_id: int = 0, cluster_count: int = 1, prefix_commands: bool = True, **kwargs):
         super(CurfewBot, self).__init__(*args, **kwargs)
         self.config = config
+        # Without message content (see getGatewayOptions()), messages are not checked for prefix commands
+        self.prefix_commands = prefix_commands
+        # This process runs the shards in self.shard_ids (all of them if None), one of cluster_count processes sharing the databases
+        self.cluster_id = cluster_id
+        self.cluster_count = cluster_count
         self.logger = logging.getLogger('bot')
         self.remove_command('help')
         genFromTemplate("Static/main.template_db", DATABASE_PATH)
         genFromTemplate("Static/calendar.template_db", CALENDAR_PATH)
+        db_config = self.config.get('Database', {})
+        self.db_pool = DatabasePool(DATABASE_PATH, size=db_config.get('pool_size', 4), cached_statements=db_config.get('cached_statements', 256), migrations=MAIN_MIGRATIONS)
+        self.calendar_pool = DatabasePool(CALENDAR_PATH, size=db_config.get('calendar_pool_size', 2), cached_statements=db_config.get('cached_statements', 256), migrations=CALENDAR_MIGRATIONS)
+        self.guild_settings: Dict[int, GuildSettings] = {}
+        self.command_sync_lock = asyncio.Lock()
+        self.synced_command_hash: Optional[str] = None
+        # IDs of journaled operations being run (or resumed) by this process
+        self.active_operations: Set[int] = set()
+        # Lockdown plans made ahead of a scheduled lockdown, by guild ID; kept up to date by the scheduler as channels and roles change
+        self.staged_plans: Dict[int, LockdownPlan] = {}
+        # Guilds of this cluster that are locked down, by ID, with what is needed to keep them locked (None until first needed; see get_locked_guild())
+        self.locked_guilds: Dict[int, Optional[LockedGuild]] = {}
+        # Paces every Discord mutation according to the rate limit headers Discord sends back
+        # The global rate limit is per bot, so it is split between the clusters
+        self.request_scheduler = RequestScheduler(global_limit=max(1, 50 // cluster_count))
+        self.request_scheduler.on_response = metrics.observe_response
+        self.request_scheduler.install(self.http)
+        self.db_pool.on_query = functools.partial(metrics.observe_query, 'main')
+        self.calendar_pool.on_query = functools.partial(metrics.observe_query, 'calendar')
+        # Serves the metrics over HTTP while the bot runs, if enabled
+        metrics_config = self.config.get('Metrics', {})
+        self.metrics_server = metrics.MetricsServer(host=metrics_config.get('host', '127.0.0.1'), port=metrics_config.get('port', 9108) + cluster_id) if metrics_config.get('enabled', False) else None
+
+    async def start(self, *args, **kwargs):
+        # Database pools live for as long as the bot does
+        await self.db_pool.open()
+        await self.calendar_pool.open()
+        await self.load_guild_settings()
+        await self.load_locked_guilds()
+        if self.metrics_server != None:
+            await self.metrics_server.start()
+        await super(CurfewBot, self).start(*args, **kwargs)
+
+    async def close(self):
+        try:
+            await super(CurfewBot, self).close()
+        finally:
+            await self.db_pool.close()
+            await self.calendar_pool.close()
+            if self.metrics_server != None:
+                await self.metrics_server.stop()
         
+    async def on_message(self, message: discord.Message):
+        if self.prefix_commands:
+            await self.process_commands(message)
+
+    def owns_guild(self, guild_id: int) -> bool:
+        """
+        Whether the guild is on one of this cluster's shards, so this process is the one to act on it.
+        """
+        if self.shard_ids == None or self.shard_count == None:
+            return True
+        return sharding.shard_id(guild_id, self.shard_count) in self.shard_ids
+
     async def connect_db(self) -> aiosqlite.Connection:
+        if self.db_pool.is_open:
+            return await self.db_pool.acquire()
         return await aiosqlite.connect(DATABASE_PATH)
 
     async def connect_calendar(self) -> aiosqlite.Connection:
+        if self.calendar_pool.is_open:
+            return await self.calendar_pool.acquire()
         return await aiosqlite.connect(CALENDAR_PATH)
 
-    async def _get_list_column(self, guild: discord.Guild, column: str, db: aiosqlite.Connection = None) -> List[int]:
+    async def load_guild_settings(self, db: aiosqlite.Connection = None):
+        """
+        Loads the settings of every guild into memory in a single query.
+        """
         my_db = db == None
         if my_db:
             db = await self.connect_db()
         try:
-            items_raw = (await (await db.execute(f"SELECT \"{column}\" FROM GUILD_SETTINGS WHERE GUILD_ID=?", (guild.id,))).fetchone())[0]
-            if items_raw == None:
-                items = []
-            else:
-                items = items_raw.split(",")
+            rows = await db.execute_fetchall(f"SELECT GUILD_ID, {', '.join(GuildSettings.COLUMNS)} FROM GUILD_SETTINGS")
+        finally:
+            if my_db:
+                await db.close()
+
+        self.guild_settings = {r[0]: GuildSettings.from_row(r[0], r[1:]) for r in rows}
+        self.logger.info(f"Loaded settings for {len(self.guild_settings)} guilds.")
+
+    async def get_guild_settings(self, guild: discord.Guild, db: aiosqlite.Connection = None) -> 'GuildSettings':
+        settings = self.guild_settings.get(guild.id)
+        if settings != None:
+            return settings
 
-            return items
+        my_db = db == None
+        if my_db:
+            db = await self.connect_db()
+        try:
+            row = await (await db.execute(f"SELECT {', '.join(GuildSettings.COLUMNS)} FROM GUILD_SETTINGS WHERE GUILD_ID=?", (guild.id,))).fetchone()
+        finally:
+            if my_db:
+                await db.close()
+
+        if row == None:
+            # Guild has not been registered yet; don't cache the defaults
+            return GuildSettings(guild.id)
+        settings = self.guild_settings[guild.id] = GuildSettings.from_row(guild.id, row)
+        return settings
+
+    async def set_guild_setting(self, guild: discord.Guild, column: str, value: Union[str, int, None], db: aiosqlite.Connection = None):
+        """
+        Writes a GUILD_SETTINGS column and updates the in-memory settings once the write is committed.
+        """
+        if column not in GuildSettings.COLUMNS:
+            raise ValueError(f"Unknown settings column '{column}'")
+
+        my_db = db == None
+        if my_db:
+            db = await self.connect_db()
+        try:
+            await db.execute(f"UPDATE GUILD_SETTINGS SET \"{column}\"=? WHERE GUILD_ID=?", (value, guild.id))
+            await db.commit()
         finally:
             if my_db:
                 await db.close()
 
+        (await self.get_guild_settings(guild)).apply(column, value)
+        # A staged plan may have been made from the old value
+        self.staged_plans.pop(guild.id, None)
+        if column in ('CALENDAR_GROUP', 'USE_CALENDAR'):
+            # The guild may now follow a calendar whose upcoming lockdown is within the planning lead time
+            self.dispatch('calendar_update')
+
+    async def _get_list_column(self, guild: discord.Guild, column: str, db: aiosqlite.Connection = None) -> List[str]:
+        return [str(x) for x in (await self.get_guild_settings(guild, db=db)).get(column)]
+
     async def _get_roles(self, guild: discord.Guild, column: str, db: aiosqlite.Connection = None) -> List[discord.Role]:
-        return [guild.get_role(int(x)) for x in (await self._get_list_column(guild, column, db=db)) if x.isnumeric()]
+        return [guild.get_role(x) for x in (await self.get_guild_settings(guild, db=db)).get(column)]
 
     async def get_target_roles(self, guild: discord.Guild, db: aiosqlite.Connection = None) -> List[discord.Role]:
         return await self._get_roles(guild, "TARGET_ROLES", db=db)
@@ -122,151 +281,324 @@ class CurfewBot(commands.Bot):
         return await self._get_roles(guild, "IGNORED_ROLES", db=db)
 
     async def get_ignored_channel_ids(self, guild: discord.Guild, db: aiosqlite.Connection = None) -> List[int]:
-        return [int(x) for x in (await self._get_list_column(guild, "IGNORED_CHANNELS", db=db)) if x.isnumeric()]
+        return list((await self.get_guild_settings(guild, db=db)).ignored_channels)
 
     async def get_ignored_channels(self, guild: discord.Guild, db: aiosqlite.Connection = None) -> List[discord.abc.GuildChannel]:
         return [guild.get_channel(x) for x in await self.get_ignored_channel_ids(guild, db=db)]
 
     async def get_ignore_overwrites_preference(self, guild: discord.Guild, db: aiosqlite.Connection = None) -> bool:
+        return (await self.get_guild_settings(guild, db=db)).ignore_neutral_overwrites
+
+    async def get_log_channel(self, guild: discord.Guild, db: aiosqlite.Connection = None) -> Optional[discord.TextChannel]:
+        channel_id = (await self.get_guild_settings(guild, db=db)).log_channel
+        
+        channel = None
+        if channel_id != None:
+            channel = guild.get_channel(channel_id)
+        return channel
+
+    async def get_logs_enabled(self, guild: discord.Guild, db: aiosqlite.Connection = None) -> bool:
+        return (await self.get_guild_settings(guild, db=db)).logs_enabled
+
+    async def get_next_calendar_task(self, group: str, cal: aiosqlite.Connection = None) -> Optional[Tuple[float, str]]:
+        """
+        Returns the (scheduled timestamp, action) of the calendar group's next pending task, or None if it has none.
+        """
+        my_cal = cal == None
+        if my_cal:
+            cal = await self.connect_calendar()
+        try:
+            return await recurrence.next_task(cal, group, datetime.datetime.now().timestamp(), self.config.get('Scheduler', {}).get('schedule_lookahead_days', 120), cluster_id=self.cluster_id)
+        finally:
+            if my_cal:
+                await cal.close()
+
+    def lockdown_config(self, key: str, default):
+        return self.config.get('Lockdown', {}).get(key, default)
+
+    def getColor(self, key: str) -> int:
+        return int('0x' + self.config['Colors'][key], base=16)
+
+    def getPlaceholder(self, key: str) -> str:
+        return self.config['Bot']['placeholders'][key]
+
+    
+    async def update_guild_timestamp(self, guild: discord.Guild, column: str, db: aiosqlite.Connection = None):
         my_db = db == None
         if my_db:
             db = await self.connect_db()
         try:
-            return bool((await (await db.execute("SELECT IGNORE_NEUTRAL_OVERWRITES FROM GUILD_SETTINGS WHERE GUILD_ID=?", (guild.id,))).fetchone())[0])
+            # User-entered input should not be able to reach here in any form
+            await db.execute(f"UPDATE STATE_INFO SET \"{column}\"=? WHERE GUILD_ID=?", (datetime.datetime.now().timestamp(), guild.id))
+            await db.commit()
         finally:
             if my_db:
                 await db.close()
 
-    async def get_log_channel(self, guild: discord.Guild, db: aiosqlite.Connection = None) -> Optional[discord.TextChannel]:
+    async def plan_guild_lockdown(self, guild: discord.Guild) -> LockdownPlan:
+        """
+        Plans a lockdown of the guild from its stored settings without changing anything.
+        """
+        return plan_lockdown(guild, await self.get_target_roles(guild), await self.get_ignored_roles(guild), await self.get_ignored_channel_ids(guild), await self.get_ignore_overwrites_preference(guild))
+
+    async def stage_lockdown_plan(self, guild: discord.Guild) -> LockdownPlan:
+        """
+        Plans a lockdown of the guild ahead of time, so that locking it down later with the same settings only has to make the API calls.
+        """
+        plan = self.staged_plans[guild.id] = await self.plan_guild_lockdown(guild)
+        return plan
+
+    def take_staged_plan(self, guild: discord.Guild, target_roles: List[discord.Role], ignored_roles: List[discord.Role], whitelisted_channel_ids: List[int], ignore_neutral_overwrites: bool) -> Optional[LockdownPlan]:
+        """
+        Removes and returns the guild's staged plan, if it was made with the given arguments and is still current.
+        """
+        plan = self.staged_plans.pop(guild.id, None)
+        if plan == None or not plan.matches(guild, target_roles, ignored_roles, whitelisted_channel_ids, ignore_neutral_overwrites):
+            return None
+        return plan
+
+    async def load_locked_guilds(self, db: aiosqlite.Connection = None):
+        """
+        Finds the guilds of this cluster that are locked down, in a single query. What enforcing their lockdowns needs is loaded for each when first needed.
+        """
         my_db = db == None
         if my_db:
             db = await self.connect_db()
         try:
-            channel_id = (await (await db.execute("SELECT LOG_CHANNEL FROM GUILD_SETTINGS WHERE GUILD_ID=?", (guild.id,))).fetchone())[0]
+            rows = await db.execute_fetchall("SELECT GUILD_ID FROM STATE_INFO WHERE LAST_LOCKDOWN IS NOT NULL AND (LAST_REOPEN IS NULL OR LAST_REOPEN < LAST_LOCKDOWN)")
         finally:
             if my_db:
                 await db.close()
-        
-        channel = None
-        if channel_id != None:
-            channel = guild.get_channel(channel_id)
-        return channel
 
-    async def get_logs_enabled(self, guild: discord.Guild, db: aiosqlite.Connection = None) -> bool:
+        self.locked_guilds = {r[0]: None for r in rows if self.owns_guild(r[0])}
+        self.logger.info(f"{len(self.locked_guilds)} guilds are locked down.")
+
+    async def get_locked_guild(self, guild: discord.Guild, db: aiosqlite.Connection = None) -> Optional[LockedGuild]:
+        """
+        What is needed to keep the guild locked, if it is locked down and lockdowns are enforced, loading it from the guild's last lockdown the first time.
+        """
+        if not self.lockdown_config('enforce_while_locked', True) or guild.id not in self.locked_guilds:
+            return None
+        state = self.locked_guilds[guild.id]
+        if state != None:
+            state.bind(guild)
+            return state
+
         my_db = db == None
         if my_db:
             db = await self.connect_db()
         try:
-            enabled = (await (await db.execute("SELECT LOGS_ENABLED FROM GUILD_SETTINGS WHERE GUILD_ID=?", (guild.id,))).fetchone())[0]
+            operation_id = await history.last_report_operation(db, guild.id, 'lockdown')
+            operation = await history.load_operation(db, operation_id) if operation_id != None else None
+            if operation == None or operation[0] != 'completed':
+                # Nothing to enforce: the lockdown is not finished (it is tracked again once it is) or did not succeed
+                self.locked_guilds.pop(guild.id, None)
+                return None
+            report = await history.load_report(db, operation_id)
         finally:
             if my_db:
                 await db.close()
-        
-        return bool(enabled)
-
-    def getColor(self, key: str) -> int:
-        return int('0x' + self.config['Colors'][key], base=16)
 
-    def getPlaceholder(self, key: str) -> str:
-        return self.config['Bot']['placeholders'][key]
-
-    
-    async def update_guild_timestamp(self, guild: discord.Guild, column: str, db: aiosqlite.Connection = None):
+        data = operation[1]
+        if 'target_roles' in data:
+            rules = LockdownRules(guild, [guild.get_role(x) for x in data['target_roles']], [guild.get_role(x) for x in data['ignored_roles']], data['ignore_neutral_overwrites'])
+            whitelisted_channel_ids = data['whitelisted_channel_ids']
+        else:
+            # Lockdowns from before the journal did not keep their arguments; the current settings are the best guess
+            rules = LockdownRules(guild, await self.get_target_roles(guild), await self.get_ignored_roles(guild), await self.get_ignore_overwrites_preference(guild))
+            whitelisted_channel_ids = await self.get_ignored_channel_ids(guild)
+        if guild.id not in self.locked_guilds or self.locked_guilds[guild.id] != None:
+            # Reopened, or loaded by another event, in the meantime
+            return self.locked_guilds.get(guild.id)
+        state = self.locked_guilds[guild.id] = LockedGuild(operation_id, rules, report, whitelisted_channel_ids)
+        return state
+
+    async def release_locked_guild(self, guild: discord.Guild) -> Optional[LockedGuild]:
+        """
+        Stops keeping the guild locked, e.g. because it is being reopened or locked down again. Waits for the change being enforced, if there is one.
+        """
+        state = self.locked_guilds.pop(guild.id, None)
+        if state != None:
+            async with state.lock:
+                pass
+        return state
+
+    async def append_lockdown_report(self, state: LockedGuild, part: Optional[dict], db: aiosqlite.Connection = None):
+        if part == None:
+            return
         my_db = db == None
         if my_db:
             db = await self.connect_db()
         try:
-            # User-entered input should not be able to reach here in any form
-            await db.execute(f"UPDATE STATE_INFO SET \"{column}\"=? WHERE GUILD_ID=?", (datetime.datetime.now().timestamp(), guild.id))
+            await history.append_report(db, state.operation_id, part)
             await db.commit()
         finally:
             if my_db:
                 await db.close()
 
-    async def server_lockdown(self, guild: discord.Guild, target_roles: List[discord.Role], ignored_roles: List[discord.Role], whitelisted_channel_ids: List[int], ignore_neutral_overwrites: bool, db: aiosqlite.Connection = None, meta: dict = {}) -> dict:
+    async def enforce_channel_lockdown(self, channel: discord.abc.GuildChannel) -> bool:
+        """
+        Locks a channel that was created or changed while its guild is locked down, and adds it to the lockdown's report so that reopening restores it too.
+        Returns whether the channel had to be locked.
+        """
+        state = await self.get_locked_guild(channel.guild)
+        if state == None:
+            return False
+        async with state.lock:
+            if self.locked_guilds.get(channel.guild.id) is not state:
+                return False
+            edit = state.plan_channel(channel)
+            if edit == None:
+                # Already locked; if only because it took the overwrites of a locked category, reopening has to open it too
+                await self.append_lockdown_report(state, state.record_inherited(channel))
+                return False
+
+            timer = metrics.OperationTimer('enforce')
+            try:
+                with timer.phase('channel_edits'):
+                    await apply_overwrite_changes(channel, edit.role_states, mode=self.lockdown_config('edit_mode', 'auto'))
+            except discord.errors.Forbidden:
+                self.logger.warning(f"Could not lock channel {channel.id} of locked down guild {channel.guild.id}.")
+                with timer.phase('db_writes'):
+                    await self.append_lockdown_report(state, state.record_failed_channel(channel.id))
+                timer.finish('failed')
+                return False
+            with timer.phase('db_writes'):
+                await self.append_lockdown_report(state, state.record_channel(edit))
+            timer.finish('completed')
+            self.logger.info(f"Locked channel {channel.id} of locked down guild {channel.guild.id} ({len(edit.changes)} overwrites).")
+            return True
+
+    async def enforce_role_lockdown(self, role: discord.Role) -> bool:
+        """
+        Takes "View Channels" from a target role (or the default role) that got it back while its guild is locked down, and adds the role to the lockdown's report.
+        Returns whether the role had to be locked.
+        """
+        state = await self.get_locked_guild(role.guild)
+        if state == None:
+            return False
+        async with state.lock:
+            if self.locked_guilds.get(role.guild.id) is not state:
+                return False
+            edit = state.plan_role(role)
+            if edit == None:
+                return False
+
+            timer = metrics.OperationTimer('enforce')
+            try:
+                with timer.phase('role_edits'):
+                    await role.edit(permissions=edit.permissions)
+            except discord.errors.Forbidden:
+                self.logger.warning(f"Could not lock role {role.id} of locked down guild {role.guild.id}.")
+                with timer.phase('db_writes'):
+                    await self.append_lockdown_report(state, state.record_role(role.id, False))
+                timer.finish('failed')
+                return False
+            with timer.phase('db_writes'):
+                await self.append_lockdown_report(state, state.record_role(role.id, True))
+            timer.finish('completed')
+            self.logger.info(f"Locked role {role.id} of locked down guild {role.guild.id}.")
+            return True
+
+    async def claim_unfinished_operation(self, guild: discord.Guild, action: str) -> Optional[OperationJournal]:
+        """
+        Returns the guild's interrupted operation of the given action, unless it is already being resumed, and marks it as being resumed.
+        """
+        for journal in await OperationJournal.load_unfinished(self.connect_db, guild_id=guild.id, action=action):
+            if journal.operation_id not in self.active_operations:
+                self.active_operations.add(journal.operation_id)
+                return journal
+        return None
+
+    async def resume_operations(self):
+        """
+        Finishes the lockdowns and reopens that were interrupted by the bot stopping, from their last checkpoint.
+        """
+        resumed = []
+        for journal in await OperationJournal.load_unfinished(self.connect_db):
+            if journal.operation_id in self.active_operations or not self.owns_guild(journal.guild_id):
+                # Operations of other clusters' guilds are theirs to resume
+                continue
+            guild = self.get_guild(journal.guild_id)
+            if guild == None:
+                self.logger.warning(f"Abandoning interrupted {journal.action} of guild {journal.guild_id}, which the bot is no longer in.")
+                await journal.finish('abandoned')
+                continue
+            self.active_operations.add(journal.operation_id)
+            if journal.action == 'lockdown':
+                resumed.append(self.server_lockdown(guild, *journal.lockdown_arguments(guild), meta=journal.input.get('meta', {}), journal=journal))
+            else:
+                resumed.append(self.server_reopen(guild, journal.input['lockdown_report'], meta=journal.input.get('meta', {}), journal=journal))
+        # Failures are logged by server_lockdown()/server_reopen() themselves
+        await asyncio.gather(*resumed, return_exceptions=True)
+
+    async def server_lockdown(self, guild: discord.Guild, target_roles: List[discord.Role], ignored_roles: List[discord.Role], whitelisted_channel_ids: List[int], ignore_neutral_overwrites: bool, db: aiosqlite.Connection = None, meta: dict = {}, journal: OperationJournal = None) -> dict:
         # Given the target server and the roles provided from the owner's config, lock down the server.
         # Input validation will be handled by the commands. Do not worry about it here, for the most part.
 
+        # Every record logged while the guild is locked down carries its ID, and the operation's once there is one (see logpipeline)
+        log_fields = logpipeline.set_log_fields(guild_id=guild.id, action='lockdown')
         self.logger.info(f"Locking down guild {guild.id}.")
+        # Channels are locked by the lockdown itself from here on, and by the new report's state after it
+        await self.release_locked_guild(guild)
         
         # Create report dict
-        report = {
+        report = Report({
             'affected_channels': {}, # Each channel's ID will become a key (as a string) in this nested dict and the value will be a list of lists of the IDs of all affected roles and their previous permission states
             'affected_roles': [], # List of IDs of affected roles from target_roles plus the default role
             'no_perms_channels': [], # List of IDs of channels the bot has no permission to edit
             'no_perms_roles': [], # List of IDs of roles the bot has no permission to edit
             'meta': {'provided': meta}
-        } # Since the default role has an ID, it will be included in the reports without special accommodation
+        }) # Since the default role has an ID, it will be included in the reports without special accommodation
 
         success = False
+        interrupted = False
         try:
-            # Iterate over each unwhitelisted channel in the server:
-            channels = [x for x in guild.channels if x.id not in whitelisted_channel_ids]
-            for ch in channels:
-                
-                previous_state = None
-
-                if ch.id not in report['affected_channels'].keys():
-                    report['affected_channels'][str(ch.id)] = []
-
-                new_overwrites = ch.overwrites.copy()
-
-                # If no overwrite present for the default role, create one
-                if guild.default_role not in new_overwrites.keys():
-                    new_overwrites[guild.default_role] = discord.PermissionOverwrite(view_channel=False)
-                    report['affected_channels'][str(ch.id)].append([guild.default_role.id, STATE_MAP[None]])
-
-                # Iterate over each role in the channel's overwrites:
-                for r in new_overwrites.keys():
-                    # Skip user-specific overwrites
-                    if not isinstance(r, discord.Role):
-                        continue
-
-                    # If the role is not in ignored_roles, set "View Channel" to False if not already disabled
-                    if (r not in ignored_roles) and (r in target_roles or r == guild.default_role or (new_overwrites[r].view_channel != False and not ignore_neutral_overwrites) or (new_overwrites[r].view_channel == True and ignore_neutral_overwrites)):
-                        previous_state = STATE_MAP[new_overwrites[r].view_channel]
-                        new_overwrites[r].view_channel = False
-
-                        # Record all affected roles in the report dict
-                        report['affected_channels'][str(ch.id)].append([r.id, previous_state])
-
-                if len(report['affected_channels'][str(ch.id)]) > 0:
-                    # Update channel permissions with new overwrites
-                    try:
-                        await ch.edit(overwrites=new_overwrites)
-                    except discord.errors.Forbidden:
-                        # Record error in report, continue to next iteration
-                        report['no_perms_channels'].append(ch.id)
-                        continue
-
-                    # Delay to prevent ratelimiting
-                    await asyncio.sleep(len(channels) / 50)
-                
-                else:
-                    report['affected_channels'].pop(str(ch.id))
-
-            # Iterate over the given roles + the server default role:
-            roles = target_roles + [guild.default_role]
-            for r in roles:
-                # Set "View Channels" to False if not already disabled
-                if r.permissions.view_channel != False:
-                    new_permissions = r.permissions
-                    new_permissions.update(view_channel=False)
-                    try:
-                        await r.edit(permissions=new_permissions)
-                    except discord.errors.Forbidden:
-                        # Record error in report, continue to next iteration
-                        report['no_perms_roles'].append(r.id)
-                        continue
-
-                    # Record all affected roles in the report dict
-                    report['affected_roles'].append(r.id)
-
-                    # Delay to prevent ratelimiting
-                    await asyncio.sleep(len(roles) / 50)
+            if journal == None:
+                # An interrupted lockdown of this guild is finished rather than started over, since its channels are already partly locked
+                journal = await self.claim_unfinished_operation(guild, 'lockdown')
+                if journal != None:
+                    target_roles, ignored_roles, whitelisted_channel_ids, ignore_neutral_overwrites = journal.lockdown_arguments(guild)
+            if journal != None:
+                self.logger.info(f"Resuming interrupted lockdown of guild {guild.id} ({len(journal.steps)} edits already done).")
+                report['meta']['provided'] = journal.input.get('meta', {})
+                report['meta']['resumed_operation'] = journal.operation_id
+                journal.replay(report)
+            else:
+                journal = await OperationJournal.begin(self.connect_db, guild.id, 'lockdown', {
+                    'target_roles': [x.id for x in target_roles if x != None],
+                    'ignored_roles': [x.id for x in ignored_roles if x != None],
+                    'whitelisted_channel_ids': list(whitelisted_channel_ids),
+                    'ignore_neutral_overwrites': ignore_neutral_overwrites,
+                    'meta': meta
+                })
+                self.active_operations.add(journal.operation_id)
+            logpipeline.set_log_fields(operation_id=journal.operation_id)
+
+            with journal.timer.phase('plan'):
+                plan = self.take_staged_plan(guild, target_roles, ignored_roles, whitelisted_channel_ids, ignore_neutral_overwrites) if not journal.resumed else None
+                staged = plan != None
+                saved_plan = journal.step_data('plan') if journal.resumed else None
+                if saved_plan != None:
+                    # The plan the lockdown started with: edits that were in flight when it was interrupted may have been made in part, so the current states are not the previous ones
+                    plan = LockdownPlan.from_dict(guild, saved_plan, target_roles, ignored_roles, whitelisted_channel_ids, ignore_neutral_overwrites)
+                elif not staged:
+                    plan = plan_lockdown(guild, target_roles, ignored_roles, whitelisted_channel_ids, ignore_neutral_overwrites)
+            if journal.resumed:
+                # Only what was not done before the interruption; the previous states of finished edits come from the journal
+                plan = plan.remaining(journal.target_ids('affected_channels'), journal.target_ids('no_perms_channels'), journal.target_ids('affected_roles', 'no_perms_roles'))
+            else:
+                await journal.record('plan', guild.id, plan.to_dict())
+            self.logger.info(f"{'Staged l' if staged else 'L'}ockdown plan for guild {guild.id}: {len(plan.channel_edits)} channel edits, {len(plan.role_edits)} role edits, ~{plan.estimate_calls(self.lockdown_config('edit_mode', 'auto'))} API calls.")
+            await execute_lockdown_plan(plan, report, edit_mode=self.lockdown_config('edit_mode', 'auto'), journal=journal, timer=journal.timer, concurrency=self.lockdown_config('edit_concurrency', 8))
+        except asyncio.CancelledError:
+            # The journal is left running, so the lockdown is resumed on the next start
+            interrupted = True
+            self.logger.warning(f"Lockdown of guild {guild.id} was interrupted.")
+            raise
         except:
-            self.logger.error(f"Lockdown of guild {guild.id} (may have) failed. Traceback below.")
-            self.logger.error(traceback.format_exc())
+            # A single record, so the traceback stays together in the log file
+            self.logger.exception(f"Lockdown of guild {guild.id} (may have) failed.")
             raise
         else:
             success = True
@@ -274,7 +606,8 @@ class CurfewBot(commands.Bot):
         finally:
             # Broadcast event
             if success:
-                self.dispatch('guild_lockdown', guild, report)
+                with journal.timer.phase('dispatch'):
+                    self.dispatch('guild_lockdown', guild, report)
 
             # Return report dict
             report['meta']['timestamp'] = datetime.datetime.now().timestamp()
@@ -288,102 +621,78 @@ class CurfewBot(commands.Bot):
                     db = await self.connect_db()
                 try:
                     await self.update_guild_timestamp(guild, 'LAST_LOCKDOWN', db=db)
-                    await db.execute("UPDATE STATE_INFO SET LAST_LOCKDOWN_REPORT=? WHERE GUILD_ID=?", (json.dumps(report), guild.id))
-                    await db.commit()
+                    # The report is stored in the history along with closing the journal, so a crash before then still resumes the lockdown
+                    if journal != None:
+                        if interrupted:
+                            # Kept so the partial lockdown can still be reopened before it is resumed
+                            await journal.save_report(report)
+                        else:
+                            await journal.finish('completed' if success else 'failed', report=report)
+                            if success:
+                                # A lockdown that failed partway is not enforced; its report is still there to reopen from
+                                self.locked_guilds[guild.id] = LockedGuild(journal.operation_id, LockdownRules(guild, target_roles, ignored_roles, ignore_neutral_overwrites), report, whitelisted_channel_ids)
                 finally:
                     if my_db:
                         await db.close()
+                    if journal != None:
+                        self.active_operations.discard(journal.operation_id)
+                        journal.timer.finish('completed' if success else 'interrupted' if interrupted else 'failed')
+                    logpipeline.LOG_FIELDS.reset(log_fields)
 
-    async def server_reopen(self, guild: discord.Guild, lockdown_report: dict, db: aiosqlite.Connection = None, meta: dict = {}) -> dict:
+    async def server_reopen(self, guild: discord.Guild, lockdown_report: dict, db: aiosqlite.Connection = None, meta: dict = {}, journal: OperationJournal = None) -> dict:
+        log_fields = logpipeline.set_log_fields(guild_id=guild.id, action='reopen')
         self.logger.info(f"Reopening guild {guild.id}.")
+        locked = await self.release_locked_guild(guild)
         
         # Create report dict
-        report = {
+        report = Report({
             "missing_channels": [],
             "missing_roles": [],
             "missing_overwrites": {}, # Keys, stringified channel IDs. Values, lists of role IDs.
             "no_perms_roles": [],
             "no_perms_channels": [],
+            "reopened_channels": {}, # Keys, stringified channel IDs. Values, lists of [role ID, state before reopening] for each restored overwrite.
+            "unchanged_channels": [], # Channels whose overwrites were already as before the lockdown
+            "reopened_roles": [],
+            "unchanged_roles": [], # Roles that could already view channels
             "meta": {'provided': meta}
-        }
+        })
         
         success = False
+        interrupted = False
 
         try:
-            # Iterate over each affected channel in lockdown_report:
-            for k in lockdown_report['affected_channels'].keys():
-                # Get the channel from the channel ID
-                channel = guild.get_channel(int(k))
-                # If channel not found, store the problem in the report and continue to next iteration
-                if channel == None:
-                    report['missing_channels'].append(int(k))
-                    continue
-                
-                new_overwrites = channel.overwrites.copy()
-                # Iterate over each list in the list for the channel:
-                for ov in lockdown_report['affected_channels'][k]:
-                    # Get the role ID from the first element and try to get the role
-                    role = guild.get_role(ov[0])
-                    # If role not found, store the problem in the report and continue to next iteration
-                    if role == None:
-                        report['missing_roles'].append(ov[0])
-                        continue
-                    # If role is no longer in the overwrites for the channel, store the problem in the report and continue to next iteration
-                    if role not in new_overwrites.keys():
-                        if k not in report['missing_overwrites'].keys():
-                            report['missing_overwrites'][k] = []
-                        if ov[0] not in report['missing_overwrites'][k]:
-                            report['missing_overwrites'][k].append(ov[0])
-                        continue
-
-                    # Edit the overwrite for the role in that channel to match the original permission state specified in lockdown_report
-                    previous_state = new_overwrites[role].view_channel
-                    if previous_state != STATE_MAP_REVERSE[ov[1]]:
-                        new_overwrites[role].view_channel = STATE_MAP_REVERSE[ov[1]]
-                    
-                    # Take note of the change in the report and include the original state from before reopening
-                    #TODO
-                
-                # Update channel
-                try:
-                    await channel.edit(overwrites=new_overwrites)
-                except discord.errors.Forbidden:
-                    # Record error in report, continue to next iteration
-                    report['no_perms_channels'].append(channel.id)
-                    continue
-
-                # Delay to prevent ratelimiting
-                await asyncio.sleep(len(lockdown_report['affected_channels']) / 50)
-                
-                # If the channel was affected, take note of the change in the report
-                #TODO
-
-            # Iterate over each affected role in lockdown_report:
-            for r_id in lockdown_report['affected_roles']:
-                # Get the role from the role ID
-                role = guild.get_role(r_id)
-                # If role not found, store the problem in the report and continue to next iteration
-                if role == None:
-                    report['missing_roles'].append(r_id)
-                    continue
-
-                # Edit the role so that "View channels" permission is enabled (lockdown_report would only have it stored if it was previously enabled)
-                new_permissions = role.permissions
-                new_permissions.update(view_channel=True)
-                try:
-                    await role.edit(permissions=new_permissions)
-                except discord.errors.Forbidden:
-                    # Record error in report, continue to next iteration
-                    report['no_perms_roles'].append(role.id)
-                    continue
-                # Take note of the change in the report
-                #TODO
-
-                # Delay to prevent ratelimiting
-                await asyncio.sleep(len(lockdown_report['affected_roles']) / 50)
+            if journal == None:
+                journal = await self.claim_unfinished_operation(guild, 'reopen')
+                if journal != None:
+                    lockdown_report = journal.input['lockdown_report']
+            if journal != None:
+                self.logger.info(f"Resuming interrupted reopening of guild {guild.id} ({len(journal.steps)} steps already done).")
+                report['meta']['provided'] = journal.input.get('meta', {})
+                report['meta']['resumed_operation'] = journal.operation_id
+                journal.replay(report)
+            else:
+                if locked != None:
+                    # Channels and roles locked since the report was loaded
+                    locked.merge_into(lockdown_report)
+                journal = await OperationJournal.begin(self.connect_db, guild.id, 'reopen', {'lockdown_report': lockdown_report, 'meta': meta})
+                self.active_operations.add(journal.operation_id)
+            logpipeline.set_log_fields(operation_id=journal.operation_id)
+            done_channel_ids = journal.target_ids('reopened_channels', 'unchanged_channels', 'missing_channels', 'no_perms_channels')
+            done_role_ids = journal.target_ids('reopened_roles', 'unchanged_roles', 'no_perms_roles')
+
+            with journal.timer.phase('plan'):
+                plan = plan_reopen(guild, lockdown_report, done_channel_ids, done_role_ids)
+            self.logger.info(f"Reopen plan for guild {guild.id}: {sum(1 for x in plan.channel_edits if len(x.role_states) > 0)} of {len(plan.channel_edits)} channels and up to {len(plan.role_ids)} roles to restore, ~{plan.estimate_calls(self.lockdown_config('edit_mode', 'auto'))} API calls.")
+            await execute_reopen_plan(plan, report, edit_mode=self.lockdown_config('edit_mode', 'auto'), journal=journal, timer=journal.timer, concurrency=self.lockdown_config('edit_concurrency', 8))
+        except asyncio.CancelledError:
+            # The journal is left running, so the reopening is resumed on the next start
+            interrupted = True
+            self.logger.warning(f"Reopening of guild {guild.id} was interrupted.")
+            raise
         except:
-            self.logger.error(f"Reopening of guild {guild.id} (may have) failed. Traceback below.")
-            self.logger.error(traceback.format_exc())
+            # A single record, so the traceback stays together in the log file
+            self.logger.exception(f"Reopening of guild {guild.id} (may have) failed.")
             raise
         else:
             success = True
@@ -397,7 +706,8 @@ class CurfewBot(commands.Bot):
 
             # Broadcast event
             if success:
-                self.dispatch('guild_reopen', guild, report, lockdown_report)
+                with journal.timer.phase('dispatch'):
+                    self.dispatch('guild_reopen', guild, report, lockdown_report)
 
             try:
                 # Return report dict
@@ -409,11 +719,53 @@ class CurfewBot(commands.Bot):
                     db = await self.connect_db()
                 try:
                     await self.update_guild_timestamp(guild, 'LAST_REOPEN', db=db)
+                    if journal != None and not interrupted:
+                        await journal.finish('completed' if success else 'failed', report=report)
                 finally:
                     if my_db:
                         await db.close()
+                    if journal != None:
+                        self.active_operations.discard(journal.operation_id)
+                        journal.timer.finish('completed' if success else 'interrupted' if interrupted else 'failed')
+                    logpipeline.LOG_FIELDS.reset(log_fields)
+
+    async def report_file(self, report: dict, filename: str) -> discord.File:
+        """
+        The report as an attachment, gzip-compressed if it is larger than configured.
+        """
+        return await reports.to_file(report, filename, compress_over=int(self.config.get('Reports', {}).get('compress_attachments_over_kib', 256) * 1024))
+
+    async def get_last_lockdown_report(self, guild: discord.Guild, db: aiosqlite.Connection = None) -> Optional[dict]:
+        """
+        Loads the guild's most recent lockdown report from the history, or returns None if it has none.
+        """
+        my_db = db == None
+        if my_db:
+            db = await self.connect_db()
+        try:
+            return await history.load_last_report(db, guild.id, 'lockdown')
+        finally:
+            if my_db:
+                await db.close()
 
-    async def update_guilds(self, db: aiosqlite.Connection = None):
+    async def prune_history(self, db: aiosqlite.Connection = None) -> int:
+        """
+        Applies the configured retention policy to the lockdown history.
+        """
+        history_config = self.config.get('History', {})
+        my_db = db == None
+        if my_db:
+            db = await self.connect_db()
+        try:
+            return await history.prune_history(db, history_config.get('retention_days', 90), history_config.get('max_operations_per_guild', 50))
+        finally:
+            if my_db:
+                await db.close()
+
+    async def update_guilds(self, db: aiosqlite.Connection = None) -> int:
+        """
+        Adds the guilds the bot is in that the database does not know yet, in a single transaction. Returns how many were added.
+        """
         my_db = db == None
         if my_db:
             db = await self.connect_db()
@@ -421,38 +773,112 @@ class CurfewBot(commands.Bot):
         try:
             TARGET_TABLES = ["STATE_INFO", "GUILD_SETTINGS"]
             db_guilds = {k: {x[0] for x in await db.execute_fetchall(f"SELECT GUILD_ID FROM {k}")} for k in TARGET_TABLES}
-            for guild in self.guilds:
-                for k in db_guilds.keys():
-                    if guild.id not in db_guilds[k]:
-                        await db.execute(f"INSERT INTO {k} (GUILD_ID) VALUES (?)", (guild.id,))
-                        await db.commit()
+            missing = {k: [guild.id for guild in self.guilds if guild.id not in db_guilds[k]] for k in TARGET_TABLES}
+            if not any(missing.values()):
+                return 0
+            try:
+                for k, guild_ids in missing.items():
+                    # OR IGNORE, so a guild the schema rejects does not stop the others from being added
+                    await db.executemany(f"INSERT OR IGNORE INTO {k} (GUILD_ID) VALUES (?)", [(x,) for x in guild_ids])
+                added = {x[0] for x in await db.execute_fetchall("SELECT GUILD_ID FROM GUILD_SETTINGS")} - db_guilds["GUILD_SETTINGS"]
+                await db.commit()
+            except:
+                await db.rollback()
+                raise
+            for guild_id in added:
+                self.guild_settings[guild_id] = GuildSettings(guild_id)
+            rejected = set(missing["GUILD_SETTINGS"]) - added
+            if len(rejected) > 0:
+                self.logger.warning(f"Could not add guilds {', '.join(str(x) for x in sorted(rejected))} to the database.")
+            return len(added)
         finally:
             if my_db:
                 await db.close()
 
+    def command_tree_hash(self) -> str:
+        """
+        A hash of every application command as it would be registered with Discord.
+        """
+        tree = sorted(json.dumps([cmd.to_dict(), cmd.guild_ids], sort_keys=True) for cmd in self.pending_application_commands)
+        return hashlib.sha256(json.dumps([self.application_id, tree]).encode("utf8")).hexdigest()
+
+    def restore_command_ids(self, registered: List[list]) -> bool:
+        """
+        Maps the command IDs saved by the last sync back to the commands, which is what sync_commands() would otherwise do.
+        Returns False if any command is left without an ID.
+        py-cord has no public way to register a command under a known ID, so this fills in the same private map as sync_commands() does
+        (requirements.txt caps py-cord for this); without that map, the commands are synced instead.
+        """
+        if not isinstance(getattr(self, '_application_commands', None), dict):
+            return False
+        for command_id, name, command_type, guild_ids in registered:
+            cmd = discord.utils.find(lambda x: x.name == name and x.type == command_type and x.guild_ids == guild_ids, self.pending_application_commands)
+            if cmd == None:
+                return False
+            cmd.id = command_id
+            self._application_commands[command_id] = cmd
+        return all(cmd.id != None for cmd in self.pending_application_commands)
+
+    async def sync_commands_if_changed(self) -> bool:
+        """
+        Syncs the application commands with Discord, unless they have not changed since they were last synced. Returns whether they were synced.
+        Every shard's connect calls this, so it only ever checks once at a time, and not at all once this process has synced or restored the tree.
+        """
+        async with self.command_sync_lock:
+            digest = self.command_tree_hash()
+            if digest == self.synced_command_hash:
+                return False
+            synced = await self._sync_commands_if_changed(digest)
+            self.synced_command_hash = digest
+            return synced
+
+    async def _sync_commands_if_changed(self, digest: str) -> bool:
+        if not self.config['Bot'].get('always_sync_commands', False):
+            db = await self.connect_db()
+            try:
+                row = await (await db.execute("SELECT VALUE FROM BOT_STATE WHERE KEY='commands'")).fetchone()
+            finally:
+                await db.close()
+            if row != None:
+                state = json.loads(row[0])
+                if state['hash'] == digest and self.restore_command_ids(state['registered']):
+                    self.logger.info("Application commands are unchanged since they were last synced.")
+                    return False
+
+        await self.sync_commands()
+        registered = [[cmd.id, cmd.name, cmd.type, cmd.guild_ids] for cmd in self.application_commands]
+        db = await self.connect_db()
+        try:
+            await db.execute("INSERT OR REPLACE INTO BOT_STATE (KEY, VALUE) VALUES ('commands', ?)", (json.dumps({'hash': digest, 'registered': registered}),))
+            await db.commit()
+        finally:
+            await db.close()
+        self.logger.info(f"Synced {len(registered)} application commands.")
+        return True
+
 def getPrefix(bot: CurfewBot, message: discord.Message) -> str:
     """
     When a prefix-change command is implemented for external servers, this function will get the custom prefix
     """
     return bot.config['Bot']['default_prefix']
 
+def getGatewayOptions(config) -> dict:
+    """
+    CurfewBot keyword arguments for the configured gateway mode.
+    'lean' only subscribes to guild events (channels, roles and the guilds themselves), which is all slash commands, lockdowns and reopens use,
+    and caches no members, presences or messages. The bot's own member is cached either way, so guild.me still works.
+    'full' subscribes to everything and caches everything, as prefix commands (e.g. jishaku) need.
+    """
+    if config['Bot'].get('gateway_mode', 'lean') == 'full':
+        return {'intents': discord.Intents.all(), 'command_prefix': getPrefix}
+    return {
+        'intents': discord.Intents(guilds=True), 'command_prefix': getPrefix, 'prefix_commands': False,
+        'member_cache_flags': discord.MemberCacheFlags.none(), 'chunk_guilds_at_startup': False, 'max_messages': None
+    }
+
 
 def check_embed(embed: discord.Embed) -> bool:
     """
     Evaluates all limits of embeds and returns whether or not they are satisfied.
     """
     return len(embed) <= 6000 and len(embed.fields) <= 25 and all(len(field.title) <= 256 and len(field.value) <= 1024 for field in embed.fields) and len(embed.title) <= 256 and len(embed.description) <= 4096 and len(embed.footer) <= 2048
-
-def affected_channels_validator(d: dict) -> bool:
-    return isinstance(d, dict) and all(isinstance(x, str) and x.isnumeric() and len(x) == 18 for x in d.keys()) and all(isinstance(x, list) and all(isinstance(y, list) and len(y) == 2 and isinstance(y[0], int) and isinstance(y[1], int) and len(str(y[0])) == 18 and y[1] in range(-1, 2) for y in x) for x in d.values())
-
-def id_list_validator(d: dict) -> bool:
-    return isinstance(d, list) and all(isinstance(x, int) and len(str(x)) == 18 for x in d)
-
-LOCKDOWN_REPORT_SCHEMA = Schema({
-    "affected_channels": And(affected_channels_validator, dict),
-    "affected_roles": And(id_list_validator, list),
-    "no_perms_channels": And(id_list_validator, list),
-    "no_perms_roles": And(id_list_validator, list),
-    "meta": dict
-})
\ No newline at end of file